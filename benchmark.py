@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""Measure how classifying, parsing and expiring archives scales.
+
+For each size, a synthetic list of archive names is generated for a few
+jobs with realistic delta policies and naming patterns, and fed to a
+``TarsnapBackend`` which pretends tarsnap printed it. Each stage runs in
+a forked child process, so that its peak memory use can be measured:
+
+    classify  build the index of all archives, as get_backups() does
+    parse     turn the date part of each name into a datetime
+    expire    decide which archives of each job to keep
+
+Results can be saved as a baseline, and compared against a later run:
+
+    ./benchmark.py --save baseline.json
+    ./benchmark.py --compare baseline.json
+"""
+
+import sys
+from os import path
+sys.path.insert(0, path.join(path.dirname(__file__), 'src'))
+
+import os
+import gc
+import json
+import time
+import logging
+import resource
+import argparse
+import platform
+from datetime import datetime, timedelta
+
+from tarsnapper import expire
+from tarsnapper.config import Job, parse_deltas
+from tarsnapper.script import TarsnapBackend
+
+
+SIZES = [10, 1000, 100000, 1000000]
+
+STAGES = ['classify', 'parse', 'expire']
+
+# (name, strftime format of the names, dateformat of the job, deltas)
+JOBS = [
+    # The default format, parsed straight from the regex
+    ('db', '%Y%m%d-%H%M%S', None, '1h 1d 7d 30d 360d 18000d'),
+    # An explicit dateformat
+    ('www', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S', '1d 7d 30d'),
+    # A layout only python-dateutil understands
+    ('home', '%Y-%m-%d %H.%M', None, '1d 7d 30d 360d'),
+    # Shares its prefix with "home"
+    ('home-dev', '%Y%m%d-%H%M%S', None, '1d 7d'),
+]
+
+NOW = datetime(2016, 1, 1)
+
+
+class BenchmarkBackend(TarsnapBackend):
+    """Pretends that tarsnap printed ``archives``."""
+
+    def __init__(self, archives, *a, **kw):
+        TarsnapBackend.__init__(self, *a, **kw)
+        self.fake_archives = archives
+
+    def _exec_tarsnap(self, args):
+        return "\n".join(self.fake_archives)
+
+    def _stream_tarsnap(self, args):
+        for name in self.fake_archives:
+            yield name + '\n'
+
+
+def make_jobs():
+    return [Job(name=name, target='$name-$date', dateformat=dateformat,
+                deltas=parse_deltas(deltas))
+            for name, _, dateformat, deltas in JOBS]
+
+
+def make_archives(size):
+    """Return ``size`` archive names, spread evenly over the jobs, one
+    per hour for each job, going back from ``NOW``.
+    """
+    archives = []
+    for i in xrange(size):
+        name, fmt, _, _ = JOBS[i % len(JOBS)]
+        date = NOW - timedelta(hours=i // len(JOBS), seconds=i % 7)
+        archives.append('%s-%s' % (name, date.strftime(fmt)))
+    return archives
+
+
+def max_rss():
+    """The peak resident set size of this process, in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_stage(size, stage):
+    """Run ``stage`` for ``size`` archives, and return a dict with the
+    time it took, and by how much it raised the peak memory use.
+    """
+    log = logging.getLogger('benchmark')
+    log.setLevel(logging.CRITICAL)
+    jobs = make_jobs()
+    backend = BenchmarkBackend(make_archives(size), log, [])
+    backend.add_jobs(jobs)
+
+    # Prepare the input of the stage, without measuring it
+    if stage in ('parse', 'expire'):
+        backend.get_index()
+    if stage == 'expire':
+        backups = [backend.get_backups(job) for job in jobs]
+
+    gc.collect()
+    rss_before = max_rss()
+    start = time.time()
+    if stage == 'classify':
+        backend.get_index()
+    elif stage == 'parse':
+        for job in jobs:
+            backend.get_backups(job)
+    elif stage == 'expire':
+        for job, job_backups in zip(jobs, backups):
+            expire.expire(job_backups, job.deltas)
+    seconds = time.time() - start
+    return {'seconds': seconds, 'memory': max_rss() - rss_before}
+
+
+def run_forked(size, stage):
+    """Call ``run_stage()`` in a child process."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            result = json.dumps(run_stage(size, stage))
+        except BaseException, e:
+            result = json.dumps({'error': repr(e)})
+        os.write(write_fd, result)
+        os._exit(0)
+    os.close(write_fd)
+    output = ''
+    while True:
+        data = os.read(read_fd, 4096)
+        if not data:
+            break
+        output += data
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    result = json.loads(output)
+    if 'error' in result:
+        raise RuntimeError('%s with %d archives failed: %s' % (
+            stage, size, result['error']))
+    return result
+
+
+def format_memory(value):
+    return '%.1f MB' % (value / 1024.0 / 1024)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark classifying, parsing and expiring archives.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        metavar='N', help='numbers of archives to try '
+                        '(default: %s)' % ' '.join(map(str, SIZES)))
+    parser.add_argument('--stages', nargs='+', choices=STAGES,
+                        default=STAGES, help='stages to measure')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='how much slower than the baseline a stage '
+                             'may be before it is reported as a regression '
+                             '(default: 1.25)')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    regressions = []
+    print '%10s  %-8s  %10s  %10s  %s' % (
+        'archives', 'stage', 'time', 'memory', 'baseline')
+    for size in args.sizes:
+        for stage in args.stages:
+            result = run_forked(size, stage)
+            results.setdefault(str(size), {})[stage] = result
+            comparison = ''
+            previous = (baseline or {}).get(str(size), {}).get(stage)
+            if previous:
+                ratio = result['seconds'] / max(previous['seconds'], 1e-6)
+                comparison = '%.2fx' % ratio
+                # Ignore noise in very short timings
+                if ratio > args.tolerance and result['seconds'] > 0.05:
+                    comparison += ' REGRESSION'
+                    regressions.append((size, stage))
+            print '%10d  %-8s  %9.3fs  %10s  %s' % (
+                size, stage, result['seconds'],
+                format_memory(result['memory']), comparison)
+            sys.stdout.flush()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'time': time.time(), 'results': results}, f,
+                      indent=2, sort_keys=True)
+
+    if regressions:
+        print ""
+        print "Slower than the baseline: %s" % ", ".join(
+            '%s with %d archives' % (stage, size) for size, stage in regressions)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]) or 0)
@@ -44,6 +44,6 @@ setup(name='tarsnapper',
       license='BSD',
       packages=['tarsnapper'],
       package_dir = {'tarsnapper': 'src/tarsnapper'},
-      install_requires = ['argparse>=1.1', 'pyyaml>=3.09', 'python-dateutil>=2.4.0', 'pexpect>=3.1'],
+      install_requires = ['argparse>=1.1', 'pyyaml>=3.09', 'python-dateutil>=2.4.0', 'pexpect>=3.1', 'scandir>=1.5'],
       **kw
 )
@@ -4,20 +4,76 @@ import sys
 from os import path
 sys.path.insert(0, path.join(path.dirname(__file__), 'src'))
 
+import argparse
 from datetime import timedelta
 
-from tarsnapper.test import BackupSimulator
-from tarsnapper.config import parse_deltas
+from tarsnapper.test import BackupSimulator, FastSimulator
+from tarsnapper.config import parse_deltas, str_to_timedelta
+
+
+def format_micros(value):
+    """Format a number of microseconds as a short duration."""
+    seconds = value // 1000000
+    for unit, size in (('d', 86400), ('h', 3600), ('min', 60)):
+        if seconds >= size and seconds % size == 0:
+            return '%d%s' % (seconds // size, unit)
+    if seconds >= 86400:
+        return '%.1fd' % (seconds / 86400.0)
+    return '%ds' % seconds
+
+
+def simulate_fast(args):
+    """Simulate years of backups, and print statistics."""
+    s = FastSimulator(args.deltas, args.interval)
+    s.run(args.simulate, args.sample)
+
+    print "Number of backups over time:"
+    for now, count in s.counts:
+        print "  %8s  %d" % (format_micros(now), count)
+
+    print ""
+    print "Largest gap between backups, by age:"
+    for (lower, upper, expected), worst in zip(s.bands, s.worst_gaps):
+        print "  %8s - %-8s  expected %-8s  worst %s" % (
+            format_micros(lower), format_micros(upper),
+            format_micros(expected), format_micros(worst) if worst else '-')
+
+    print ""
+    if s.steady_mean is None:
+        print "The simulation did not reach a steady state; simulate " \
+              "for at least %s." % format_micros(s.deltas[-1])
+    else:
+        print "Steady state: %d to %d backups, %.1f on average" % (
+            s.steady_min, s.steady_max, s.steady_mean)
 
 
 def main(argv):
-    if '-h' in argv:
-        print "./simulate.py [backup-timestamps]"
-        return 1
+    parser = argparse.ArgumentParser(
+        usage='./simulate.py [options] [backup-timestamps]')
+    parser.add_argument('timestamps', nargs='*',
+                        help='expire the backups with the given timestamps')
+    parser.add_argument('--deltas', type=parse_deltas, default='1d 7d 30d',
+                        help='generation deltas (default: "1d 7d 30d")')
+    parser.add_argument('--simulate', metavar='DURATION',
+                        type=str_to_timedelta,
+                        help='quickly simulate making backups for DURATION, '
+                             'and print statistics')
+    parser.add_argument('--interval', metavar='DELTA', type=str_to_timedelta,
+                        default=timedelta(hours=1),
+                        help='time between backups when simulating '
+                             '(default: 1h)')
+    parser.add_argument('--sample', metavar='DELTA', type=str_to_timedelta,
+                        default=timedelta(days=30),
+                        help='how often the number of backups is printed '
+                             '(default: 30d)')
+    args = parser.parse_args(argv)
+
+    if args.simulate:
+        simulate_fast(args)
 
     # Do some default simulation
-    if not argv:
-        s = BackupSimulator(parse_deltas('1d 7d 30d'))
+    elif not args.timestamps:
+        s = BackupSimulator(args.deltas)
 
         until = s.now + timedelta(days=17)
         while s.now <= until:
@@ -29,8 +85,8 @@ def main(argv):
 
     # Simulate a backup with the timestamps given
     else:
-        s = BackupSimulator(parse_deltas('1d 7d 30d'))
-        s.add([d for d in argv])
+        s = BackupSimulator(args.deltas)
+        s.add([d for d in args.timestamps])
         deleted, _ = s.expire()
 
         print "Deleted backups:"
@@ -44,4 +100,4 @@ def main(argv):
 
 
 if __name__ == '__main__':
-    sys.exit(main(sys.argv[1:]) or 0)
\ No newline at end of file
+    sys.exit(main(sys.argv[1:]) or 0)
@@ -0,0 +1,186 @@
+"""Keep the list of archives returned by "tarsnap --list-archives" on
+disk, so that subsequent runs can skip querying the server.
+
+The cache is a plain text file; the first line is a header containing
+the time the list was queried, followed by one line per archive, as
+printed by tarsnap.
+"""
+
+import os
+from os import path
+import time
+import hashlib
+import tempfile
+
+
+__all__ = ('ArchiveCache', 'cache_filename',)
+
+
+# The tarsnap options which determine which set of archives we are
+# looking at, and thus make up the cache key.
+KEY_OPTIONS = ('keyfile', 'cachedir', 'configfile')
+
+
+def cache_filename(directory, options, creation_time=False,
+                   prefix='archives'):
+    """Return the filename of the archive cache in ``directory`` for a
+    tarsnap run using the given ``options`` (a list of key value pairs,
+    as passed to ``TarsnapBackend``).
+
+    A list including the ``creation_time`` of each archive is stored
+    separately. Other files kept per set of archives can use a
+    different ``prefix``.
+    """
+    key = ['creation-time'] if creation_time else []
+    for option in options:
+        if option[0] in KEY_OPTIONS:
+            key.append('%s=%s' % (option[0], path.abspath(option[1])
+                                  if len(option) > 1 else ''))
+    digest = hashlib.sha1("\n".join(sorted(key))).hexdigest()[:16]
+    return path.join(directory, '%s-%s' % (prefix, digest))
+
+
+class ArchiveCache(object):
+    """A list of archives, stored in ``filename``, which is considered
+    valid for ``ttl`` seconds after it has been queried.
+    """
+
+    HEADER = '# tarsnapper archive list'
+
+    def __init__(self, filename, ttl=None, log=None):
+        self.filename = filename
+        self.ttl = ttl
+        self.log = log
+
+    def _warn(self, message):
+        if self.log:
+            self.log.warning('Archive cache %s: %s' % (self.filename, message))
+
+    def _read_header(self, f):
+        """Return the time the cached list was queried, or ``None`` if
+        the file is not a valid cache.
+        """
+        header = f.readline().rstrip('\n')
+        if not header.startswith(self.HEADER + ' '):
+            return None
+        try:
+            return float(header[len(self.HEADER) + 1:])
+        except ValueError:
+            return None
+
+    def iter(self):
+        """Return an iterator over the cached archives, or ``None`` if
+        there is no valid cache.
+        """
+        try:
+            f = open(self.filename, 'rb')
+        except IOError:
+            return None
+        try:
+            queried = self._read_header(f)
+        except EnvironmentError:
+            queried = None
+        if queried is None:
+            f.close()
+            self._warn('ignoring invalid file')
+            return None
+        if self.ttl is not None and time.time() - queried > self.ttl:
+            f.close()
+            return None
+        return self._iter_lines(f)
+
+    def _iter_lines(self, f):
+        try:
+            for line in f:
+                yield line.rstrip('\n')
+        finally:
+            f.close()
+
+    def load(self):
+        """Return the list of cached archives, or ``None`` if there is
+        no valid cache.
+        """
+        archives = self.iter()
+        return None if archives is None else list(archives)
+
+    def stream(self, archives, queried=None):
+        """Yield the given ``archives``, while writing them to a new
+        cache file. Once all of them have been consumed, the new file
+        replaces the existing cache.
+        """
+        if queried is None:
+            queried = time.time()
+        directory = path.dirname(self.filename) or '.'
+        try:
+            if not path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.archives')
+            f = os.fdopen(fd, 'wb')
+            f.write('%s %f\n' % (self.HEADER, queried))
+        except EnvironmentError, e:
+            self._warn('cannot write: %s' % e)
+            for name in archives:
+                yield name
+            return
+
+        complete = False
+        try:
+            for name in archives:
+                if f:
+                    try:
+                        f.write('%s\n' % name)
+                    except EnvironmentError, e:
+                        self._warn('cannot write: %s' % e)
+                        f.close()
+                        f = None
+                yield name
+            complete = f is not None
+        finally:
+            if f:
+                f.close()
+            try:
+                if complete:
+                    os.rename(tmp, self.filename)
+                else:
+                    os.unlink(tmp)
+            except EnvironmentError, e:
+                self._warn('cannot write: %s' % e)
+
+    def save(self, archives, queried=None):
+        """Replace the cache with the given list of ``archives``."""
+        for name in self.stream(archives, queried):
+            pass
+
+    def add(self, name):
+        """Add a single archive to an existing cache."""
+        try:
+            f = open(self.filename, 'r+b')
+        except IOError:
+            # No cache exists which we would need to keep up-to-date.
+            return
+        try:
+            if self._read_header(f) is None:
+                return
+            f.seek(0, os.SEEK_END)
+            f.write('%s\n' % name)
+        except EnvironmentError, e:
+            self._warn('cannot write: %s' % e)
+        finally:
+            f.close()
+
+    def remove(self, names):
+        """Remove the given archives from an existing cache."""
+        names = set(names)
+        try:
+            f = open(self.filename, 'rb')
+        except IOError:
+            return
+        try:
+            queried = self._read_header(f)
+            if queried is None:
+                return
+            # Lines may include the creation time after a tab
+            self.save((a for a in self._iter_lines(f)
+                       if a.split('\t', 1)[0] not in names), queried)
+        finally:
+            f.close()
@@ -0,0 +1,294 @@
+"""A local catalog of the archives, and the backups of each job, in a
+SQLite database.
+
+Rather than classifying every archive name and parsing its date on
+each run, the catalog keeps the result. When the list of archives is
+queried from the server, it is reconciled with the catalog: only the
+archives not in the catalog yet are classified, and those which no
+longer exist are dropped. The backups of a job can then be read with
+an indexed query, sorted by date or limited to a range of dates.
+
+Which archives belong to a job depends on its settings, and in
+exclusive mode also on the other jobs. A fingerprint of these is
+stored for each job; if it changes, the job is classified again.
+Archives added while a job was not registered also require it to be
+classified again.
+"""
+
+import os
+from os import path
+import time
+import hashlib
+import threading
+from datetime import datetime
+
+
+__all__ = ('ArchiveCatalog', 'job_fingerprint', 'job_fingerprints',)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    name TEXT PRIMARY KEY,
+    created TEXT
+);
+CREATE TABLE IF NOT EXISTS backups (
+    job TEXT NOT NULL,
+    name TEXT NOT NULL,
+    date TEXT NOT NULL,
+    PRIMARY KEY (job, name)
+);
+CREATE INDEX IF NOT EXISTS backups_date ON backups (job, date);
+CREATE INDEX IF NOT EXISTS backups_name ON backups (name);
+CREATE TABLE IF NOT EXISTS jobs (
+    job TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Needs to be increased whenever the rules assigning archives to jobs
+# change, so that all jobs are classified again.
+CLASSIFY_VERSION = 4
+
+
+def _settings(job):
+    return [job.target or '', job.dateformat or '',
+            ','.join(job.aliases or [])]
+
+
+def _jobs_digest(jobs):
+    key = []
+    for job in sorted(jobs or [], key=lambda j: j.name or ''):
+        key.extend(_settings(job))
+    return hashlib.sha1("\n".join(key)).hexdigest() if key else ''
+
+
+def _fingerprint(job, others_digest, creation_time):
+    key = [str(CLASSIFY_VERSION)] + _settings(job) + [
+        'creation-time' if creation_time else '', others_digest]
+    return hashlib.sha1("\n".join(key)).hexdigest()
+
+
+def job_fingerprint(job, others=None, creation_time=False):
+    """Return a string identifying the settings that determine which
+    archives belong to ``job``. As a job with a longer target prefix
+    can claim an archive, this depends on the ``others`` jobs as well.
+    """
+    return _fingerprint(job, _jobs_digest(others), creation_time)
+
+
+def job_fingerprints(jobs, creation_time=False):
+    """Return a dict of the fingerprint of each of ``jobs`` by name,
+    each depending on all of them, as ``job_fingerprint()`` would; the
+    jobs are only gone through once, though.
+    """
+    digest = _jobs_digest(jobs)
+    return dict((job.name or '', _fingerprint(job, digest, creation_time))
+                for job in jobs)
+
+
+# Dates are stored as text that sorts chronologically
+DATE_FORMAT = '%04d-%02d-%02d %02d:%02d:%02d.%06d'
+
+
+def format_date(date):
+    """Format a ``datetime`` for the catalog. Unlike ``strftime``,
+    this works for all years.
+    """
+    if date is None:
+        return None
+    return DATE_FORMAT % (date.year, date.month, date.day, date.hour,
+                          date.minute, date.second, date.microsecond)
+
+
+def parse_date(value):
+    """Turn a date stored by ``format_date()`` back into a
+    ``datetime``.
+    """
+    if value is None:
+        return None
+    day, time_of_day = value.split(' ')
+    seconds, micros = time_of_day.split('.')
+    return datetime(*(map(int, day.split('-')) + map(int, seconds.split(':')) +
+                      [int(micros)]))
+
+
+class ArchiveCatalog(object):
+    """The catalog of archives stored in the SQLite database
+    ``filename``, considered in sync with the server for ``ttl``
+    seconds after it was last reconciled.
+
+    The methods taking a ``classify`` argument expect a function
+    returning a list of ``(job name, datetime)`` tuples for an archive
+    name and its creation time, and ``fingerprints``, a dict of the
+    fingerprint of each job ``classify`` knows about.
+    """
+
+    def __init__(self, filename, ttl=None, log=None):
+        self.filename = filename
+        self.ttl = ttl
+        self.log = log
+        self._db = None
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._db is None:
+            import sqlite3
+            directory = path.dirname(self.filename)
+            if directory and not path.isdir(directory):
+                os.makedirs(directory)
+            self._db = sqlite3.connect(self.filename, check_same_thread=False)
+            self._db.text_factory = str
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def queried(self):
+        """Return when the catalog was last reconciled with the server,
+        or ``None``.
+        """
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value FROM meta WHERE key = 'queried'").fetchone()
+        return float(row[0]) if row else None
+
+    def is_fresh(self):
+        queried = self.queried()
+        if queried is None:
+            return False
+        return self.ttl is None or time.time() - queried <= self.ttl
+
+    def _insert(self, db, entries, classify, fingerprints):
+        """Add the ``(name, created)`` entries, and the backups they
+        are, and invalidate the jobs which cannot be classified.
+        """
+        archives, backups = [], []
+        for name, created in entries:
+            archives.append((name, created))
+            for job, date in classify(name, parse_date(created)):
+                backups.append((job, name, format_date(date)))
+        if not archives:
+            return 0
+        db.executemany('INSERT OR REPLACE INTO archives VALUES (?, ?)',
+                       archives)
+        db.executemany('INSERT OR REPLACE INTO backups VALUES (?, ?, ?)',
+                       backups)
+        # Jobs that were not classified need to be, when next used
+        known = sorted(fingerprints)
+        db.execute('DELETE FROM jobs WHERE job NOT IN (%s)' % ', '.join(
+            '?' * len(known)), known)
+        return len(archives)
+
+    def reconcile(self, entries, classify, fingerprints, queried=None):
+        """Bring the catalog in line with the ``(name, creation time)``
+        ``entries`` queried from the server. Only the archives not in
+        the catalog are classified.
+        """
+        if queried is None:
+            queried = time.time()
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute('CREATE TEMPORARY TABLE IF NOT EXISTS listing ('
+                           'name TEXT PRIMARY KEY, created TEXT)')
+                db.execute('DELETE FROM listing')
+                db.executemany(
+                    'INSERT OR REPLACE INTO listing VALUES (?, ?)',
+                    ((name, format_date(created))
+                     for name, created in entries))
+                new = db.execute(
+                    'SELECT name, created FROM listing WHERE name NOT IN '
+                    '(SELECT name FROM archives)').fetchall()
+                added = self._insert(db, new, classify, fingerprints)
+                removed = db.execute(
+                    'DELETE FROM archives WHERE name NOT IN '
+                    '(SELECT name FROM listing)').rowcount
+                db.execute('DELETE FROM backups WHERE name NOT IN '
+                           '(SELECT name FROM archives)')
+                db.execute('DELETE FROM listing')
+                db.execute("INSERT OR REPLACE INTO meta VALUES "
+                           "('queried', ?)", (repr(queried),))
+        if self.log:
+            self.log.debug('Catalog %s: %d archives added, %d removed' % (
+                self.filename, added, removed))
+
+    def classify_jobs(self, classify, fingerprints):
+        """Classify all archives again for the jobs whose fingerprint
+        has changed.
+        """
+        with self._lock:
+            db = self._connect()
+            stored = dict(db.execute('SELECT job, fingerprint FROM jobs'))
+            stale = set(job for job, fingerprint in fingerprints.items()
+                        if stored.get(job) != fingerprint)
+            if not stale:
+                return
+            with db:
+                for job in stale:
+                    db.execute('DELETE FROM backups WHERE job = ?', (job,))
+                backups = []
+                for name, created in db.execute(
+                        'SELECT name, created FROM archives'):
+                    for job, date in classify(name, parse_date(created)):
+                        if job in stale:
+                            backups.append((job, name, format_date(date)))
+                db.executemany('INSERT OR REPLACE INTO backups '
+                               'VALUES (?, ?, ?)', backups)
+                db.executemany('INSERT OR REPLACE INTO jobs VALUES (?, ?)',
+                               [(job, fingerprints[job]) for job in stale])
+
+    def add(self, name, created, classify, fingerprints):
+        """Add the archive ``name``, just created."""
+        with self._lock:
+            db = self._connect()
+            with db:
+                self._insert(db, [(name, format_date(created))], classify,
+                             fingerprints)
+
+    def remove(self, names):
+        """Remove the given archives, just deleted."""
+        names = [(name,) for name in names]
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.executemany('DELETE FROM archives WHERE name = ?', names)
+                db.executemany('DELETE FROM backups WHERE name = ?', names)
+
+    def names_with_suffix(self, suffix):
+        """Return the names of the archives ending with ``suffix``."""
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT name FROM archives WHERE substr(name, ?) = ?',
+                (-len(suffix), suffix)).fetchall()
+        return [name for name, in rows]
+
+    def backups(self, job, start=None, end=None):
+        """Return a dict of the backups of ``job``, by name, optionally
+        only those dated from ``start`` up to, but excluding ``end``.
+        """
+        return dict(self.list_backups(job, start, end))
+
+    def list_backups(self, job, start=None, end=None, newest_first=False):
+        """Return a list of ``(name, date)`` tuples of the backups of
+        ``job``, sorted by date; see ``backups()``.
+        """
+        query = 'SELECT name, date FROM backups WHERE job = ?'
+        params = [job or '']
+        if start is not None:
+            query += ' AND date >= ?'
+            params.append(format_date(start))
+        if end is not None:
+            query += ' AND date < ?'
+            params.append(format_date(end))
+        query += ' ORDER BY date DESC' if newest_first else ' ORDER BY date'
+        with self._lock:
+            rows = self._connect().execute(query, params).fetchall()
+        return [(name, parse_date(date)) for name, date in rows]
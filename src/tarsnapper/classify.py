@@ -0,0 +1,230 @@
+"""Assign archive names to the backup jobs they belong to.
+
+Rather than matching every archive against the target of every job,
+the literal prefixes of all targets (the part before the ``$date``
+placeholder) are put into a trie. For each archive, only the jobs whose
+prefix the archive name starts with need to be tested, so the list of
+archives can be classified for all jobs in a single pass.
+
+Archives left behind by an interrupted backup, which tarsnap stores
+with a ``.part`` suffix, are not backups of any job; they are kept
+aside, so that they can be deleted once a complete backup exists.
+"""
+
+import re
+from dates import (
+    DEFAULT_DATEFORMAT, DIRECTIVES, FAST_LAYOUTS, compile_dateformat)
+
+
+__all__ = ('ArchiveIndex', 'target_patterns', 'is_partial',
+           'PARTIAL_SUFFIX',)
+
+
+# Stands in for the date when substituting the target template; cannot
+# be part of an archive name.
+DATE_MARKER = '\0'
+
+# The key in a trie node holding the matchers of that prefix.
+MATCHERS = None
+
+# What tarsnap appends to the name of an archive it did not finish
+PARTIAL_SUFFIX = '.part'
+
+
+def is_partial(name):
+    return name.endswith(PARTIAL_SUFFIX)
+
+
+def date_patterns(job, strict=False):
+    """Yield the ways the date in the job's archive names is matched,
+    in order of preference, as ``(regex, dateformat)`` tuples.
+
+    If the job has a dateformat, only dates in exactly that format are
+    matched. Otherwise, dates in the format tarsnapper uses by default
+    are preferred, but any string is accepted, to be parsed by
+    python-dateutil later.
+
+    In ``strict`` mode, any string is never accepted: the date must be
+    in the job's dateformat, or without one, in one of the common
+    layouts python-dateutil would parse the same way.
+    """
+    dateformat = compile_dateformat(job.dateformat or DEFAULT_DATEFORMAT)
+    if dateformat:
+        yield dateformat.pattern, dateformat
+    elif strict:
+        yield word_pattern(job.dateformat), None
+    if strict:
+        if not job.dateformat:
+            for layout in FAST_LAYOUTS:
+                if layout.dateformat != DEFAULT_DATEFORMAT:
+                    yield layout.pattern, layout
+    elif not job.dateformat or not dateformat:
+        yield '.*?', None
+
+
+def word_pattern(dateformat):
+    """Return a regular expression matching dates in ``dateformat``,
+    which uses directives ``DateFormat`` cannot translate. Those are
+    taken to produce a single word each.
+    """
+    pattern = ''
+    for part in re.split('(%.)', dateformat):
+        if part == '%%':
+            pattern += '%'
+        elif part.startswith('%') and len(part) == 2:
+            if part[1] in DIRECTIVES:
+                pattern += r'\d{%d}' % DIRECTIVES[part[1]][0]
+            else:
+                pattern += r'[^\W_]+'
+        else:
+            pattern += re.escape(part)
+    return pattern
+
+
+# The compiled regular expressions of ``target_patterns()``, shared by
+# all jobs whose targets continue the same way after their prefix.
+_compiled_patterns = {}
+
+
+def _compile_pattern(pattern):
+    try:
+        return _compiled_patterns[pattern]
+    except KeyError:
+        regex = _compiled_patterns[pattern] = re.compile(pattern)
+        return regex
+
+
+def target_patterns(job, strict=False):
+    """For each name a job's archives may use (the job name, and its
+    aliases), yield the literal prefix of the target, a regular
+    expression matching the rest of the archive name, and the
+    ``DateFormat`` matching the date part, if any. See
+    ``date_patterns()`` for ``strict``.
+
+    The regular expression is to be matched starting after the prefix,
+    so that jobs can share it.
+    """
+    for possible_name in [job.name] + (job.aliases or []):
+        target = job.target_template.substitute(
+            {'name': possible_name, 'date': DATE_MARKER})
+        parts = target.split(DATE_MARKER)
+        for date_regex, dateformat in date_patterns(job, strict):
+            regex = '(?P<date>%s)' % date_regex
+            for part in parts[1:-1]:
+                regex += re.escape(part) + '(?P=date)'
+            regex += re.escape(parts[-1])
+            yield parts[0], _compile_pattern('%s$' % regex), dateformat
+
+
+class ArchiveIndex(object):
+    """Keeps track of which archives belong to which of the given
+    ``jobs``, and what the date part of each archive's name is.
+
+    In ``exclusive`` mode, an archive is assigned to a single job only:
+    the one with the longest matching prefix. Its name must contain a
+    date in the job's format, as the date cannot be left to
+    python-dateutil to make sense of; see ``date_patterns()``.
+    """
+
+    def __init__(self, jobs, exclusive=False):
+        self.jobs = list(jobs)
+        self.exclusive = exclusive
+        self._trie = {}
+        self._backups = {}
+        # The names of all partial archives
+        self.partial = set()
+        for job in self.jobs:
+            self._backups[job] = {}
+            if exclusive:
+                patterns = target_patterns(job, strict=True)
+            else:
+                patterns = job.target_patterns
+            for priority, (prefix, regex, dateformat) in enumerate(patterns):
+                node = self._trie
+                for char in prefix:
+                    node = node.setdefault(char, {})
+                node.setdefault(MATCHERS, []).append(
+                    (job, priority, regex, dateformat, len(prefix)))
+
+    def __contains__(self, job):
+        return job in self._backups
+
+    def classify(self, name):
+        """Return a list of ``(job, date)`` tuples, one for each job the
+        archive ``name`` may belong to.
+
+        ``date`` is a ``datetime`` if it could be constructed directly
+        from the archive name, or otherwise the date part of the name,
+        which still needs to be parsed.
+
+        Partial archives do not belong to any job.
+        """
+        if is_partial(name):
+            return []
+        # Collect the matchers of all prefixes of name
+        node = self._trie
+        candidates = list(node.get(MATCHERS, ()))
+        for char in name:
+            node = node.get(char)
+            if node is None:
+                break
+            candidates.extend(node.get(MATCHERS, ()))
+
+        # If a job has multiple matching names, the first one wins.
+        if self.exclusive:
+            candidates.sort(key=lambda c: (-c[4], c[1]))
+        else:
+            candidates.sort(key=lambda c: c[1])
+        result = []
+        seen = set()
+        # The longest prefix of a job matching the archive with a date
+        # in its format, rather than any string
+        claimed = 0
+        for job, _, regex, dateformat, length in candidates:
+            if job in seen:
+                continue
+            match = regex.match(name, length)
+            if match:
+                seen.add(job)
+                date = match.group('date')
+                if dateformat:
+                    claimed = max(claimed, length)
+                    try:
+                        date = dateformat.build(match)
+                    except ValueError:
+                        # Not a valid date; leave it to parse_date()
+                        # to complain about it.
+                        pass
+                result.append((job, date, dateformat, length))
+                if self.exclusive:
+                    break
+        # Jobs accepting any string as the date do not get the archives
+        # of a job with a longer prefix: for "windows-$date", the date
+        # of "windows-data-20100101-000000" would be "data-...".
+        return [(job, date) for job, date, dateformat, length in result
+                if dateformat or length >= claimed]
+
+    def add(self, name, date=None):
+        """Add the archive ``name`` to the jobs it belongs to. If given,
+        ``date`` is used rather than the date in the name.
+        """
+        if is_partial(name):
+            self.partial.add(name)
+            return
+        for job, name_date in self.classify(name):
+            self._backups[job][name] = name_date if date is None else date
+
+    def extend(self, names):
+        for name in names:
+            self.add(name)
+
+    def remove(self, name):
+        self.partial.discard(name)
+        for backups in self._backups.values():
+            backups.pop(name, None)
+
+    def get(self, job):
+        """Return a dict of archive name => date pairs of the archives
+        belonging to ``job``; see ``classify()``.
+        """
+        return self._backups[job]
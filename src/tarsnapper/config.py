@@ -21,11 +21,26 @@ like this:
       important-job:
         source: /important/
         delta: important
+        # Jobs in the same group are never run at the same time
+        group: databases
+
+      large-job:
+        source: /srv/media
+        # Save the progress every 100 MB, so that an interrupted
+        # backup does not have to start over
+        checkpoint_bytes: 100M
 """
 
+import os
+from os import path
+import hashlib
+import tempfile
+import cPickle as pickle
+from collections import OrderedDict
 from datetime import timedelta
 from string import Template
-import yaml
+
+import tarsnapper
 
 
 __all__ = ('Job', 'load_config', 'load_config_from_file', 'ConfigError',)
@@ -37,8 +52,19 @@ class ConfigError(Exception):
 
 class Job(object):
     """Represent a single backup job.
+
+    A job is not supposed to change once it has been created. What is
+    derived from its settings, like the regular expressions matching its
+    archives, is built the first time it is needed, and then kept.
     """
 
+    SETTINGS = ('name', 'aliases', 'target', 'dateformat', 'deltas',
+                'sources', 'excludes', 'force', 'exec_before', 'exec_after',
+                'group', 'checkpoint_bytes')
+
+    __slots__ = SETTINGS + (
+        '_target_template', '_target_patterns', '_sorted_deltas')
+
     def __init__(self, **initial):
         self.name = initial.get('name')
         self.aliases = initial.get('aliases')
@@ -50,6 +76,42 @@ class Job(object):
         self.force = initial.get('force')
         self.exec_before = initial.get('exec_before')
         self.exec_after = initial.get('exec_after')
+        self.group = initial.get('group')
+        self.checkpoint_bytes = initial.get('checkpoint_bytes')
+        self._target_template = None
+        self._target_patterns = None
+        self._sorted_deltas = None
+
+    def __getstate__(self):
+        # The derived values are not worth storing
+        return dict((key, getattr(self, key)) for key in self.SETTINGS)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def target_template(self):
+        """The target as a ``string.Template``."""
+        if self._target_template is None:
+            self._target_template = Template(self.target)
+        return self._target_template
+
+    @property
+    def target_patterns(self):
+        """A list of the patterns matching the archives of this job;
+        see ``classify.target_patterns()``.
+        """
+        if self._target_patterns is None:
+            from classify import target_patterns
+            self._target_patterns = list(target_patterns(self))
+        return self._target_patterns
+
+    @property
+    def sorted_deltas(self):
+        """The deltas, in ascending order."""
+        if self._sorted_deltas is None and self.deltas is not None:
+            self._sorted_deltas = sorted(self.deltas)
+        return self._sorted_deltas
 
 
 def require_placeholders(text, placeholders, what):
@@ -100,6 +162,37 @@ def parse_deltas(delta_string):
 
     return deltas
 
+# The smallest checkpoint interval tarsnap accepts
+MIN_CHECKPOINT_BYTES = 1000000
+
+SIZE_SUFFIXES = {'k': 10 ** 3, 'M': 10 ** 6, 'G': 10 ** 9, 'T': 10 ** 12}
+
+
+def parse_size(value):
+    """Parse a number of bytes, optionally with a k, M, G or T suffix.
+    """
+    if value is None:
+        return None
+    text = str(value).strip()
+    factor = SIZE_SUFFIXES.get(text[-1:], 1)
+    if factor != 1:
+        text = text[:-1]
+    try:
+        return int(text) * factor
+    except ValueError:
+        raise ValueError(value)
+
+
+def parse_checkpoint_bytes(value):
+    """Parse the ``checkpoint_bytes`` option."""
+    try:
+        size = parse_size(value)
+    except ValueError:
+        raise ConfigError('Not a valid size: %s' % value)
+    if size is not None and size < MIN_CHECKPOINT_BYTES:
+        raise ConfigError('checkpoint_bytes must be at least 1M')
+    return size
+
 def parse_named_deltas(named_delta_dict):
     named_deltas = {}
     for name, deltas in named_delta_dict.iteritems():
@@ -108,20 +201,47 @@ def parse_named_deltas(named_delta_dict):
         named_deltas[name] = parse_deltas(deltas)
     return named_deltas
 
+_loader = None
+
+def _ordered_loader():
+    """Return a YAML loader class keeping mappings in order, so that
+    jobs are run in the order they are defined.
+    """
+    global _loader
+    if _loader is None:
+        import yaml
+        # LibYAML's loader is much faster, if available
+        base = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+        def construct_mapping(loader, node):
+            loader.flatten_mapping(node)
+            return OrderedDict(loader.construct_pairs(node))
+
+        class OrderedLoader(base):
+            pass
+        OrderedLoader.add_constructor(
+            yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, construct_mapping)
+        _loader = OrderedLoader
+    return _loader
+
+
 def load_config(text):
-    """Load the config file and return a dict of jobs, with the local
-    and global configurations merged.
+    """Load the config file and return an ordered dict of jobs, with
+    the local and global configurations merged.
     """
-    config = yaml.load(text)
+    import yaml
+    config = yaml.load(text, Loader=_ordered_loader())
 
     default_dateformat = config.pop('dateformat', None)
     default_deltas = parse_deltas(config.pop('deltas', None))
     default_target = require_placeholders(config.pop('target', None),
                                           ['name', 'date'], 'The global target')
+    default_checkpoint_bytes = parse_checkpoint_bytes(
+        config.pop('checkpoint_bytes', None))
 
     named_deltas = parse_named_deltas(config.pop('delta-names', {}))
 
-    read_jobs = {}
+    read_jobs = OrderedDict()
     jobs_section = config.pop('jobs', None)
     if not jobs_section:
         raise ConfigError('config must define at least one job')
@@ -174,6 +294,9 @@ def load_config(text):
             'dateformat': job_dict.pop('dateformat', default_dateformat),
             'exec_before': job_dict.pop('exec_before', None),
             'exec_after': job_dict.pop('exec_after', None),
+            'group': job_dict.pop('group', None),
+            'checkpoint_bytes': parse_checkpoint_bytes(job_dict.pop(
+                'checkpoint_bytes', None)) or default_checkpoint_bytes,
         })
         if not new_job.target:
             raise ConfigError('%s does not have a target name' % job_name)
@@ -190,9 +313,85 @@ def load_config(text):
     return read_jobs, config
 
 
-def load_config_from_file(filename):
+# Needs to be increased whenever the pickled form of the loaded config
+# changes, e.g. when attributes are added to ``Job``.
+CACHE_FORMAT = 4
+
+
+def config_cache_filename(filename):
+    """Return the file the loaded config ``filename`` is cached in."""
+    directory, basename = path.split(path.abspath(filename))
+    return path.join(directory, '.%s.cache' % basename)
+
+
+def _cache_key(text):
+    """The key of a cached config: the config file's content, and the
+    version of tarsnapper that loaded it.
+    """
+    return '%s %s %s' % (
+        hashlib.sha1(text).hexdigest(),
+        '.'.join(map(str, tarsnapper.__version__)), CACHE_FORMAT)
+
+
+def _read_cache(filename, key):
+    """Return the config cached in ``filename`` under ``key``, or
+    ``None``.
+    """
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        return None
+    try:
+        # Unpickling can run arbitrary code, so only trust a file
+        # nobody else could have written.
+        st = os.fstat(f.fileno())
+        if st.st_uid != os.getuid() or st.st_mode & 022:
+            return None
+        if f.readline().rstrip('\n') != key:
+            return None
+        return pickle.load(f)
+    except Exception:
+        return None
+    finally:
+        f.close()
+
+
+def _write_cache(filename, key, loaded):
+    try:
+        fd, tmp = tempfile.mkstemp(dir=path.dirname(filename),
+                                   prefix='.config')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(key + '\n')
+                pickle.dump(loaded, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, filename)
+        except:
+            os.unlink(tmp)
+            raise
+    except (EnvironmentError, pickle.PicklingError):
+        # Caching is optional; e.g. the directory may not be writable.
+        pass
+
+
+def load_config_from_file(filename, use_cache=True):
+    """Load the config file ``filename``, see ``load_config()``.
+
+    Unless ``use_cache`` is disabled, the loaded config is cached in a
+    file next to it (see ``config_cache_filename()``), which is used as
+    long as the content of the config file remains the same.
+    """
     f = open(filename, 'rb')
     try:
-        return load_config(f.read())
+        text = f.read()
     finally:
         f.close()
+    if not use_cache:
+        return load_config(text)
+
+    key = _cache_key(text)
+    cache_filename = config_cache_filename(filename)
+    loaded = _read_cache(cache_filename, key)
+    if loaded is None:
+        loaded = load_config(text)
+        _write_cache(cache_filename, key, loaded)
+    return loaded
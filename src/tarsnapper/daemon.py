@@ -0,0 +1,84 @@
+"""Decide when to run each job, for the ``daemon`` command.
+
+Each job is run as often as its smallest delta asks for: with the
+deltas ``1h 1d 7d``, a new backup is made every hour. The jobs are kept
+in a heap, by the time they are due next.
+"""
+
+import heapq
+import itertools
+
+
+__all__ = ('JobQueue', 'job_interval',)
+
+
+def job_interval(job):
+    """Return how often ``job`` should be run, in seconds, or ``None``
+    if it does not define deltas.
+    """
+    if not job.deltas:
+        return None
+    return job.sorted_deltas[0].total_seconds()
+
+
+class JobQueue(object):
+    """The jobs to run, by the time they are due.
+
+    A job can be scheduled again, or removed, at any time; its previous
+    entry in the heap is then ignored.
+    """
+
+    def __init__(self):
+        self._heap = []
+        # job name => (due, sequence number, job)
+        self._entries = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def names(self):
+        """Return the names of the jobs scheduled."""
+        return list(self._entries)
+
+    def push(self, job, due):
+        """Schedule ``job`` to run at the timestamp ``due``."""
+        entry = (due, next(self._counter), job)
+        self._entries[job.name] = entry
+        heapq.heappush(self._heap, (due, entry[1], job.name))
+
+    def remove(self, name):
+        self._entries.pop(name, None)
+
+    def due(self, name):
+        """Return when the job ``name`` is due, or ``None``."""
+        entry = self._entries.get(name)
+        return entry[0] if entry else None
+
+    def _discard_stale(self):
+        while self._heap:
+            due, sequence, name = self._heap[0]
+            entry = self._entries.get(name)
+            if entry and entry[1] == sequence:
+                return
+            heapq.heappop(self._heap)
+
+    def next_due(self):
+        """Return when the next job is due, or ``None``."""
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """Remove the jobs due at the timestamp ``now``, and return them
+        as ``(due, job)`` tuples, in order.
+        """
+        jobs = []
+        while True:
+            self._discard_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return jobs
+            due, sequence, name = heapq.heappop(self._heap)
+            jobs.append((due, self._entries.pop(name)[2]))
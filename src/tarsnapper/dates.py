@@ -0,0 +1,219 @@
+"""Parsing the dates contained in archive names.
+"""
+
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+
+__all__ = ('DEFAULT_DATEFORMAT', 'parse_date', 'DateParser', 'DateFormat',
+           'compile_dateformat',)
+
+
+DEFAULT_DATEFORMAT = '%Y%m%d-%H%M%S'
+
+
+# The order of the positional arguments of ``datetime``
+DATETIME_FIELDS = ('year', 'month', 'day', 'hour', 'minute', 'second',
+                   'microsecond')
+
+
+# The strftime directives we can translate into a regular expression,
+# with the number of digits and the datetime field each of them provides.
+# Only directives that produce fixed-width numbers, independent of the
+# locale, are supported.
+DIRECTIVES = {
+    'Y': (4, 'year'),
+    'y': (2, 'short_year'),
+    'm': (2, 'month'),
+    'd': (2, 'day'),
+    'j': (3, 'yday'),
+    'H': (2, 'hour'),
+    'M': (2, 'minute'),
+    'S': (2, 'second'),
+    'f': (6, 'microsecond'),
+}
+
+
+def _build_datetime(values):
+    """Construct a ``datetime`` from a dict of the fields given in
+    ``DIRECTIVES``, defaulting missing ones the same way strptime does.
+    """
+    year = values.get('year')
+    if year is None:
+        if 'short_year' in values:
+            # Same as strptime
+            year = values['short_year'] + 1900
+            if year < 1969:
+                year += 100
+        else:
+            year = 1900
+    if 'yday' in values and not ('month' in values or 'day' in values):
+        if not 1 <= values['yday'] <= 366:
+            raise ValueError('day of year out of range')
+        return datetime(year, 1, 1, values.get('hour', 0),
+                        values.get('minute', 0), values.get('second', 0),
+                        values.get('microsecond', 0)) + \
+            timedelta(days=values['yday'] - 1)
+    return datetime(year, values.get('month', 1), values.get('day', 1),
+                    values.get('hour', 0), values.get('minute', 0),
+                    values.get('second', 0), values.get('microsecond', 0))
+
+
+class DateFormat(object):
+    """A strftime format string translated into a regular expression
+    with one group per directive, whose values can be turned into a
+    ``datetime`` directly.
+
+    Raises a ``ValueError`` if the format uses unsupported directives.
+    """
+
+    def __init__(self, dateformat):
+        self.dateformat = dateformat
+        self.fields = []
+        self.groups = []
+        self.length = 0
+        pattern = ''
+        chars = iter(dateformat)
+        for char in chars:
+            if char != '%':
+                pattern += re.escape(char)
+                self.length += 1
+                continue
+            directive = next(chars, None)
+            if directive == '%':
+                pattern += '%'
+                self.length += 1
+            elif directive in DIRECTIVES:
+                width, field = DIRECTIVES[directive]
+                group = '_%d' % len(self.groups)
+                pattern += r'(?P<%s>\d{%d})' % (group, width)
+                self.fields.append(field)
+                self.groups.append(group)
+                self.length += width
+            else:
+                raise ValueError('Unsupported directive in %r: %%%s' % (
+                    dateformat, directive or ''))
+        self.pattern = pattern
+        self.regex = re.compile('^%s$' % pattern)
+        # If the fields are in the order datetime expects them, with
+        # nothing missing in between, we can take a shortcut.
+        self.positional = len(self.fields) >= 3 and \
+            tuple(self.fields) == DATETIME_FIELDS[:len(self.fields)]
+
+    def build(self, match):
+        """Construct a ``datetime`` from a match of ``pattern``, which
+        may be part of a larger regular expression.
+        """
+        values = match.group(*self.groups)
+        if self.positional:
+            return datetime(*map(int, values))
+        if len(self.groups) == 1:
+            values = [values]
+        return _build_datetime(dict(zip(self.fields, map(int, values))))
+
+    def parse(self, string):
+        match = self.regex.match(string)
+        if not match:
+            raise ValueError('%r does not match format %r' % (
+                string, self.dateformat))
+        if self.positional:
+            return datetime(*map(int, match.groups()))
+        return self.build(match)
+
+
+_compiled_formats = {}
+
+
+def compile_dateformat(dateformat):
+    """Return a ``DateFormat`` for the given format string, or ``None``
+    if it cannot be translated.
+    """
+    try:
+        return _compiled_formats[dateformat]
+    except KeyError:
+        try:
+            compiled = DateFormat(dateformat)
+        except ValueError:
+            compiled = None
+        _compiled_formats[dateformat] = compiled
+        return compiled
+
+
+# Common layouts which python-dateutil would parse the same way, tried
+# before falling back to it.
+FAST_LAYOUTS = [DateFormat(f) for f in (
+    DEFAULT_DATEFORMAT,
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d',
+    '%Y%m%d',
+    '%Y%m%d%H%M%S',
+    '%Y%m%dT%H%M%S',
+)]
+
+
+class DateParser(object):
+    """Parses dates, trying the cheapest approach first.
+
+    Without a dateformat, the common layouts in ``FAST_LAYOUTS`` are
+    tried before falling back to python-dateutil. The layout that
+    succeeded is remembered for the given ``key`` (usually the job) and
+    is tried first the next time; at most ``max_hints`` keys are kept.
+    """
+
+    def __init__(self, max_hints=1024):
+        self.max_hints = max_hints
+        self._hints = OrderedDict()
+        self._layouts = {}
+        for layout in FAST_LAYOUTS:
+            self._layouts.setdefault(layout.length, []).append(layout)
+
+    def parse(self, string, dateformat=None, key=None):
+        if dateformat:
+            compiled = compile_dateformat(dateformat)
+            if compiled:
+                try:
+                    return compiled.parse(string)
+                except ValueError:
+                    # strptime is more lenient, e.g. regarding the width
+                    # of numbers.
+                    pass
+            return datetime.strptime(string, dateformat)
+
+        hint = self._hints.get(key)
+        if hint is not None:
+            try:
+                return hint.parse(string)
+            except ValueError:
+                pass
+        for layout in self._layouts.get(len(string), ()):
+            if layout is hint:
+                continue
+            try:
+                result = layout.parse(string)
+            except ValueError:
+                continue
+            if key is not None:
+                self._remember(key, layout)
+            return result
+        import dateutil.parser
+        return dateutil.parser.parse(string)
+
+    def _remember(self, key, layout):
+        self._hints.pop(key, None)
+        self._hints[key] = layout
+        while len(self._hints) > self.max_hints:
+            self._hints.popitem(last=False)
+
+
+_parser = DateParser()
+
+
+def parse_date(string, dateformat=None, key=None):
+    """Parse a date string, either using the given format, or by
+    relying on python-dateutil. See ``DateParser``.
+    """
+    return _parser.parse(string, dateformat, key)
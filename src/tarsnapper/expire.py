@@ -1,16 +1,22 @@
 import operator
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timedelta
 
 
-__all__ = ('expire',)
+__all__ = ('expire', 'expire_sorted',)
 
 
 def timedelta_div(td1, td2):
     """http://stackoverflow.com/questions/865618/how-can-i-perform-divison-on-a-datetime-timedelta-in-python
     """
-    us1 = td1.microseconds + 1000000 * (td1.seconds + 86400 * td1.days)
-    us2 = td2.microseconds + 1000000 * (td2.seconds + 86400 * td2.days)
-    return float(us1) / us2
+    return float(timedelta_micros(td1)) / timedelta_micros(td2)
+
+
+def timedelta_micros(td):
+    """Return the given ``timedelta`` as an integer number of
+    microseconds.
+    """
+    return td.microseconds + 1000000 * (td.seconds + 86400 * td.days)
 
 
 def expire(backups, deltas):
@@ -47,18 +53,36 @@ def expire(backups, deltas):
     if not backups:
         return []
 
-    # First, sort the backups with most recent one first
-    backups = [(name, time) for name, time in backups.items()]
-    backups.sort(cmp=lambda x, y: -cmp(x[1], y[1]))
-    old_backups = backups[:]
+    # Sort the backups with the oldest one first. The sort is stable, so
+    # backups sharing a timestamp remain in their original order, which
+    # decides which one of them is chosen.
+    backups = sorted(backups.items(), key=operator.itemgetter(1))
+    origin = backups[0][1]
+    times = [timedelta_micros(time - origin) for _, time in backups]
+
+    to_keep = expire_sorted(times, [timedelta_micros(d) for d in deltas])
+    return [backups[index][0] for index in to_keep]
 
-    # Also make sure that we have the deltas in ascending order
-    deltas = list(deltas[:])
-    deltas.sort()
+
+def expire_sorted(times, deltas):
+    """The engine behind :func:`expire`.
+
+    ``times`` is a list of backup timestamps as integers, sorted in
+    ascending order; ``deltas`` are integers of the same unit. Returned
+    is a set of indices into ``times`` of the backups to keep.
+
+    The closest backup to a point in time is found using a binary search,
+    and gaps between backups larger than the current delta are skipped
+    in a single step, so the run time only depends on the number of
+    backups, not on the timespan they cover.
+    """
+    most_recent_backup = times[-1]
 
     # Always keep the most recent backup
-    most_recent_backup = backups[0][1]
-    to_keep = set([backups[0][0]])
+    to_keep = set([_first_of(times, len(times) - 1)])
+
+    # Make sure that we have the deltas in ascending order
+    deltas = sorted(deltas)
 
     # Then, for each delta/generation, determine which backup to keep
     last_delta = deltas.pop()
@@ -75,25 +99,44 @@ def expire(backups, deltas):
             # in general. We do the latter. The difference is merely in how
             # long the oldest backup in each generation should be kept, that
             # is, how the given deltas should be interpreted.
-            by_dist = sorted([(bn, bd, abs(bd - dt_pointer)) for bn, bd in backups], key=operator.itemgetter(2))
-            if by_dist:
-                if by_dist[0][0] == last_selected:
-                    # If the time diff between two backups is larger than
-                    # the delta, it can happen that multiple iterations of
-                    # this loop determine the same backup to be closest.
-                    # In this case, to avoid looping endlessly, we need to
-                    # force the date pointer to move forward.
-                    dt_pointer += current_delta
-                else:
-                    last_selected = by_dist[0][0]
-                    to_keep.add(by_dist[0][0])
-                    # (3) Proceed forward in time, jumping by the current
-                    # generation's delta.
-                    dt_pointer = by_dist[0][1] + current_delta
+            closest = _closest(times, dt_pointer)
+            if closest == last_selected:
+                # If the time diff between two backups is larger than
+                # the delta, it can happen that multiple iterations of
+                # this loop determine the same backup to be closest.
+                # Move the date pointer forward by as many deltas as it
+                # takes for the next newer backup to become the closest.
+                selected = times[closest]
+                newer = times[bisect_right(times, selected)]
+                steps = -((2 * dt_pointer - selected - newer) //
+                          (2 * current_delta))
+                dt_pointer += steps * current_delta
             else:
-                # No more backups found in this generation.
-                break
+                last_selected = closest
+                to_keep.add(closest)
+                # (3) Proceed forward in time, jumping by the current
+                # generation's delta.
+                dt_pointer = times[closest] + current_delta
 
         last_delta = current_delta
 
-    return list(to_keep)
+    return to_keep
+
+
+def _first_of(times, index):
+    """Return the index of the first backup sharing the timestamp of
+    the backup at ``index``.
+    """
+    return bisect_left(times, times[index])
+
+
+def _closest(times, dt_pointer):
+    """Return the index of the backup closest to ``dt_pointer``. If two
+    backups are equally close, the newer one wins.
+    """
+    index = bisect_left(times, dt_pointer)
+    if index == len(times):
+        return _first_of(times, index - 1)
+    if index and dt_pointer - times[index - 1] < times[index] - dt_pointer:
+        return _first_of(times, index - 1)
+    return index
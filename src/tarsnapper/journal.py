@@ -0,0 +1,126 @@
+"""Record the archives an expire run is going to delete, so that an
+interrupted run can be resumed.
+
+Before the archives of a job are deleted, the whole list is written
+to the journal, and as they are deleted, they are checked off. The next
+run deletes those still left without listing the archives, or deciding
+again which of them to keep.
+
+The journal is a file with one JSON object per line, only ever
+appended to while a deletion is in progress, and removed once all of
+them are done.
+"""
+
+import os
+import threading
+
+from schedule import job_fingerprint
+
+
+__all__ = ('DeletionJournal',)
+
+
+class DeletionJournal(object):
+    """The deletions which have been planned, but not yet finished,
+    stored in ``filename``.
+    """
+
+    def __init__(self, filename, creation_time=False, log=None):
+        self.filename = filename
+        self.creation_time = creation_time
+        self.log = log
+        self._plans = None
+        self._lock = threading.Lock()
+
+    def _warn(self, message):
+        if self.log:
+            self.log.warning('Deletion journal %s: %s' % (
+                self.filename, message))
+
+    def _load(self):
+        if self._plans is not None:
+            return self._plans
+        import json
+        self._plans = {}
+        try:
+            f = open(self.filename, 'rb')
+        except IOError:
+            return self._plans
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    plan = self._plans.get(record['job'])
+                    if 'delete' in record:
+                        self._plans[record['job']] = {
+                            'fingerprint': record['fingerprint'],
+                            'stable': record.get('stable'),
+                            'pending': list(record['delete'])}
+                    elif plan and 'done' in record:
+                        done = set(record['done'])
+                        plan['pending'] = [
+                            n for n in plan['pending'] if n not in done]
+                    elif 'finished' in record:
+                        self._plans.pop(record['job'], None)
+                except (ValueError, TypeError, KeyError):
+                    # Most likely the last line, cut short when we
+                    # were interrupted.
+                    self._warn('ignoring invalid line')
+        return self._plans
+
+    def _append(self, record):
+        import json
+        try:
+            with open(self.filename, 'ab') as f:
+                f.write(json.dumps(record) + '\n')
+        except EnvironmentError, e:
+            self._warn('cannot write: %s' % e)
+
+    def pending(self, job):
+        """Return a ``(names, stable)`` tuple of the archives of ``job``
+        still to be deleted, and the ``stable`` value given to
+        ``start()``; or ``None`` if there is nothing to resume.
+
+        A plan is not resumed if the job's settings have changed since.
+        """
+        with self._lock:
+            plan = self._load().get(job.name or '')
+            if not plan or plan['fingerprint'] != job_fingerprint(
+                    job, self.creation_time):
+                return None
+            return list(plan['pending']), plan['stable']
+
+    def start(self, job, names, stable=None):
+        """Record that the archives ``names`` of ``job`` are going to be
+        deleted. ``stable`` is kept for when the deletion is resumed.
+        """
+        fingerprint = job_fingerprint(job, self.creation_time)
+        with self._lock:
+            self._load()[job.name or ''] = {
+                'fingerprint': fingerprint, 'stable': stable,
+                'pending': list(names)}
+            self._append({'job': job.name or '', 'fingerprint': fingerprint,
+                          'stable': stable, 'delete': list(names)})
+
+    def done(self, job, names):
+        """Check off the given archives as deleted."""
+        with self._lock:
+            plan = self._load().get(job.name or '')
+            if plan:
+                done = set(names)
+                plan['pending'] = [
+                    n for n in plan['pending'] if n not in done]
+            self._append({'job': job.name or '', 'done': list(names)})
+
+    def finish(self, job):
+        """Record that all archives of ``job`` have been deleted."""
+        with self._lock:
+            plans = self._load()
+            plans.pop(job.name or '', None)
+            if plans:
+                self._append({'job': job.name or '', 'finished': True})
+                return
+            try:
+                os.unlink(self.filename)
+            except OSError:
+                pass
@@ -0,0 +1,168 @@
+"""Drive multiple child processes from a single thread.
+
+Rather than blocking until a process has finished, processes are
+registered with a ``ProcessLoop``, which uses ``select()`` to read the
+output of all of them as it arrives. This allows any number of tarsnap
+and hook processes to be in flight at the same time, without a thread
+per process.
+"""
+
+import os
+import re
+import errno
+import select
+
+
+__all__ = ('ProcessLoop', 'Process', 'TarsnapProcess', 'ShellProcess',)
+
+
+PASSPHRASE_PROMPT = re.compile('Please enter passphrase for keyfile .*?:')
+
+
+class Process(object):
+    """A child process whose output is read by a ``ProcessLoop``.
+
+    ``on_output`` is called with each chunk of output as it arrives.
+    Unless ``keep_output`` is disabled, the output is also collected,
+    to be returned by ``get_output()``.
+    """
+
+    def __init__(self, fd, on_output=None, keep_output=True):
+        self.fd = fd
+        self.on_output = on_output
+        self.keep_output = keep_output
+        self.output = []
+        self.exitstatus = None
+        self.finished = False
+
+    def feed(self, data):
+        if self.keep_output:
+            self.output.append(data)
+        if self.on_output:
+            self.on_output(data)
+
+    def finish(self):
+        self.finished = True
+
+    def get_output(self):
+        return ''.join(self.output)
+
+
+class TarsnapProcess(Process):
+    """Runs tarsnap in a pseudo terminal, answering the passphrase
+    prompt if there is one by calling ``get_passphrase``.
+
+    As with ``TarsnapBackend``, if a prompt was answered, the output
+    only includes what tarsnap printed after the prompt.
+    """
+
+    def __init__(self, args, env=None, get_passphrase=None, **kwargs):
+        import pexpect
+        self.child = pexpect.spawn(args[0], args[1:], env=env, timeout=None)
+        Process.__init__(self, self.child.child_fd, **kwargs)
+        self.get_passphrase = get_passphrase
+        # Until we know whether there is a prompt, output is held back
+        self._pending = ''
+
+    def feed(self, data):
+        if self._pending is None:
+            return Process.feed(self, data)
+
+        self._pending += data
+        if PASSPHRASE_PROMPT.search(self._pending):
+            # Drop everything up to, and including the prompt
+            self._pending = None
+            self.child.sendline(self.get_passphrase())
+        elif '\n' in self._pending:
+            # The prompt is the first thing tarsnap asks for; once a
+            # full line of output has been received, there is none.
+            data, self._pending = self._pending, None
+            Process.feed(self, data)
+
+    def finish(self):
+        if self._pending:
+            data, self._pending = self._pending, None
+            Process.feed(self, data)
+        self.child.close()
+        self.exitstatus = self.child.exitstatus
+        Process.finish(self)
+
+
+class ShellProcess(Process):
+    """Runs ``cmdline`` using the shell, with stdout and stderr
+    combined.
+    """
+
+    def __init__(self, cmdline, **kwargs):
+        import subprocess
+        self.popen = subprocess.Popen(
+            cmdline, shell=True, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+        Process.__init__(self, self.popen.stdout.fileno(), **kwargs)
+
+    def finish(self):
+        self.popen.stdout.close()
+        self.exitstatus = self.popen.wait()
+        Process.finish(self)
+
+
+class ProcessLoop(object):
+    """Reads the output of all registered processes, until they exit.
+    """
+
+    READ_SIZE = 65536
+
+    def __init__(self):
+        self._active = {}
+
+    def add(self, process):
+        self._active[process.fd] = process
+        return process
+
+    def spawn_tarsnap(self, args, **kwargs):
+        return self.add(TarsnapProcess(args, **kwargs))
+
+    def spawn_shell(self, cmdline, **kwargs):
+        return self.add(ShellProcess(cmdline, **kwargs))
+
+    def __len__(self):
+        return len(self._active)
+
+    def step(self, timeout=None):
+        """Wait up to ``timeout`` seconds for output from any of the
+        processes, and process it.
+        """
+        if not self._active:
+            return
+        try:
+            readable, _, _ = select.select(
+                list(self._active), [], [], timeout)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        for fd in readable:
+            process = self._active[fd]
+            try:
+                data = os.read(fd, self.READ_SIZE)
+            except OSError, e:
+                # A pseudo terminal signals EOF this way
+                if e.errno != errno.EIO:
+                    raise
+                data = ''
+            if data:
+                process.feed(data)
+            else:
+                del self._active[fd]
+                process.finish()
+
+    def run(self, processes=None):
+        """Run until the given processes, or all of them, have
+        finished.
+        """
+        if processes is None:
+            while self._active:
+                self.step()
+        else:
+            while not all(p.finished for p in processes):
+                self.step()
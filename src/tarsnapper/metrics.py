@@ -0,0 +1,264 @@
+"""Collect timings and counts of a run, for monitoring.
+
+Every tarsnap (and hook) invocation is recorded with its wall time,
+exit status and the number of bytes it printed. For each job, the
+archives matched, kept and deleted are counted, and the time spent in
+each phase is measured: estimating the size of the backup, listing
+the archives, classifying them, planning which of them to keep,
+creating a new backup and deleting.
+
+The results can be appended to a file as JSON lines, one for each
+event as it happens, and/or written in the format read by the textfile
+collector of the Prometheus node exporter once the run is complete.
+"""
+
+import os
+from os import path
+import time
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+__all__ = ('Metrics', 'command_name',)
+
+
+# The kind of tarsnap invocation, by the first of these flags it uses
+COMMANDS = (
+    ('--dry-run', 'estimate'),
+    ('-c', 'create'),
+    ('-d', 'delete'),
+    ('--list-archives', 'list'),
+    ('--print-stats', 'stats'),
+)
+
+
+def command_name(arguments):
+    """Return the kind of tarsnap invocation with the given
+    ``arguments``.
+    """
+    for flag, name in COMMANDS:
+        if flag in arguments:
+            return name
+    return 'other'
+
+
+def _escape(value):
+    """Escape a Prometheus label value."""
+    return value.replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (k, _escape(str(v)))
+                    for k, v in sorted(labels.items()))
+
+
+class Metrics(object):
+    """Collects the metrics of a run, optionally writing them as JSON
+    lines to ``log_filename``, and for Prometheus to
+    ``textfile_filename``.
+
+    Calls and phases are attributed to the job set with ``job()`` in
+    the current thread.
+    """
+
+    def __init__(self, log_filename=None, textfile_filename=None, log=None):
+        self.log_filename = log_filename
+        self.textfile_filename = textfile_filename
+        self.log = log
+        self.started = time.time()
+        # (job, command, status) => [calls, seconds, output bytes]
+        self.calls = OrderedDict()
+        # job => {'seconds': {phase: seconds}, 'archives': {what: count}}
+        self.jobs = OrderedDict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _warn(self, message):
+        if self.log:
+            self.log.warning('Metrics: %s' % message)
+
+    def _current_job(self):
+        return getattr(self._local, 'job', None) or ''
+
+    def _job_metrics(self, job):
+        if job not in self.jobs:
+            self.jobs[job] = {'seconds': OrderedDict(),
+                              'archives': OrderedDict()}
+        return self.jobs[job]
+
+    def _event(self, event, **record):
+        """Append a record to the JSON lines file."""
+        if not self.log_filename:
+            return
+        import json
+        record['event'] = event
+        record['time'] = time.time()
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self.log_filename, 'ab')
+                self._file.write(json.dumps(record, sort_keys=True) + '\n')
+                self._file.flush()
+            except EnvironmentError, e:
+                self._warn('cannot write %s: %s' % (self.log_filename, e))
+                self.log_filename = None
+
+    @contextmanager
+    def job(self, job):
+        """Attribute everything happening in the current thread to
+        ``job`` while in this context.
+        """
+        name = job.name or ''
+        previous = getattr(self._local, 'job', None)
+        self._local.job = name
+        start = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            self._local.job = previous
+            with self._lock:
+                metrics = self._job_metrics(name)
+                metrics['seconds']['total'] = \
+                    metrics['seconds'].get('total', 0) + seconds
+                record = {'seconds': dict(metrics['seconds']),
+                          'archives': dict(metrics['archives'])}
+            self._event('job', job=name, **record)
+
+    @contextmanager
+    def phase(self, name):
+        """Measure the time spent in the phase ``name``. The time spent
+        in phases nested within is not included.
+        """
+        stack = self._local.__dict__.setdefault('phases', [])
+        # Time spent in nested phases, to be subtracted
+        stack.append(0)
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            seconds = elapsed - stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                phases = self._job_metrics(self._current_job())['seconds']
+                phases[name] = phases.get(name, 0) + seconds
+
+    def timed(self, iterable, phase):
+        """Iterate over ``iterable``, counting the time spent waiting
+        for each item towards ``phase``.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.phase(phase):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, what, value):
+        """Add ``value`` to the number of ``what`` archives of the
+        current job.
+        """
+        with self._lock:
+            archives = self._job_metrics(self._current_job())['archives']
+            archives[what] = archives.get(what, 0) + value
+
+    @contextmanager
+    def call(self, command):
+        """Record an invocation of ``command`` (see ``command_name()``,
+        or ``hook``). Its output is counted by adding to the
+        ``output_bytes`` item of the dict this yields. The exit status
+        is taken from the ``exitstatus`` of an exception, if raised.
+        """
+        record = {'output_bytes': 0, 'status': 0}
+        start = time.time()
+        try:
+            yield record
+        except Exception, e:
+            record['status'] = getattr(e, 'exitstatus', None) or 1
+            raise
+        finally:
+            seconds = time.time() - start
+            job = self._current_job()
+            with self._lock:
+                totals = self.calls.setdefault(
+                    (job, command, record['status']), [0, 0, 0])
+                totals[0] += 1
+                totals[1] += seconds
+                totals[2] += record['output_bytes']
+            self._event('call', job=job, command=command, seconds=seconds,
+                        **record)
+
+    def format_textfile(self, success=None):
+        """Return the metrics in the Prometheus text format."""
+        lines = []
+
+        def metric(name, help, samples):
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s gauge' % name)
+            for labels, value in samples:
+                value = repr(value) if isinstance(value, float) else \
+                    str(value)
+                if labels:
+                    lines.append('%s{%s} %s' % (name, _labels(**labels),
+                                                value))
+                else:
+                    lines.append('%s %s' % (name, value))
+
+        calls = [(dict(job=j, command=c, status=s), v)
+                 for (j, c, s), v in self.calls.items()]
+        metric('tarsnapper_calls', 'Number of tarsnap and hook invocations.',
+               [(l, v[0]) for l, v in calls])
+        metric('tarsnapper_call_seconds',
+               'Wall time spent in tarsnap and hook invocations.',
+               [(l, v[1]) for l, v in calls])
+        metric('tarsnapper_call_output_bytes',
+               'Output printed by tarsnap and hook invocations.',
+               [(l, v[2]) for l, v in calls])
+        metric('tarsnapper_job_seconds', 'Time spent per job and phase.',
+               [(dict(job=job, phase=phase), seconds)
+                for job, m in self.jobs.items()
+                for phase, seconds in m['seconds'].items()])
+        metric('tarsnapper_job_archives',
+               'Number of archives matched, kept and deleted per job.',
+               [(dict(job=job, archives=what), count)
+                for job, m in self.jobs.items()
+                for what, count in m['archives'].items()])
+        metric('tarsnapper_run_start_timestamp_seconds',
+               'When the run started.', [({}, self.started)])
+        metric('tarsnapper_run_seconds', 'How long the run took.',
+               [({}, time.time() - self.started)])
+        if success is not None:
+            metric('tarsnapper_run_success',
+                   'Whether the run completed without errors.',
+                   [({}, int(success))])
+        return '\n'.join(lines) + '\n'
+
+    def close(self, success=None):
+        """Finish the run, writing the textfile if requested."""
+        self._event('run', seconds=time.time() - self.started,
+                    success=success)
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        if self.textfile_filename:
+            # The collector may read the file at any time, so it needs
+            # to be replaced atomically.
+            directory = path.dirname(self.textfile_filename) or '.'
+            try:
+                fd, tmp = tempfile.mkstemp(dir=directory, prefix='.metrics')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(self.format_textfile(success))
+                os.chmod(tmp, 0644)
+                os.rename(tmp, self.textfile_filename)
+            except EnvironmentError, e:
+                self._warn('cannot write %s: %s' % (
+                    self.textfile_filename, e))
@@ -0,0 +1,90 @@
+"""Run the jobs of a command concurrently, using a pool of threads.
+
+Jobs sharing a serialization group (the ``group`` option in the config
+file) are run one after another, in the order given. All other jobs may
+run at the same time as any other job.
+
+Given a ``weight`` for each job, such as the number of bytes it is
+expected to upload, the heaviest groups are started first, so that a
+large job does not end up running on its own after all others are done.
+"""
+
+import sys
+import threading
+from Queue import Queue, Empty
+from collections import OrderedDict
+
+
+__all__ = ('run_jobs', 'group_jobs', 'order_jobs',)
+
+
+def group_jobs(jobs):
+    """Return a list of lists of jobs that need to be run one after
+    another.
+    """
+    groups = OrderedDict()
+    for job in jobs:
+        key = ('group', job.group) if job.group else ('job', id(job))
+        groups.setdefault(key, []).append(job)
+    return groups.values()
+
+
+def order_groups(jobs, weight=None):
+    """Return the groups of ``jobs``, heaviest first according to the
+    ``weight`` function. Groups of equal weight keep their order.
+    """
+    groups = group_jobs(jobs)
+    if weight is not None:
+        groups.sort(key=lambda group: sum(weight(job) for job in group),
+                    reverse=True)
+    return groups
+
+
+def order_jobs(jobs, weight=None):
+    """Return ``jobs`` in the order ``run_jobs`` would start them."""
+    return [job for group in order_groups(jobs, weight) for job in group]
+
+
+def run_jobs(jobs, func, workers, log, weight=None):
+    """Call ``func`` for each job in ``jobs``, using up to ``workers``
+    threads, starting with the heaviest according to ``weight``.
+
+    If ``func`` raises an exception, no further jobs are started, and
+    once those already running have finished, the first exception is
+    re-raised.
+    """
+    queue = Queue()
+    for group in order_groups(jobs, weight):
+        queue.put(group)
+    errors = []
+
+    def worker():
+        while not errors:
+            try:
+                group = queue.get_nowait()
+            except Empty:
+                return
+            for job in group:
+                if errors:
+                    return
+                try:
+                    func(job)
+                except Exception:
+                    errors.append(sys.exc_info())
+                    return
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(workers, queue.qsize()))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        # Joining with a timeout keeps the main thread responsive
+        # to KeyboardInterrupt.
+        while thread.is_alive():
+            thread.join(1)
+
+    if errors:
+        if len(errors) > 1:
+            log.debug('%d jobs failed, reporting the first' % len(errors))
+        raise errors[0][0], errors[0][1], errors[0][2]
@@ -0,0 +1,128 @@
+"""Remember which jobs do not currently need to be expired.
+
+Which archives ``expire.expire`` keeps depends only on the deltas and
+on the dates of the archives relative to the most recent one, not on
+the current time. Once a job has been expired, and expiring it again
+would not delete anything, nothing changes until an archive is added
+or removed. The jobs for which this is the case are recorded, so that
+later runs can skip listing and planning them entirely.
+
+Archives created by tarsnapper itself invalidate the jobs they may
+belong to. Changes made by anyone else can only be noticed by querying
+the server, so an entry is trusted for ``ttl`` seconds at most.
+"""
+
+import os
+from os import path
+import time
+import hashlib
+import tempfile
+import threading
+
+from expire import timedelta_micros
+
+
+__all__ = ('ExpirySchedule', 'job_fingerprint',)
+
+
+def job_fingerprint(job, creation_time=False):
+    """Return a string identifying the settings of ``job`` that
+    determine which archives are kept.
+    """
+    key = [job.target or '', job.dateformat or '',
+           ','.join(job.aliases or []),
+           ','.join(str(timedelta_micros(d)) for d in job.sorted_deltas),
+           'creation-time' if creation_time else '']
+    return hashlib.sha1("\n".join(key)).hexdigest()
+
+
+def job_prefixes(job):
+    """Return the literal prefixes of the archive names ``job`` uses."""
+    prefixes = []
+    for name in [job.name] + (job.aliases or []):
+        target = job.target_template.safe_substitute({'name': name})
+        prefixes.append(target.split('$', 1)[0])
+    return prefixes
+
+
+class ExpirySchedule(object):
+    """The set of jobs known not to need expiring, stored in
+    ``filename``.
+    """
+
+    def __init__(self, filename, ttl=None, creation_time=False, log=None):
+        self.filename = filename
+        self.ttl = ttl
+        self.creation_time = creation_time
+        self.log = log
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _warn(self, message):
+        if self.log:
+            self.log.warning('Expiry schedule %s: %s' % (
+                self.filename, message))
+
+    def _load(self):
+        if self._entries is None:
+            import json
+            self._entries = {}
+            try:
+                with open(self.filename, 'rb') as f:
+                    entries = json.load(f)
+            except IOError:
+                return self._entries
+            except ValueError:
+                self._warn('ignoring invalid file')
+                return self._entries
+            if isinstance(entries, dict):
+                self._entries = entries
+        return self._entries
+
+    def _save(self):
+        import json
+        directory = path.dirname(self.filename) or '.'
+        try:
+            if not path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.expiry')
+            with os.fdopen(fd, 'wb') as f:
+                json.dump(self._entries, f)
+            os.rename(tmp, self.filename)
+        except EnvironmentError, e:
+            self._warn('cannot write: %s' % e)
+
+    def is_clean(self, job):
+        """Return whether ``job`` is known not to need expiring."""
+        with self._lock:
+            entry = self._load().get(job.name or '')
+        if not entry or entry.get('fingerprint') != job_fingerprint(
+                job, self.creation_time):
+            return False
+        if self.ttl is not None and time.time() - entry['time'] > self.ttl:
+            return False
+        return True
+
+    def set_clean(self, job, clean=True):
+        """Record whether ``job`` needs to be expired the next time."""
+        with self._lock:
+            entries = self._load()
+            if clean:
+                entries[job.name or ''] = {
+                    'fingerprint': job_fingerprint(job, self.creation_time),
+                    'prefixes': job_prefixes(job),
+                    'time': time.time()}
+            elif entries.pop(job.name or '', None) is None:
+                return
+            self._save()
+
+    def invalidate(self, name):
+        """Forget about all jobs the archive ``name`` may belong to."""
+        with self._lock:
+            entries = self._load()
+            dirty = [job for job, entry in entries.items()
+                     if any(name.startswith(p) for p in entry['prefixes'])]
+            if dirty:
+                for job in dirty:
+                    del entries[job]
+                self._save()
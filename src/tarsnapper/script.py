@@ -1,22 +1,30 @@
-import json
 import sys, os
-from os import path
-import urllib2
-import uuid
-import subprocess
-from StringIO import StringIO
 import re
-from string import Template
+import time
+from os import path
+import itertools
+from collections import deque, OrderedDict
 from datetime import datetime, timedelta
 import logging
 import argparse
-import dateutil.parser
-import getpass
-
-import pexpect
+import threading
+import signal
 
 import expire, config
+from cache import ArchiveCache, cache_filename
+from schedule import ExpirySchedule
+from journal import DeletionJournal
+from classify import ArchiveIndex, PARTIAL_SUFFIX
+from catalog import ArchiveCatalog, job_fingerprints
 from config import Job
+from dates import DEFAULT_DATEFORMAT, parse_date, compile_dateformat
+from runner import run_jobs, order_jobs
+from loop import ProcessLoop, PASSPHRASE_PROMPT
+from metrics import Metrics, command_name
+from sources import check_sources, TIMEOUT
+from daemon import JobQueue, job_interval
+from stats import (
+    EstimateCache, StatsDatabase, parse_print_stats, format_bytes)
 
 
 class ArgumentError(Exception):
@@ -24,7 +32,10 @@ class ArgumentError(Exception):
 
 
 class TarsnapError(Exception):
-    pass
+
+    def __init__(self, message, exitstatus=None):
+        Exception.__init__(self, message)
+        self.exitstatus = exitstatus
 
 
 class TarsnapBackend(object):
@@ -32,9 +43,22 @@ class TarsnapBackend(object):
 
     One of the reasons this is designed as a class is to allow the backend
     to mimimize the calls to "tarsnap --list-archives" by caching the result.
+
+    The backend may be used by multiple threads at once. Since tarsnap
+    locks its cache directory, only one tarsnap process that needs it
+    is run at a time.
     """
 
-    def __init__(self, log, options, dryrun=False):
+    # Default limits for the number of archives deleted by a single
+    # tarsnap call, and for the combined length of their names.
+    DELETE_BATCH_SIZE = 100
+    DELETE_BATCH_BYTES = 32768
+
+    def __init__(self, log, options, dryrun=False, delete_batch_size=None,
+                 delete_batch_bytes=None, archive_cache=None, refresh=False,
+                 use_creation_time=False, expiry_schedule=None,
+                 deletion_journal=None, metrics=None, estimates=None,
+                 stats_db=None, catalog=None):
         """
         ``options`` - options to pass to each tarsnap call
         (a list of key value pairs).
@@ -43,17 +67,74 @@ class TarsnapBackend(object):
         delete backups. This is a global option rather than a method
         specific one, because once the cached list of archives is tainted
         with simulated data, you don't really want to run in non-dry mode.
+
+        ``delete_batch_size`` and ``delete_batch_bytes`` limit how many
+        archives are deleted with a single tarsnap call.
+
+        ``archive_cache`` is an optional ``ArchiveCache`` instance, which
+        will be used instead of querying the server, unless ``refresh``
+        is set.
+
+        With ``use_creation_time``, the creation time of each archive as
+        reported by tarsnap is used as its date, rather than parsing the
+        archive name.
+
+        ``expiry_schedule`` is an optional ``ExpirySchedule``, used to
+        skip expiring jobs which are known to have nothing to delete,
+        unless ``refresh`` is set.
+
+        ``deletion_journal`` is an optional ``DeletionJournal``, which
+        allows an interrupted expire run to be resumed.
+
+        ``metrics`` is the ``Metrics`` instance that tarsnap calls and
+        the phases of each job are recorded in.
+
+        ``estimates`` is an optional ``EstimateCache``. If given, the
+        bytes each new backup uploads are recorded in it, and
+        ``estimate()`` becomes available.
+
+        ``stats_db`` is an optional ``StatsDatabase``, in which the
+        statistics tarsnap prints about the archives created and
+        deleted are recorded.
+
+        ``catalog`` is an optional ``ArchiveCatalog``, which replaces
+        ``archive_cache``: rather than the list of archives, the backups
+        of each job are kept, and read with indexed queries.
         """
         self.log = log
         self.options = options
         self.dryrun = dryrun
+        self.delete_batch_size = delete_batch_size or self.DELETE_BATCH_SIZE
+        self.delete_batch_bytes = delete_batch_bytes or self.DELETE_BATCH_BYTES
+        self.archive_cache = archive_cache
+        self.refresh = refresh
+        self.use_creation_time = use_creation_time
+        self.expiry_schedule = expiry_schedule
+        self._use_schedule = expiry_schedule is not None and not refresh
+        self.deletion_journal = deletion_journal
+        self.metrics = metrics or Metrics()
+        self.estimates = estimates
+        self.stats_db = stats_db
+        self._print_stats = estimates is not None or stats_db is not None
+        self.catalog = catalog
+        self._catalog_synced = False
+        self._creation_times = {}
         self._queried_archives = None
         self._known_archives = []
+        self._jobs = []
+        self._index = None
+        # The classifier of the catalog, and the index telling which
+        # job partial archives belong to, built for the registered jobs
+        self._classifier = None
+        self._partial_index = None
         self.key_passphrase = None
+        self._lock = threading.RLock()
+        self._cachedir_lock = threading.Lock()
+        self._passphrase_lock = threading.Lock()
 
-    def call(self, *arguments):
-        """
-        ``arguments`` is a single list of strings.
+    def _tarsnap_args(self, arguments):
+        """Return the full command line to run tarsnap with the given
+        ``arguments``.
         """
         call_with = ['tarsnap']
         for option in self.options:
@@ -63,9 +144,27 @@ class TarsnapBackend(object):
             for value in option[1:]:
                 call_with.append(value)
         call_with.extend(arguments)
-        return self._exec_tarsnap(call_with)
+        return call_with
+
+    def call(self, *arguments):
+        """
+        ``arguments`` is a single list of strings.
+        """
+        call_with = self._tarsnap_args(arguments)
+        if '--list-archives' in arguments:
+            # Does not need the cache directory
+            return self._exec_tarsnap_recorded(call_with)
+        with self._cachedir_lock:
+            return self._exec_tarsnap_recorded(call_with)
+
+    def _exec_tarsnap_recorded(self, args):
+        with self.metrics.call(command_name(args)) as record:
+            out = self._exec_tarsnap(args)
+            record['output_bytes'] = len(out or '')
+        return out
 
     def _exec_tarsnap(self, args):
+        import pexpect
         self.log.debug("Executing: %s" % " ".join(args))
         env = os.environ
         env['LANG'] = 'C' # ensure the tarsnap output is in english
@@ -84,16 +183,70 @@ class TarsnapBackend(object):
 
         if child.exitstatus != 0:
             raise TarsnapError("tarsnap failed with status {0}:{1}{2}".format(
-                        child.exitstatus, os.linesep, out))
+                        child.exitstatus, os.linesep, out), child.exitstatus)
         return out
 
+    def call_lines(self, *arguments):
+        """Like ``call()``, but returns an iterator over the lines of
+        output as tarsnap prints them.
+        """
+        args = self._tarsnap_args(arguments)
+        with self.metrics.call(command_name(args)) as record:
+            for line in self._stream_tarsnap(args):
+                record['output_bytes'] += len(line)
+                yield line
+
+    def _stream_tarsnap(self, args):
+        import pexpect
+        self.log.debug("Executing: %s" % " ".join(args))
+        env = os.environ
+        env['LANG'] = 'C' # ensure the tarsnap output is in english
+        child = pexpect.spawn(args[0], args[1:], env=env, timeout=None)
+
+        if self.log.isEnabledFor(logging.DEBUG):
+            child.logfile = sys.stdout
+
+        # Keep the last few lines for the error message
+        tail = deque(maxlen=20)
+
+        # look for the passphrase prompt, or the first line of output
+        index = child.expect([PASSPHRASE_PROMPT, '\n', pexpect.EOF])
+        if index == 0:
+            child.sendline(self._get_key_passphrase())
+        elif index == 1:
+            tail.append(child.before)
+            yield child.before + '\n'
+        elif child.before:
+            tail.append(child.before)
+            yield child.before
+        if index != 2:
+            for line in child:
+                tail.append(line)
+                yield line
+        child.close()
+
+        if child.exitstatus != 0:
+            raise TarsnapError("tarsnap failed with status {0}:{1}{2}".format(
+                        child.exitstatus, os.linesep, "".join(tail)),
+                        child.exitstatus)
+
     def _get_key_passphrase(self):
-        if not self.key_passphrase:
-            self.key_passphrase = getpass.getpass('Passphrase for the tarsnap key: ')
+        with self._passphrase_lock:
+            if not self.key_passphrase:
+                import getpass
+                self.key_passphrase = getpass.getpass('Passphrase for the tarsnap key: ')
         return self.key_passphrase
         
+    def exec_hook(self, cmdline):
+        """Run one of the commands a job defines to be run before or
+        after the backup.
+        """
+        with self.metrics.call('hook'):
+            self._exec_util(cmdline)
+
     def _exec_util(self, cmdline, shell=False):
         # TODO: can this be merged with _exec_tarsnap into something generic?
+        import subprocess
         self.log.debug("Executing: %s" % cmdline)
         p = subprocess.Popen(cmdline, shell=True)
         p.communicate()
@@ -108,66 +261,373 @@ class TarsnapBackend(object):
         means that when we create a new backup, we subsequently don't need
         to requery the server.
         """
-        self._known_archives.append(name)
+        with self._lock:
+            self._known_archives.append(name)
+            created = None
+            if self.use_creation_time:
+                # tarsnap reports creation times in local time
+                created = self._creation_times[name] = datetime.now()
+            if self._index is not None:
+                self._index.add(name, created)
+            if self.catalog is not None and not self.dryrun:
+                classify, fingerprints = self._catalog_classifier()
+                self.catalog.add(name, created, classify, fingerprints)
+            if self.archive_cache and not self.dryrun:
+                self.archive_cache.add(self._format_listing(name, created))
+            if self.expiry_schedule and not self.dryrun:
+                self.expiry_schedule.invalidate(name)
+
+    def _remove_archives(self, names):
+        """Forget about the given archives, after they have been
+        deleted.
+        """
+        names = set(names)
+        with self._lock:
+            if self._queried_archives is not None:
+                self._queried_archives = [
+                    a for a in self._queried_archives if a not in names]
+            self._known_archives = [
+                a for a in self._known_archives if a not in names]
+            for name in names:
+                self._creation_times.pop(name, None)
+            if self._index is not None:
+                for name in names:
+                    self._index.remove(name)
+            if self.catalog is not None and not self.dryrun:
+                self.catalog.remove(names)
+            if self.archive_cache and not self.dryrun:
+                self.archive_cache.remove(names)
+
+    def _format_listing(self, name, created=None):
+        """Return a line as printed by --list-archives for the archive
+        ``name``.
+        """
+        if created is None:
+            return name
+        return '%s\t%s' % (name, created.strftime(CREATION_TIME_FORMAT))
+
+    def _parse_listing(self, lines):
+        """Yield a ``(name, creation time)`` tuple for each of the
+        given lines, as printed by --list-archives (or stored in the
+        archive cache). The creation time is ``None``, unless we are
+        using creation times.
+        """
+        creation_time = compile_dateformat(CREATION_TIME_FORMAT)
+        for line in lines:
+            name = line.rstrip()
+            if not name:
+                continue
+            created = None
+            if '\t' in name:
+                # Filter out extraneous info if tarsnap was run with
+                # verbose flag, now or when the cache was written
+                name, info = name.split('\t', 1)
+                if self.use_creation_time:
+                    try:
+                        created = creation_time.parse(info.split('\t')[0])
+                    except ValueError, e:
+                        self.log.error("Ignoring creation time of '%s': %s" % (
+                            name, e))
+            yield name, created
+
+    def _query_archives(self):
+        """Yield the archives as returned by --list-archives, while
+        tarsnap is printing them, as ``(name, creation time)`` tuples.
+        If an archive cache is used, they are written to it along the
+        way.
+        """
+        arguments = ['--list-archives']
+        if self.use_creation_time and not ['v'] in self.options:
+            arguments.append('-v')
+        lines = self.call_lines(*arguments)
+        if self.archive_cache and not self.dryrun:
+            lines = self.archive_cache.stream(l.rstrip() for l in lines)
+
+        known = set(self._known_archives)
+        seen_known = set()
+        for name, created in self._parse_listing(lines):
+            if name in known:
+                seen_known.add(name)
+            yield name, created
+
+        if self.archive_cache and not self.dryrun:
+            for name in self._known_archives:
+                if name not in seen_known:
+                    self.archive_cache.add(self._format_listing(
+                        name, self._creation_times.get(name)))
+        # Once we have queried the server, the archive cache is fresh.
+        self.refresh = False
+
+    def _load_archives(self):
+        """Return an iterator over the archives as ``(name, creation
+        time)`` tuples, read from the archive cache if it is used and
+        valid, or otherwise queried from the server.
+        """
+        if self.archive_cache and not self.refresh:
+            cached = self.archive_cache.iter()
+            if cached is not None:
+                self.log.debug('Using cached list of archives from %s' %
+                               self.archive_cache.filename)
+                return self.metrics.timed(
+                    self._parse_listing(cached), 'listing')
+        return self.metrics.timed(self._query_archives(), 'listing')
 
     def get_archives(self):
         """A list of archives as returned by --list-archives. Queried
         the first time it is accessed, and then subsequently cached.
+
+        If an archive cache is used, the list is read from there instead,
+        as long as it is still valid.
         """
-        if self._queried_archives is None:
-            response = StringIO(self.call('--list-archives'))
-            self._queried_archives = [l.rstrip() for l in response.readlines()]
-            if ['v'] in self.options:
-                # Filter out extraneous info if tarsnap was run with
-                # verbose flag
-                self._queried_archives = [
-                    l.rsplit('\t', 1)[0] for l in self._queried_archives]
-        return self._queried_archives + self._known_archives
+        with self._lock:
+            if self._queried_archives is None:
+                archives = []
+                for name, created in self._load_archives():
+                    archives.append(name)
+                    if created is not None:
+                        self._creation_times[name] = created
+                self._queried_archives = archives
+            return self._queried_archives + self._known_archives
     archives = property(get_archives)
 
+    def iter_entries(self):
+        """Return an iterator over ``(name, creation time)`` tuples of
+        all archives. Unless the list of archives has already been
+        loaded, it is not kept in memory, but streamed from tarsnap (or
+        the archive cache) as it is being consumed.
+        """
+        with self._lock:
+            if self._queried_archives is not None:
+                entries = ((name, self._creation_times.get(name))
+                           for name in self._queried_archives)
+            else:
+                entries = self._load_archives()
+            known = [(name, self._creation_times.get(name))
+                     for name in self._known_archives]
+            return itertools.chain(entries, known)
+
+    def iter_archives(self):
+        """Like ``get_archives()``, but returns an iterator; see
+        ``iter_entries()``.
+        """
+        return (name for name, _ in self.iter_entries())
+
+    def add_jobs(self, jobs):
+        """Register the jobs which will be processed.
+
+        The list of archives is classified for all registered jobs at
+        once, the first time the backups of any of them are requested.
+        Registering another job after that requires the list to be
+        loaded again.
+        """
+        with self._lock:
+            for job in jobs:
+                if job not in self._jobs:
+                    self._jobs.append(job)
+                    self._index = None
+                    self._classifier = None
+                    self._partial_index = None
+                    self._catalog_synced = False
+
+    def set_jobs(self, jobs):
+        """Replace the registered jobs with ``jobs``, as after
+        reloading the config file.
+        """
+        with self._lock:
+            self._jobs = []
+            self._index = None
+            self._classifier = None
+            self._partial_index = None
+            self._catalog_synced = False
+            self.add_jobs(jobs)
+
+    def forget_archives(self):
+        """Forget the list of archives, so that it is queried from the
+        server again the next time it is needed.
+        """
+        with self._lock:
+            self._queried_archives = None
+            self._known_archives = []
+            self._creation_times = {}
+            self._index = None
+            self._catalog_synced = False
+            self.refresh = True
+
+    def get_index(self, job=None):
+        """Return the ``ArchiveIndex`` of all registered jobs, building
+        it if necessary. ``job`` will be registered if it isn't yet.
+        """
+        with self._lock:
+            if job is not None:
+                self.add_jobs([job])
+            if self._index is None:
+                # Each archive is classified as it is read, so only
+                # those belonging to one of the jobs are kept in memory.
+                index = ArchiveIndex(
+                    self._jobs, exclusive=self.use_creation_time)
+                for name, created in self.iter_entries():
+                    index.add(name, created)
+                self._index = index
+            return self._index
+
+    def _catalog_classifier(self):
+        """Return the function classifying archives for the catalog,
+        and the fingerprints of the registered jobs. Both are kept until
+        the registered jobs change.
+        """
+        with self._lock:
+            if self._classifier is not None:
+                return self._classifier
+            index = ArchiveIndex(self._jobs, exclusive=self.use_creation_time)
+            fingerprints = job_fingerprints(self._jobs, self.use_creation_time)
+
+            def classify(name, created):
+                backups = []
+                for job, date in index.classify(name):
+                    date = self._parse_backup_date(
+                        job, name, date if created is None else created)
+                    if date is not None:
+                        backups.append((job.name or '', date))
+                return backups
+            self._classifier = classify, fingerprints
+            return self._classifier
+
+    def _sync_catalog(self, job):
+        """Make sure the catalog is reconciled with the server, if it
+        is out of date, and has classified the archives for ``job``,
+        and all other registered jobs.
+        """
+        with self._lock:
+            self.add_jobs([job])
+            if self._catalog_synced:
+                return
+            classify, fingerprints = self._catalog_classifier()
+            if self.refresh or not self.catalog.is_fresh():
+                # The backups made since are listed as well, unless the
+                # listing is out of date already.
+                known = [(name, self._creation_times.get(name))
+                         for name in self._known_archives]
+                self.catalog.reconcile(itertools.chain(
+                    self.metrics.timed(self._query_archives(), 'listing'),
+                    known), classify, fingerprints)
+            else:
+                self.log.debug('Using the catalog of archives in %s' %
+                               self.catalog.filename)
+            self.catalog.classify_jobs(classify, fingerprints)
+            self._catalog_synced = True
+
     def get_backups(self, job):
         """Return a dict of backups that exist for the given job, by
         parsing the list of archives.
         """
-        # Assemble regular expressions that matche the job's target
-        # filenames, including those based on it's aliases.
-        unique = uuid.uuid4().hex
-        regexes = []
-        for possible_name in [job.name] + (job.aliases or []):
-            target = Template(job.target).substitute(
-                {'name': possible_name, 'date': unique})
-            regexes.append(re.compile("^%s$" %
-                        re.escape(target).replace(unique, '(?P<date>.*?)')))
+        with self.metrics.phase('classifying'):
+            if self.catalog is not None:
+                backups = self._get_catalog_backups(job)
+            else:
+                backups = self._get_backups(job)
+        self._check_matched(job, backups)
+        return backups
+
+    def list_backups(self, job):
+        """Return the backups of ``job`` as ``(name, date)`` tuples,
+        the newest first.
+        """
+        if self.catalog is not None and not self.dryrun:
+            with self.metrics.phase('classifying'):
+                self._sync_catalog(job)
+                backups = self.catalog.list_backups(
+                    job.name or '', newest_first=True)
+            self._check_matched(job, backups)
+            return backups
+        backups = self.get_backups(job).items()
+        backups.sort(key=lambda backup: backup[1], reverse=True)
+        return backups
+
+    def _check_matched(self, job, backups):
+        """With creation times, archive names still need a date in a
+        format we can match; point that out if a job has no backups.
+        """
+        if self.use_creation_time and not backups:
+            self.log.warning(("No archives match '%s'; with --creation-time, "
+                              "their names need to contain a date in the "
+                              "job's dateformat, or a common layout such as "
+                              "%%Y-%%m-%%d") % (job.name or job.target))
+
+    def partial_archives(self, job):
+        """Return the names of the archives of ``job`` left behind by
+        interrupted backups, which tarsnap stored with a ``.part``
+        suffix.
+
+        As they are deleted without being expired, an archive only
+        counts if its name, without the suffix, contains a date in the
+        job's format, and no job with a longer prefix claims it.
+        """
+        if self.catalog is not None:
+            self._sync_catalog(job)
+            names = self.catalog.names_with_suffix(PARTIAL_SUFFIX)
+        else:
+            index = self.get_index(job)
+            with self._lock:
+                names = list(index.partial)
+        with self._lock:
+            if self._partial_index is None:
+                self._partial_index = ArchiveIndex(self._jobs, exclusive=True)
+            index = self._partial_index
+        partial = []
+        for name in names:
+            backup_path = name[:-len(PARTIAL_SUFFIX)]
+            for owner, date in index.classify(backup_path):
+                if owner == job and self._parse_backup_date(
+                        job, backup_path, date) is not None:
+                    partial.append(name)
+        return sorted(partial)
+
+    def _get_catalog_backups(self, job):
+        self._sync_catalog(job)
+        backups = self.catalog.backups(job.name or '')
+        if self.dryrun:
+            # Pretend the backups made have been added to the catalog
+            classify, _ = self._catalog_classifier()
+            with self._lock:
+                for name in self._known_archives:
+                    for job_name, date in classify(
+                            name, self._creation_times.get(name)):
+                        if job_name == (job.name or ''):
+                            backups[name] = date
+        return backups
 
+    def _get_backups(self, job):
+        index = self.get_index(job)
+        with self._lock:
+            dates = index.get(job).items()
         backups = {}
-        for backup_path in self.get_archives():
-            match = None
-            for regex in regexes:
-                match = regex.match(backup_path)
-                if match:
-                    break
-            else:
-                # Not one of the regexes matched.
-                continue
-            try:
-                date = parse_date(match.groupdict()['date'], job.dateformat)
-            except ValueError, e:
-                # This can occasionally happen when multiple archives
-                # share a prefix, say for example you have "windows-$date"
-                # and "windows-data-$date". Since we have to use a generic
-                # .* regex to capture the date part, when processing the
-                # "windows-$date" targets, we'll stumble over entries where
-                # we try to parse "data-$date" as a date. Make sure we
-                # only print a warning, rather than crashing.
-                # TODO: It'd take some work, but we could build a proper
-                # regex based on any given date format string, thus avoiding
-                # the issue for most cases.
-                self.log.error("Ignoring '%s': %s" % (backup_path, e))
-            else:
+        for backup_path, date in dates:
+            date = self._parse_backup_date(job, backup_path, date)
+            if date is not None:
                 backups[backup_path] = date
-
         return backups
 
+    def _parse_backup_date(self, job, backup_path, date):
+        """Return the date of the archive ``backup_path`` of ``job`` as
+        classified, or ``None`` if it cannot be parsed.
+        """
+        if isinstance(date, datetime):
+            return date
+        try:
+            return parse_date(date, job.dateformat, key=job)
+        except ValueError, e:
+            # This can occasionally happen when multiple archives
+            # share a prefix, say for example you have "windows-$date"
+            # and "windows-data-$date". If the job does not define a
+            # dateformat (or one we cannot build a regex for), we have
+            # to use a generic .* regex to capture the date part, so
+            # when processing the "windows-$date" targets, we'll
+            # stumble over entries where we try to parse "data-$date"
+            # as a date. Make sure we only print a warning, rather
+            # than crashing.
+            self.log.error("Ignoring '%s': %s" % (backup_path, e))
+            return None
+
     def expire(self, job):
         """Have tarsnap delete those archives which we need to expire
         according to the deltas defined.
@@ -175,59 +635,367 @@ class TarsnapBackend(object):
         If a dry run is wanted, set ``dryrun`` to a dict of the backups to
         pretend that exist (they will always be used, and not matched).
         """
+        if self.deletion_journal and not self.dryrun:
+            resumed = self.deletion_journal.pending(job)
+            if resumed is not None:
+                to_delete, stable = resumed
+                self.log.info(("Resuming the expiry of '%s', %d archives "
+                               "left to delete") % (job.name, len(to_delete)))
+                self.metrics.count('deleted', len(to_delete))
+                self._delete_planned(job, to_delete, stable, resumed=True)
+                return
+
+        if self._use_schedule and self.expiry_schedule.is_clean(job):
+            self.log.info(("Skipping '%s', nothing to expire since the "
+                           "last run") % job.name)
+            return
 
         backups = self.get_backups(job)
         self.log.info('%d backups are matching' % len(backups))
 
         # Determine which backups we need to get rid of, which to keep
-        to_keep = expire.expire(backups, job.deltas)
+        with self.metrics.phase('planning'):
+            to_keep = set(expire.expire(backups, job.sorted_deltas))
         self.log.info('%d of those can be deleted' % (len(backups)-len(to_keep)))
+        self.metrics.count('matched', len(backups))
+        self.metrics.count('kept', len(to_keep))
+        self.metrics.count('deleted', len(backups) - len(to_keep))
 
         # Delete all others
+        to_delete = []
         for name, _ in backups.items():
             if not name in to_keep:
                 self.log.info('Deleting %s' % name)
-                if not self.dryrun:
-                    self.call('-d', '-f', name)
-                self.archives.remove(name)
+                to_delete.append(name)
             else:
                 self.log.debug('Keeping %s' % name)
 
-    def make(self, job):
-        now = datetime.utcnow()
+        stable = None
+        if self.expiry_schedule and not self.dryrun:
+            # Deleting archives can make others expendable, in which
+            # case the next run still has work to do.
+            with self.metrics.phase('planning'):
+                kept = dict([(name, backups[name]) for name in to_keep])
+                stable = len(expire.expire(kept, job.sorted_deltas)) == \
+                    len(kept)
+        self._delete_planned(job, to_delete, stable)
+
+    def _delete_planned(self, job, names, stable, resumed=False):
+        """Delete the archives ``names`` of ``job``, keeping track of
+        the progress in the deletion journal.
+
+        ``stable`` tells whether the job has nothing left to expire once
+        they are deleted. If the deletion was ``resumed`` from the
+        journal, it is finished even if nothing is left to delete.
+        """
+        journal = self.deletion_journal if not self.dryrun else None
+        with self.metrics.phase('deleting'):
+            if journal and names:
+                journal.start(job, names, stable)
+                self.delete(names, on_deleted=lambda b: journal.done(job, b),
+                            job=job)
+                journal.finish(job)
+            else:
+                self.delete(names, job=job)
+                if journal and resumed:
+                    # Interrupted after the last deletion was checked off
+                    journal.finish(job)
+
+        if self.expiry_schedule and not self.dryrun:
+            self.expiry_schedule.set_clean(job, bool(stable))
+
+    def _batch_archives(self, names):
+        """Split ``names`` into groups that can be deleted with a single
+        tarsnap call, honoring both the maximum number of archives per
+        call and the maximum length of the command line.
+        """
+        batch, batch_bytes = [], 0
+        for name in names:
+            # Account for the "-f" argument, and the separators
+            name_bytes = len(name) + 4
+            if batch and (len(batch) >= self.delete_batch_size or
+                          batch_bytes + name_bytes > self.delete_batch_bytes):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(name)
+            batch_bytes += name_bytes
+        if batch:
+            yield batch
+
+    def delete(self, names, on_deleted=None, job=None):
+        """Delete the given archives of ``job``.
+
+        Multiple archives are deleted by a single tarsnap call, so that
+        the cost of starting tarsnap is not paid for each of them. If a
+        batch fails, its archives are deleted one by one, so that the
+        archive causing the failure can be reported.
+
+        ``on_deleted`` is called with each list of archives that has
+        been deleted.
+        """
+        for batch in self._batch_archives(names):
+            if not self.dryrun and len(batch) > 1:
+                try:
+                    self._delete_call(batch, job)
+                except TarsnapError, e:
+                    self.log.warning(('Deleting %d archives at once '
+                                      'failed, retrying them one by '
+                                      'one: %s') % (len(batch), e))
+                    for name in batch:
+                        self._delete_single(name, job)
+                        self._deleted([name], on_deleted)
+                    continue
+            elif not self.dryrun:
+                self._delete_single(batch[0], job)
+            self._deleted(batch, on_deleted)
+
+    def _delete_call(self, names, job=None):
+        args = ['-d']
+        if self.stats_db is not None:
+            args.append('--print-stats')
+        [args.extend(['-f', name]) for name in names]
+        output = self.call(*args)
+        if self.stats_db is not None:
+            self.stats_db.record_deleted(
+                job or Job(), names, parse_print_stats(output or ''))
+
+    def _deleted(self, names, on_deleted=None):
+        self._remove_archives(names)
+        if on_deleted:
+            on_deleted(names)
+
+    def _delete_single(self, name, job=None):
+        try:
+            self._delete_call([name], job)
+        except TarsnapError, e:
+            if MISSING_ARCHIVE.search(str(e)):
+                # Most likely deleted by an earlier, interrupted run
+                self.log.info('%s does not exist anymore' % name)
+                return
+            raise TarsnapError('Deleting %s failed: %s' % (name, e),
+                               e.exitstatus)
+
+    def _create_args(self, job, target):
+        args = ['-c']
+        [args.extend(['--exclude', e]) for e in job.excludes]
+        args.extend(['-f', target])
+        args.extend(job.sources)
+        return args
+
+    def _target(self, job, now):
         date_str = now.strftime(job.dateformat or DEFAULT_DATEFORMAT)
-        target = Template(job.target).safe_substitute(
+        return job.target_template.safe_substitute(
             {'date': date_str, 'name': job.name})
 
+    def estimate(self, job):
+        """Return how many bytes a new backup of ``job`` is expected to
+        upload, or ``None`` if that cannot be determined.
+
+        The most recent backup made, or a previous estimate, is used if
+        available. Otherwise, tarsnap is asked what it would upload.
+        """
+        value = self.estimates.get(job)
+        if value is not None:
+            return value
+        self.log.debug('Estimating the size of %s' % (job.name or 'the backup'))
+        args = self._create_args(job, self._target(job, datetime.utcnow()))
+        args[1:1] = ['--dry-run', '--print-stats']
+        try:
+            with self.metrics.phase('estimating'):
+                output = self.call(*args)
+        except TarsnapError, e:
+            self.log.warning('Cannot estimate the size of %s: %s' % (
+                job.name or 'the backup', e))
+            return None
+        stats = parse_print_stats(output)
+        if 'new' not in stats:
+            return None
+        value = stats['new'][1]
+        self.estimates.set(job, value)
+        return value
+
+    def make(self, job):
+        now = datetime.utcnow()
+        target = self._target(job, now)
+
         if job.name:
             self.log.info('Creating backup %s: %s' % (job.name, target))
         else:
             self.log.info('Creating backup: %s' % target)
 
         if not self.dryrun:
-            args = ['-c']
-            [args.extend(['--exclude', e]) for e in job.excludes]
-            args.extend(['-f', target])
-            args.extend(job.sources)
-            self.call(*args)
+            args = self._create_args(job, target)
+            if self._print_stats:
+                args[1:1] = ['--print-stats']
+            if job.checkpoint_bytes:
+                # If interrupted, tarsnap keeps what has been uploaded
+                # as "<target>.part", and does not upload it again.
+                args[1:1] = ['--checkpoint-bytes', str(job.checkpoint_bytes)]
+            with self.metrics.phase('creating'):
+                output = self.call(*args)
+            if self._print_stats:
+                self._record_created(job, target, parse_print_stats(output))
         # Add the new backup the list of archives, so we have an up-to-date
         # list without needing to query again.
         self._add_known_archive(target)
 
         return target, now
 
+    def archives_loaded(self):
+        """Return whether the list of archives has been loaded, so that
+        looking at it does not require another query.
+        """
+        with self._lock:
+            if self.catalog is not None:
+                return self._catalog_synced
+            return self._index is not None
+
+    def delete_partial_archives(self, job):
+        """Delete the archives of ``job`` left behind by interrupted
+        backups, once a backup has been made. A failure is only logged,
+        as the backup itself succeeded.
+        """
+        try:
+            partial = self.partial_archives(job)
+            if partial:
+                self.log.info(("Deleting %d partial archives of '%s' left "
+                               "behind by interrupted backups") % (
+                                   len(partial), job.name))
+                with self.metrics.phase('deleting'):
+                    self.delete(partial, job=job)
+        except TarsnapError, e:
+            self.log.warning("Not deleting the partial archives of '%s': %s"
+                             % (job.name, e))
+
+    def _record_created(self, job, target, stats):
+        if self.estimates is not None and 'new' in stats:
+            # The next backup is likely to upload as much as this one
+            self.estimates.set(job, stats['new'][1])
+        if self.stats_db is not None:
+            self.stats_db.record_created(job, target, stats)
+
+
+# The format of the creation times printed by "tarsnap --list-archives -v"
+CREATION_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# How tarsnap reports an attempt to delete an archive which does not exist
+MISSING_ARCHIVE = re.compile('No such archive|Archive does not exist')
+
+
+class LoopBackend(TarsnapBackend):
+    """A backend running tarsnap and the hook commands through a
+    ``ProcessLoop``, rather than blocking on each process in turn.
+
+    The regular backend API waits for the process to finish, but all
+    other processes in flight are serviced meanwhile. Use ``submit()``
+    and ``submit_util()`` to start processes without waiting for them,
+    and ``wait()`` to run the loop.
+    """
 
-DEFAULT_DATEFORMAT = '%Y%m%d-%H%M%S'
+    def __init__(self, *a, **kw):
+        TarsnapBackend.__init__(self, *a, **kw)
+        self.loop = ProcessLoop()
+        self._loop_lock = threading.RLock()
 
+    def _output_handler(self, verbose=False):
+        if verbose or self.log.isEnabledFor(logging.DEBUG):
+            return sys.stdout.write
+        return None
 
-def parse_date(string, dateformat=None):
-    """Parse a date string, either using the given format, or by
-    relying on python-dateutil.
-    """
-    if dateformat:
-        return datetime.strptime(string, dateformat)
-    else:
-        return dateutil.parser.parse(string)
+    def submit(self, *arguments):
+        """Start tarsnap with the given ``arguments``, and return the
+        ``Process``.
+
+        Unlike ``call()``, this does not wait for other processes using
+        the tarsnap cache directory.
+        """
+        return self._spawn_tarsnap(self._tarsnap_args(arguments))
+
+    def _spawn_tarsnap(self, args, on_output=None, keep_output=True):
+        self.log.debug("Executing: %s" % " ".join(args))
+        env = dict(os.environ)
+        env['LANG'] = 'C' # ensure the tarsnap output is in english
+        debug_output = self._output_handler()
+        if on_output and debug_output:
+            def output_handler(data):
+                debug_output(data)
+                on_output(data)
+        else:
+            output_handler = on_output or debug_output
+        with self._loop_lock:
+            return self.loop.spawn_tarsnap(
+                args, env=env, get_passphrase=self._get_key_passphrase,
+                on_output=output_handler, keep_output=keep_output)
+
+    def submit_util(self, cmdline):
+        """Start ``cmdline`` using the shell, and return the
+        ``Process``.
+        """
+        self.log.debug("Executing: %s" % cmdline)
+        with self._loop_lock:
+            return self.loop.spawn_shell(
+                cmdline, on_output=self._output_handler(verbose=True))
+
+    def wait(self, processes=None):
+        """Run the loop until the given processes, or all processes,
+        have finished.
+        """
+        with self._loop_lock:
+            self.loop.run(processes)
+
+    def _exec_tarsnap(self, args):
+        process = self._spawn_tarsnap(args)
+        self.wait([process])
+        out = process.get_output()
+        if process.exitstatus != 0:
+            raise TarsnapError("tarsnap failed with status {0}:{1}{2}".format(
+                        process.exitstatus, os.linesep, out),
+                        process.exitstatus)
+        return out
+
+    def _stream_tarsnap(self, args):
+        lines = deque()
+        partial = ['']
+
+        def on_output(data):
+            parts = (partial[0] + data).split('\n')
+            partial[0] = parts.pop()
+            lines.extend(part + '\n' for part in parts)
+
+        process = self._spawn_tarsnap(args, on_output, keep_output=False)
+        tail = deque(maxlen=20)
+        while True:
+            # Hand out the lines received so far before reading more
+            while lines:
+                line = lines.popleft()
+                tail.append(line)
+                yield line
+            if process.finished:
+                break
+            with self._loop_lock:
+                if not process.finished:
+                    self.loop.step()
+        if partial[0]:
+            tail.append(partial[0])
+            yield partial[0]
+
+        if process.exitstatus != 0:
+            raise TarsnapError("tarsnap failed with status {0}:{1}{2}".format(
+                        process.exitstatus, os.linesep, "".join(tail)),
+                        process.exitstatus)
+
+    def _exec_util(self, cmdline, shell=False):
+        process = self.submit_util(cmdline)
+        self.wait([process])
+        if process.exitstatus:
+            raise RuntimeError('%s failed with exit code %s' % (
+                cmdline, process.exitstatus))
+
+
+BACKENDS = {
+    'pexpect': TarsnapBackend,
+    'loop': LoopBackend,
+}
 
 
 def timedelta_string(value):
@@ -239,6 +1007,15 @@ def timedelta_string(value):
         raise argparse.ArgumentTypeError('invalid delta value: %r (suffix d, s allowed)' % e)
 
 
+def size_string(value):
+    """Parse a string to a number of bytes to checkpoint after.
+    """
+    try:
+        return config.parse_checkpoint_bytes(value)
+    except config.ConfigError, e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 class Command(object):
 
     BackendClass = TarsnapBackend
@@ -248,7 +1025,82 @@ class Command(object):
         self.log = log
         self.backend = (backend_class or self.BackendClass)(
             self.log, self.args.tarsnap_options,
-            dryrun=getattr(self.args, 'dryrun', False))
+            dryrun=getattr(self.args, 'dryrun', False),
+            delete_batch_size=getattr(self.args, 'delete_batch_size', None),
+            delete_batch_bytes=getattr(self.args, 'delete_batch_bytes', None),
+            archive_cache=self.get_archive_cache(),
+            refresh=getattr(self.args, 'refresh', False),
+            use_creation_time=getattr(self.args, 'creation_time', False),
+            expiry_schedule=self.get_expiry_schedule(),
+            deletion_journal=self.get_deletion_journal(),
+            metrics=Metrics(getattr(self.args, 'metrics_log', None),
+                            getattr(self.args, 'metrics_textfile', None),
+                            log=self.log),
+            estimates=self.get_estimate_cache(),
+            stats_db=self.get_stats_db(),
+            catalog=self.get_archive_catalog())
+
+    def get_archive_cache(self):
+        directory = getattr(self.args, 'archive_cache', None)
+        if not directory or getattr(self.args, 'catalog', False):
+            return None
+        ttl = getattr(self.args, 'archive_cache_ttl', None)
+        return ArchiveCache(
+            cache_filename(directory, self.args.tarsnap_options,
+                           getattr(self.args, 'creation_time', False)),
+            ttl=ttl.total_seconds() if ttl else None,
+            log=self.log)
+
+    def get_archive_catalog(self):
+        directory = getattr(self.args, 'archive_cache', None)
+        if not directory or not getattr(self.args, 'catalog', False):
+            return None
+        ttl = getattr(self.args, 'archive_cache_ttl', None)
+        return ArchiveCatalog(
+            cache_filename(directory, self.args.tarsnap_options,
+                           getattr(self.args, 'creation_time', False),
+                           prefix='catalog'),
+            ttl=ttl.total_seconds() if ttl else None,
+            log=self.log)
+
+    def get_expiry_schedule(self):
+        directory = getattr(self.args, 'archive_cache', None)
+        if not directory:
+            return None
+        ttl = getattr(self.args, 'archive_cache_ttl', None)
+        creation_time = getattr(self.args, 'creation_time', False)
+        return ExpirySchedule(
+            cache_filename(directory, self.args.tarsnap_options,
+                           creation_time, prefix='expiry'),
+            ttl=ttl.total_seconds() if ttl else None,
+            creation_time=creation_time, log=self.log)
+
+    def get_deletion_journal(self):
+        directory = getattr(self.args, 'archive_cache', None)
+        if not directory:
+            return None
+        creation_time = getattr(self.args, 'creation_time', False)
+        return DeletionJournal(
+            cache_filename(directory, self.args.tarsnap_options,
+                           creation_time, prefix='journal'),
+            creation_time=creation_time, log=self.log)
+
+    def get_estimate_cache(self):
+        if not getattr(self.args, 'estimate', False):
+            return None
+        directory = getattr(self.args, 'archive_cache', None)
+        max_age = getattr(self.args, 'estimate_max_age', None)
+        return EstimateCache(
+            cache_filename(directory, self.args.tarsnap_options,
+                           prefix='estimates') if directory else None,
+            max_age=max_age.total_seconds() if max_age else None,
+            log=self.log)
+
+    def get_stats_db(self):
+        filename = getattr(self.args, 'stats_db', None)
+        if not filename:
+            return None
+        return StatsDatabase(filename, log=self.log)
 
     @classmethod
     def setup_arg_parser(self, parser):
@@ -261,25 +1113,127 @@ class Command(object):
     def run(self, job):
         raise NotImplementedError()
 
+    def run_job(self, job):
+        """Run the command for ``job``, recording its metrics."""
+        with self.backend.metrics.job(job):
+            self.run(job)
+
+    def process(self, jobs):
+        """Run the command for all the given jobs."""
+        for job in jobs:
+            self.run_job(job)
+
 
 class ListCommand(Command):
 
     help = 'list all the existing backups'
     description = 'For each job, output a sorted list of existing backups.'
 
+    FORMATS = ('text', 'jsonl', 'tsv')
+
+    @classmethod
+    def setup_arg_parser(self, parser):
+        parser.add_argument('--format', choices=self.FORMATS, default='text',
+                            help='output a record for each backup, sorted '
+                                 'by job and archive name, with its date and '
+                                 'whether expiring would keep or delete it, '
+                                 'as JSON lines or tab separated values '
+                                 '(default: text)')
+
     def run(self, job):
-        backups = self.backend.get_backups(job)
+        output_format = getattr(self.args, 'format', 'text')
+        if output_format != 'text':
+            write = getattr(self, 'write_%s' % output_format)
+            for record in self.records(job):
+                write(record)
+            return
+
+        # Sorted by time, the newest first
+        backups = self.backend.list_backups(job)
 
         self.log.info('%s' % job.name)
 
-        # Sort backups by time
-        # TODO: This duplicates code from the expire module. Should
-        # the list of backups always be returned sorted instead?
-        backups = [(name, time) for name, time in backups.items()]
-        backups.sort(cmp=lambda x, y: -cmp(x[1], y[1]))
         for backup, _ in backups:
             print "  %s" % backup
 
+    def records(self, job):
+        """Yield a dict for each backup of ``job``, sorted by archive
+        name, with the verdict of expiring them according to the
+        current deltas.
+        """
+        backups = self.backend.get_backups(job)
+        to_keep = None
+        if job.deltas:
+            to_keep = expire.expire(backups, job.sorted_deltas)
+        for name in sorted(backups):
+            yield {'job': job.name or '', 'archive': name,
+                   'timestamp': backups[name].isoformat(),
+                   'verdict': 'keep' if to_keep is None or name in to_keep
+                              else 'delete'}
+
+    def write_jsonl(self, record):
+        import json
+        sys.stdout.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def write_tsv(self, record):
+        sys.stdout.write('\t'.join([record['job'], record['archive'],
+                                    record['timestamp'],
+                                    record['verdict']]) + '\n')
+
+    def process(self, jobs):
+        # All jobs are classified in a single pass over the archives,
+        # the first time the backups of any of them are requested.
+        Command.process(self, sorted(jobs, key=lambda job: job.name))
+
+
+class StatsCommand(Command):
+
+    help = 'show how much data the backups upload and free up'
+    description = 'For each job, show the number of backups made and ' \
+                  'deleted, and the bytes uploaded and reclaimed, as ' \
+                  'recorded in the --stats-db database. Does not query ' \
+                  'the tarsnap server.'
+
+    @classmethod
+    def setup_arg_parser(self, parser):
+        parser.add_argument('--since', metavar='DELTA', type=timedelta_string,
+                            help='only count the backups made and deleted '
+                                 'during the given time (the last backup '
+                                 'is shown regardless)')
+
+    @classmethod
+    def validate_args(self, args):
+        if not args.stats_db:
+            raise ArgumentError('The stats command needs a database, '
+                                'given with --stats-db')
+
+    def run(self, job):
+        since = getattr(self.args, 'since', None)
+        summary = self.backend.stats_db.job_summary(
+            job, time.time() - since.total_seconds() if since else None)
+        print "%s" % (job.name or job.target)
+        print "  backups made:       %d, uploading %s" % (
+            summary['created'], format_bytes(summary['uploaded']))
+        if summary['last_size'] is not None:
+            print "  last backup:        %s (%s compressed)" % (
+                format_bytes(summary['last_size']),
+                format_bytes(summary['last_compressed_size']))
+        print "  backups deleted:    %d, reclaiming %s" % (
+            summary['deleted'], format_bytes(summary['reclaimed']))
+
+    def process(self, jobs):
+        Command.process(self, sorted(jobs, key=lambda job: job.name))
+        account = self.backend.stats_db.account()
+        if account:
+            print "All archives:         %s (%s compressed)" % (
+                format_bytes(account['total_size']),
+                format_bytes(account['compressed_size']))
+            print "  unique data:        %s (%s compressed), as of %s" % (
+                format_bytes(account['unique_size']),
+                format_bytes(account['unique_compressed_size']),
+                datetime.fromtimestamp(account['time']).strftime(
+                    CREATION_TIME_FORMAT))
+
 
 class ExpireCommand(Command):
 
@@ -291,6 +1245,26 @@ class ExpireCommand(Command):
     def setup_arg_parser(self, parser):
         parser.add_argument('--dry-run', dest='dryrun', action='store_true',
                             help='only simulate, don\'t delete anything')
+        self.setup_expire_arg_parser(parser)
+
+    @classmethod
+    def setup_expire_arg_parser(self, parser):
+        parser.add_argument('--jobs', '-j', dest='workers', metavar='N',
+                            type=int, default=1,
+                            help='run up to N jobs at the same time '
+                                 '(default: 1)')
+        parser.add_argument('--delete-batch-size', dest='delete_batch_size',
+                            metavar='N', type=int,
+                            help='delete at most N archives per tarsnap call '
+                                 '(default: %d)' %
+                                 TarsnapBackend.DELETE_BATCH_SIZE)
+        parser.add_argument('--delete-batch-bytes',
+                            dest='delete_batch_bytes', metavar='BYTES',
+                            type=int,
+                            help='limit the length of the archive names '
+                                 'passed to a single tarsnap call '
+                                 '(default: %d)' %
+                                 TarsnapBackend.DELETE_BATCH_BYTES)
 
     def expire(self, job):
         if not job.deltas:
@@ -302,6 +1276,25 @@ class ExpireCommand(Command):
     def run(self, job):
         self.expire(job)
 
+    def weigh_jobs(self, jobs):
+        """Return a function giving the weight of each job, used to
+        decide which jobs to start first, or ``None`` to keep them in
+        order.
+        """
+        return None
+
+    def process(self, jobs):
+        workers = getattr(self.args, 'workers', 1) or 1
+        weight = self.weigh_jobs(jobs)
+        if workers > 1:
+            run_jobs(jobs, self.run_job, workers, self.log, weight=weight)
+        else:
+            Command.process(self, order_jobs(jobs, weight))
+
+
+# How long to wait for the sources of a job to be checked, in seconds
+DEFAULT_SOURCE_TIMEOUT = 30
+
 
 class MakeCommand(ExpireCommand):
 
@@ -318,6 +1311,22 @@ class MakeCommand(ExpireCommand):
         parser.add_argument('--no-expire', dest='no_expire',
                             action='store_true', default=None,
                             help='don\'t expire, only make backups')
+        parser.add_argument('--source-timeout', dest='source_timeout',
+                            metavar='SECONDS', type=float,
+                            default=DEFAULT_SOURCE_TIMEOUT,
+                            help='skip a job if checking whether its '
+                                 'sources exist takes longer than this '
+                                 '(default: %d)' % DEFAULT_SOURCE_TIMEOUT)
+        parser.add_argument('--estimate', action='store_true',
+                            help='start the jobs expected to upload the most '
+                                 'data first, estimating it with "tarsnap '
+                                 '--dry-run" if the last backup is unknown')
+        parser.add_argument('--estimate-max-age', dest='estimate_max_age',
+                            metavar='DELTA', type=timedelta_string,
+                            default=config.str_to_timedelta('7d'),
+                            help='how long an estimate is used before it is '
+                                 'made again (default: 7d)')
+        self.setup_expire_arg_parser(parser)
 
     @classmethod
     def validate_args(self, args):
@@ -333,29 +1342,41 @@ class MakeCommand(ExpireCommand):
                                 'need to specify at least one source path '
                                 'using --sources')
 
+    def weigh_jobs(self, jobs):
+        if self.backend.estimates is None:
+            return None
+        estimates = {}
+        for job in jobs:
+            if job.sources:
+                with self.backend.metrics.job(job):
+                    estimates[job] = self.backend.estimate(job)
+                if estimates[job] is not None:
+                    self.log.debug('%s is expected to upload %d bytes' % (
+                        job.name or 'The backup', estimates[job]))
+        return lambda job: estimates.get(job) or 0
+
     def run(self, job):
         if not job.sources:
             self.log.info(("Skipping '%s', does not define sources") % job.name)
             return
 
         if job.exec_before:
-            self.backend._exec_util(job.exec_before)
+            self.backend.exec_hook(job.exec_before)
 
         # Determine whether we can run this job. If any of the sources
-        # are missing, or any source directory is empty, we skip this job.
+        # are missing, any source directory is empty, or does not respond
+        # in time, we skip this job.
         sources_missing = False
         if not job.force:
-            for source in job.sources:
-                if not path.exists(source):
-                    sources_missing = True
-                    break
-                if path.isdir(source) and not os.listdir(source):
-                    # directory is empty
-                    sources_missing = True
-                    break
+            problems = check_sources(job.sources, getattr(
+                self.args, 'source_timeout', DEFAULT_SOURCE_TIMEOUT))
+            for source, problem in problems:
+                (self.log.warning if problem == TIMEOUT else self.log.debug)(
+                    'Source %s %s' % (source, problem))
+            sources_missing = bool(problems)
 
         # Do a new backup
-        skipped = False
+        skipped = made = False
 
         if sources_missing:
             if job.name:
@@ -368,23 +1389,185 @@ class MakeCommand(ExpireCommand):
         else:
             try:
                 self.backend.make(job)
+                made = True
             except Exception:
                 self.log.exception(("Something went wrong with backup job: '%s'")
                                % job.name)
 
         if job.exec_after:
-            self.backend._exec_util(job.exec_after)
+            self.backend.exec_hook(job.exec_after)
 
         # Expire old backups, but only bother if either we made a new
         # backup, or if expire was explicitly requested.
         if not skipped and not self.args.no_expire:
             self.expire(job)
 
+        # Partial archives of interrupted backups are superseded by the
+        # new one. Jobs without checkpoints have some only if they used
+        # to, so for those, the list of archives is not queried just to
+        # look for them.
+        if made and (job.checkpoint_bytes or self.backend.archives_loaded()):
+            self.backend.delete_partial_archives(job)
+
+
+class DaemonCommand(MakeCommand):
+
+    help = 'keep running, and make backups as often as the deltas ask for'
+    description = 'Run each job as often as its smallest delta, making ' \
+                  'a new backup and then expiring old ones. The list of ' \
+                  'archives is kept in memory, and queried again only ' \
+                  'every --refresh-every. Send SIGHUP to reload the ' \
+                  'config file.'
+
+    DEFAULT_REFRESH = '1d'
+
+    @classmethod
+    def setup_arg_parser(self, parser):
+        MakeCommand.setup_arg_parser(parser)
+        parser.add_argument('--refresh-every', dest='refresh_every',
+                            metavar='DELTA', type=timedelta_string,
+                            default=config.str_to_timedelta(
+                                self.DEFAULT_REFRESH),
+                            help='how often to query the list of archives '
+                                 'again, to notice changes made by others '
+                                 '(default: %s)' % self.DEFAULT_REFRESH)
+
+    # Replaced by the tests
+    clock = staticmethod(time.time)
+    sleep = staticmethod(time.sleep)
+
+    def load_archives(self):
+        """Keep the list of archives in memory, unless the catalog is
+        used, so that classifying it again after reloading the config
+        does not require querying the server.
+        """
+        if self.backend.catalog is None:
+            self.backend.get_archives()
+
+    def first_due(self, job, interval):
+        """Return when ``job`` is due first: once ``interval`` seconds
+        have passed since its most recent backup.
+        """
+        now = self.clock()
+        backups = self.backend.get_backups(job)
+        if not backups:
+            return now
+        # Dates in archive names are UTC; tarsnap's creation times local
+        current = datetime.now() if self.backend.use_creation_time \
+            else datetime.utcnow()
+        age = (current - max(backups.values())).total_seconds()
+        return now + max(0, interval - age)
+
+    def schedule_jobs(self, jobs):
+        """Add ``jobs`` to the queue, keeping the time each job was due
+        if it was scheduled already, and remove all other jobs.
+        """
+        names = set()
+        for job in jobs:
+            interval = job_interval(job)
+            if interval is None:
+                self.log.warning(("Not scheduling '%s', does not define "
+                                  "deltas") % job.name)
+                continue
+            names.add(job.name)
+            due = self.queue.due(job.name)
+            if due is None:
+                due = self.first_due(job, interval)
+                self.log.info("Scheduling '%s' every %s, next in %ds" % (
+                    job.name, timedelta(seconds=interval),
+                    max(0, due - self.clock())))
+            self.queue.push(job, due)
+        for name in self.queue.names():
+            if name not in names:
+                self.queue.remove(name)
+
+    def reload(self):
+        """Load the config file again, and schedule its jobs."""
+        if not self.args.config:
+            self.log.warning('Not reloading, no config file was given')
+            return
+        try:
+            jobs, _ = config.load_config_from_file(self.args.config)
+        except (config.ConfigError, EnvironmentError), e:
+            self.log.error('Not reloading the config file: %s' % e)
+            return
+        self.log.info('Reloaded %s' % self.args.config)
+        self.backend.set_jobs(jobs.values())
+        if self.args.jobs:
+            jobs = OrderedDict(
+                (n, j) for n, j in jobs.items() if n in self.args.jobs)
+        self.schedule_jobs(jobs.values())
+
+    def refresh_archives(self):
+        self.log.info('Querying the list of archives again')
+        self.backend.forget_archives()
+        self.load_archives()
+
+    def _handle_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self.reloading = True
+        else:
+            self.stopping = True
+
+    def process(self, jobs):
+        self.stopping = self.reloading = False
+        handlers = {}
+        for signum in (signal.SIGHUP, signal.SIGTERM):
+            handlers[signum] = signal.signal(signum, self._handle_signal)
+        try:
+            self.serve(jobs)
+        except KeyboardInterrupt:
+            self.log.info('Interrupted')
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+    def serve(self, jobs):
+        """Run the jobs when they are due, until asked to stop."""
+        refresh_every = self.args.refresh_every.total_seconds()
+        self.queue = JobQueue()
+        self.load_archives()
+        self.schedule_jobs(jobs)
+        next_refresh = self.clock() + refresh_every
+        while not self.stopping:
+            now = self.clock()
+            try:
+                if self.reloading:
+                    self.reloading = False
+                    self.reload()
+                if now >= next_refresh:
+                    next_refresh = now + refresh_every
+                    self.refresh_archives()
+            except TarsnapError, e:
+                # Tried again when the list of archives is needed
+                self.log.error('Querying the list of archives failed: %s' % e)
+
+            due = self.queue.pop_due(now)
+            if due:
+                try:
+                    # Jobs due at the same time may run concurrently
+                    ExpireCommand.process(self, [job for _, job in due])
+                except Exception:
+                    self.log.exception('Running %s failed' % ', '.join(
+                        "'%s'" % job.name for _, job in due))
+                for previous, job in due:
+                    # Stay on schedule, unless we have fallen behind
+                    self.queue.push(job, max(
+                        previous + job_interval(job), self.clock()))
+                continue
+
+            wake = min(next_refresh, self.queue.next_due() or next_refresh)
+            # Signals interrupt the sleep
+            self.sleep(max(0, wake - now))
+        self.log.info('Stopping')
+
 
 COMMANDS = {
     'make': MakeCommand,
     'expire': ExpireCommand,
     'list': ListCommand,
+    'stats': StatsCommand,
+    'daemon': DaemonCommand,
 }
 
 
@@ -406,6 +1589,44 @@ def parse_args(argv):
                         dest='tarsnap_options', default=[], action='append',
                         help='option to pass to tarsnap',)
     parser.add_argument('--config', '-c', help='use the given config file')
+    parser.add_argument('--backend', choices=sorted(BACKENDS),
+                        help='how tarsnap is run: one process at a time '
+                             '(pexpect, the default), or multiplexed on a '
+                             'single thread (loop)')
+    parser.add_argument('--archive-cache', metavar='DIR',
+                        help='keep the list of archives in the given '
+                             'directory, rather than querying tarsnap '
+                             'every time')
+    parser.add_argument('--archive-cache-ttl', metavar='DELTA',
+                        type=timedelta_string,
+                        default=config.str_to_timedelta('1h'),
+                        help='how long the cached list of archives is used '
+                             '(default: 1h)')
+    parser.add_argument('--catalog', action='store_true',
+                        help='rather than the list of archives, keep the '
+                             'backups of each job in a database in the '
+                             '--archive-cache directory, updated '
+                             'incrementally')
+    parser.add_argument('--creation-time', dest='creation_time',
+                        action='store_true',
+                        help='use the creation time of each archive as '
+                             'reported by tarsnap, rather than parsing the '
+                             'date in the archive name')
+    parser.add_argument('--refresh', action='store_true',
+                        help='query the list of archives, even if a cached '
+                             'one is available')
+    parser.add_argument('--metrics-log', dest='metrics_log', metavar='FILE',
+                        help='append timings and counts of each tarsnap '
+                             'call and job to FILE, as JSON lines')
+    parser.add_argument('--metrics-textfile', dest='metrics_textfile',
+                        metavar='FILE',
+                        help='write the metrics of the run to FILE, for the '
+                             'Prometheus node exporter\'s textfile '
+                             'collector')
+    parser.add_argument('--stats-db', dest='stats_db', metavar='FILE',
+                        help='record the size of the archives created and '
+                             'the space freed by deleting archives in the '
+                             'SQLite database FILE, for the stats command')
 
     group = parser.add_argument_group(
         description='Instead of using a configuration file, you may define '\
@@ -417,6 +1638,11 @@ def parse_args(argv):
                         type=timedelta_string,
                         help='generation deltas', nargs='+')
     group.add_argument('--dateformat', '-f', help='dateformat')
+    group.add_argument('--checkpoint-bytes', dest='checkpoint_bytes',
+                       metavar='SIZE', type=size_string,
+                       help='have tarsnap save its progress every SIZE '
+                            'bytes (e.g. 100M), so that an interrupted '
+                            'backup can be resumed')
 
     for plugin in PLUGINS:
         plugin.setup_arg_parser(parser)
@@ -468,9 +1694,12 @@ def parse_args(argv):
     # Do some argument validation that would be to much to ask for
     # argparse to handle internally.
     if args.config and (args.target or args.dateformat or args.deltas or
-                        args.sources):
+                        args.sources or args.checkpoint_bytes):
         raise ArgumentError('If --config is used, then --target, --deltas, '
-                            '--sources and --dateformat are not available')
+                            '--sources, --dateformat and --checkpoint-bytes '
+                            'are not available')
+    if args.catalog and not args.archive_cache:
+        raise ArgumentError('--catalog requires --archive-cache')
     if args.jobs and not args.config:
         raise ArgumentError(('Specific jobs (%s) can only be given if a '
                             'config file is used') % ", ".join(args.jobs))
@@ -506,7 +1735,8 @@ def main(argv):
     else:
         # Only a single job, as given on the command line
         jobs = {None: Job(**{'target': args.target, 'dateformat': args.dateformat,
-                             'deltas': args.deltas, 'sources': args.sources})}
+                             'deltas': args.deltas, 'sources': args.sources,
+                             'checkpoint_bytes': args.checkpoint_bytes})}
         global_config = {}
 
     # Validate the requested list of jobs to run
@@ -515,20 +1745,28 @@ def main(argv):
         if unknown:
             log.fatal('Error: not defined in the config file: %s' % ", ".join(unknown))
             return 1
-        jobs_to_run = dict([(n, j) for n, j in jobs.iteritems() if n in args.jobs])
+        jobs_to_run = OrderedDict(
+            [(n, j) for n, j in jobs.iteritems() if n in args.jobs])
     else:
         jobs_to_run = jobs
 
-    command = args.command(args, log)
+    command = args.command(args, log,
+                           backend_class=BACKENDS.get(args.backend))
+    # All jobs are registered, even those not run, so that archives are
+    # classified the same way whichever jobs are given.
+    command.backend.add_jobs(jobs.values())
+    success = False
     try:
-        for job in jobs_to_run.values():
-            command.run(job)
+        command.process(jobs_to_run.values())
 
         for plugin in PLUGINS:
             plugin.all_jobs_done(args, global_config, args.command)
+        success = True
     except TarsnapError, e:
         log.fatal("tarsnap execution failed:\n%s" % e)
         return 1
+    finally:
+        command.backend.metrics.close(success)
 
 
 def run():
@@ -0,0 +1,96 @@
+"""Check whether the sources of a job are available, before backing
+them up.
+
+A source is considered missing if it does not exist, or is an empty
+directory (most likely a mount point with nothing mounted). To find
+out whether a directory is empty, only its first entry is read, using
+``scandir`` where available. All sources of a job are checked at the
+same time, each in its own thread, so that an unresponsive network
+mount cannot hold up the backup for longer than the given timeout.
+"""
+
+import os
+from os import path
+import time
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+__all__ = ('check_sources', 'is_empty_dir', 'MISSING', 'EMPTY', 'TIMEOUT',)
+
+
+# The problems a source can have
+MISSING = 'does not exist'
+EMPTY = 'is an empty directory'
+TIMEOUT = 'did not respond in time'
+
+
+def is_empty_dir(directory):
+    """Return whether ``directory`` has no entries, reading no more
+    than the first one if possible.
+    """
+    if scandir is None:
+        return not os.listdir(directory)
+    entries = scandir(directory)
+    try:
+        for entry in entries:
+            return False
+        return True
+    finally:
+        # Python 3.6+ can release the directory handle right away
+        close = getattr(entries, 'close', None)
+        if close:
+            close()
+
+
+def check_source(source):
+    """Return the problem with ``source``, or ``None``."""
+    if not path.exists(source):
+        return MISSING
+    if path.isdir(source) and is_empty_dir(source):
+        return EMPTY
+    return None
+
+
+def check_sources(sources, timeout=None):
+    """Check all of ``sources`` at the same time, waiting no longer than
+    ``timeout`` seconds for them. Returns a list of ``(source, problem)``
+    tuples for those which are not available.
+
+    The checks that did not finish in time are left running in the
+    background, as there is no way to abort them.
+    """
+    results = {}
+
+    def check(source):
+        try:
+            results[source] = check_source(source)
+        except EnvironmentError, e:
+            results[source] = str(e)
+
+    threads = []
+    for source in sources:
+        thread = threading.Thread(target=check, args=(source,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    deadline = None if timeout is None else time.time() + timeout
+    for thread in threads:
+        thread.join(None if deadline is None
+                    else max(0, deadline - time.time()))
+
+    problems = []
+    for source in sources:
+        if source not in results:
+            problems.append((source, TIMEOUT))
+        elif results[source]:
+            problems.append((source, results[source]))
+    return problems
@@ -0,0 +1,272 @@
+"""Make sense of the statistics tarsnap prints with ``--print-stats``,
+keep track of how much data each job uploads, and record the figures
+in a local database.
+
+The output looks like this (with "Deleted data" rather than "New data"
+when deleting archives)::
+
+                                           Total size  Compressed size
+    All archives                               104983            47239
+      (unique data)                             76907            32614
+    This archive                                 2580             1199
+    New data                                     2580             1199
+
+The database is a SQLite file, with a row for each archive created,
+each tarsnap call deleting archives, and each time the totals of the
+account were printed. It is only ever written to by tarsnapper, so
+that the ``stats`` command can answer questions about growth and
+retention without asking the tarsnap server.
+"""
+
+import os
+from os import path
+import re
+import time
+import tempfile
+import threading
+
+
+__all__ = ('parse_print_stats', 'format_bytes', 'EstimateCache',
+           'StatsDatabase',)
+
+
+# The keys under which the rows of the output are returned
+ROWS = {
+    'All archives': 'all',
+    '(unique data)': 'unique',
+    'This archive': 'archive',
+    'New data': 'new',
+    'Deleted data': 'deleted',
+}
+
+ROW_RE = re.compile(r'^\s*(\S.*?)\s+(\d+)\s+(\d+)\s*$')
+
+
+def parse_print_stats(output):
+    """Return a dict of the rows in the ``--print-stats`` part of
+    tarsnap's ``output``, each a ``(total size, compressed size)`` tuple
+    of bytes. Other output is ignored.
+
+    If the statistics are printed more than once, as when deleting
+    several archives, the deleted data is added up, and the last of
+    the other rows is returned.
+    """
+    stats = {}
+    for line in output.splitlines():
+        match = ROW_RE.match(line)
+        if match and match.group(1) in ROWS:
+            key = ROWS[match.group(1)]
+            value = (int(match.group(2)), int(match.group(3)))
+            if key == 'deleted' and key in stats:
+                value = (stats[key][0] + value[0], stats[key][1] + value[1])
+            stats[key] = value
+    return stats
+
+
+def format_bytes(value):
+    """Format a number of bytes for humans."""
+    for unit in ('B', 'kB', 'MB', 'GB', 'TB'):
+        if abs(value) < 1000 or unit == 'TB':
+            break
+        value /= 1000.0
+    return ('%d %s' if unit == 'B' else '%.1f %s') % (value, unit)
+
+
+class EstimateCache(object):
+    """Remembers how many bytes each job is expected to upload, for up
+    to ``max_age`` seconds. Stored in ``filename``, if given.
+    """
+
+    def __init__(self, filename=None, max_age=None, log=None):
+        self.filename = filename
+        self.max_age = max_age
+        self.log = log
+        self._estimates = None
+        self._lock = threading.Lock()
+
+    def _warn(self, message):
+        if self.log:
+            self.log.warning('Estimates %s: %s' % (self.filename, message))
+
+    def _load(self):
+        if self._estimates is None:
+            self._estimates = {}
+            if self.filename:
+                import json
+                try:
+                    with open(self.filename, 'rb') as f:
+                        estimates = json.load(f)
+                    if isinstance(estimates, dict):
+                        self._estimates = estimates
+                except IOError:
+                    pass
+                except ValueError:
+                    self._warn('ignoring invalid file')
+        return self._estimates
+
+    def _save(self):
+        if not self.filename:
+            return
+        import json
+        directory = path.dirname(self.filename) or '.'
+        try:
+            if not path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.estimates')
+            with os.fdopen(fd, 'wb') as f:
+                json.dump(self._estimates, f)
+            os.rename(tmp, self.filename)
+        except EnvironmentError, e:
+            self._warn('cannot write: %s' % e)
+
+    def get(self, job):
+        """Return the estimated bytes ``job`` uploads, or ``None`` if
+        there is no recent estimate.
+        """
+        with self._lock:
+            entry = self._load().get(job.name or '')
+        if not entry:
+            return None
+        if self.max_age is not None and \
+                time.time() - entry['time'] > self.max_age:
+            return None
+        return entry['bytes']
+
+    def set(self, job, value):
+        with self._lock:
+            self._load()[job.name or ''] = {
+                'bytes': value, 'time': time.time()}
+            self._save()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    name TEXT PRIMARY KEY,
+    job TEXT NOT NULL,
+    time REAL NOT NULL,
+    total_size INTEGER,
+    compressed_size INTEGER,
+    new_size INTEGER,
+    new_compressed_size INTEGER,
+    deleted REAL
+);
+CREATE INDEX IF NOT EXISTS archives_job ON archives (job, time);
+CREATE TABLE IF NOT EXISTS deletions (
+    time REAL NOT NULL,
+    job TEXT NOT NULL,
+    archives INTEGER NOT NULL,
+    deleted_size INTEGER,
+    deleted_compressed_size INTEGER
+);
+CREATE INDEX IF NOT EXISTS deletions_job ON deletions (job, time);
+CREATE TABLE IF NOT EXISTS account (
+    time REAL NOT NULL,
+    total_size INTEGER,
+    compressed_size INTEGER,
+    unique_size INTEGER,
+    unique_compressed_size INTEGER
+);
+"""
+
+
+class StatsDatabase(object):
+    """The statistics of the archives created and deleted, stored in
+    the SQLite database ``filename``.
+    """
+
+    def __init__(self, filename, log=None):
+        self.filename = filename
+        self.log = log
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            import sqlite3
+            directory = path.dirname(self.filename)
+            if directory and not path.isdir(directory):
+                os.makedirs(directory)
+            # Used by the threads running the jobs, one at a time
+            self._db = sqlite3.connect(self.filename, check_same_thread=False)
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def _record_account(self, db, now, stats):
+        if 'all' in stats and 'unique' in stats:
+            db.execute('INSERT INTO account VALUES (?, ?, ?, ?, ?)',
+                       (now,) + stats['all'] + stats['unique'])
+
+    def record_created(self, job, name, stats):
+        """Record the ``stats`` printed when creating the archive
+        ``name`` of ``job``.
+        """
+        now = time.time()
+        total = stats.get('archive', (None, None))
+        new = stats.get('new', (None, None))
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute('INSERT OR REPLACE INTO archives VALUES '
+                           '(?, ?, ?, ?, ?, ?, ?, NULL)',
+                           (name, job.name or '', now) + total + new)
+                self._record_account(db, now, stats)
+
+    def record_deleted(self, job, names, stats):
+        """Record the ``stats`` printed when deleting the archives
+        ``names`` of ``job``.
+        """
+        now = time.time()
+        deleted = stats.get('deleted', (None, None))
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute('INSERT INTO deletions VALUES (?, ?, ?, ?, ?)',
+                           (now, job.name or '', len(names)) + deleted)
+                db.executemany('UPDATE archives SET deleted = ? '
+                               'WHERE name = ?',
+                               [(now, name) for name in names])
+                self._record_account(db, now, stats)
+
+    def job_summary(self, job, since=None):
+        """Return a dict summarizing the archives of ``job`` created and
+        deleted after the timestamp ``since``.
+        """
+        since = since or 0
+        name = job.name or ''
+        with self._lock:
+            db = self._connect()
+            created, uploaded = db.execute(
+                'SELECT COUNT(*), SUM(new_compressed_size) FROM archives '
+                'WHERE job = ? AND time >= ?', (name, since)).fetchone()
+            last = db.execute(
+                'SELECT total_size, compressed_size FROM archives '
+                'WHERE job = ? ORDER BY time DESC, rowid DESC LIMIT 1',
+                (name,)).fetchone()
+            deleted, reclaimed = db.execute(
+                'SELECT SUM(archives), SUM(deleted_compressed_size) '
+                'FROM deletions WHERE job = ? AND time >= ?',
+                (name, since)).fetchone()
+        return {'created': created, 'uploaded': uploaded or 0,
+                'last_size': last[0] if last else None,
+                'last_compressed_size': last[1] if last else None,
+                'deleted': deleted or 0, 'reclaimed': reclaimed or 0}
+
+    def account(self):
+        """Return the most recent totals of the account, as a dict, or
+        ``None``.
+        """
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT time, total_size, compressed_size, unique_size, '
+                'unique_compressed_size FROM account '
+                'ORDER BY time DESC, rowid DESC LIMIT 1').fetchone()
+        if not row:
+            return None
+        return dict(zip(('time', 'total_size', 'compressed_size',
+                         'unique_size', 'unique_compressed_size'), row))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -1,10 +1,12 @@
+from bisect import bisect_right
 from datetime import datetime
-from expire import expire as default_expire_func
+from expire import expire as default_expire_func, expire_sorted, \
+    timedelta_micros
 from config import parse_deltas
 from script import parse_date
 
 
-__all__ = ('BackupSimulator',)
+__all__ = ('BackupSimulator', 'FastSimulator',)
 
 
 try:
@@ -46,9 +48,91 @@ class BackupSimulator(object):
 
     def expire(self):
         keep = self.expire_func(self.backups, self.deltas)
-        deleted = []
-        for key in self.backups.keys():
-            if not key in keep:
-                deleted.append(key)
-                del self.backups[key]
+        keep_set = set(keep)
+        deleted = [key for key in self.backups if not key in keep_set]
+        if deleted:
+            self.backups = OrderedDict(
+                (k, v) for k, v in self.backups.iteritems() if k in keep_set)
         return deleted, keep
+
+
+class FastSimulator(object):
+    """Simulates making a backup every ``interval``, and expiring the
+    old ones after each of them, over long periods of time.
+
+    Rather than named backups with datetimes, as ``BackupSimulator``
+    uses, backups are plain integer timestamps (in microseconds since
+    the start of the simulation), expired using ``expire_sorted``.
+
+    Along the way, the number of backups is recorded, as well as the
+    largest gap between two consecutive backups for each age band. The
+    bands are given by the deltas: backups younger than the second delta
+    should be about the first delta apart, those between the second and
+    the third delta about the second delta apart, and so on.
+    """
+
+    def __init__(self, deltas, interval):
+        if isinstance(deltas, basestring):
+            deltas = parse_deltas(deltas)
+        self.deltas = sorted(timedelta_micros(d) for d in deltas)
+        self.interval = timedelta_micros(interval)
+        self.now = 0
+        self.times = []
+        # (lower, upper, expected gap) for each age band
+        self.bands = [(self.deltas[i - 1] if i > 1 else 0, self.deltas[i],
+                       self.deltas[i - 1])
+                      for i in range(1, len(self.deltas))]
+        self.worst_gaps = [0] * len(self.bands)
+        self.counts = []
+        # The number of backups once the oldest generation is full
+        self.steady_min = self.steady_max = None
+        self._steady_sum = self._steady_steps = 0
+
+    def backup(self):
+        """Make a backup now, expire, and move on by ``interval``."""
+        self.times.append(self.now)
+        keep = expire_sorted(self.times, self.deltas)
+        if len(keep) < len(self.times):
+            self.times = [self.times[i] for i in sorted(keep)]
+        self._record()
+        self.now += self.interval
+
+    def _record(self):
+        count = len(self.times)
+        if self.now >= self.deltas[-1]:
+            if self.steady_min is None:
+                self.steady_min = self.steady_max = count
+            self.steady_min = min(self.steady_min, count)
+            self.steady_max = max(self.steady_max, count)
+            self._steady_sum += count
+            self._steady_steps += 1
+
+        uppers = [upper for _, upper, _ in self.bands]
+        times = self.times
+        for older, newer in zip(times, times[1:]):
+            band = bisect_right(uppers, self.now - older)
+            if band < len(self.bands) and \
+                    newer - older > self.worst_gaps[band]:
+                self.worst_gaps[band] = newer - older
+
+    @property
+    def steady_mean(self):
+        if not self._steady_steps:
+            return None
+        return float(self._steady_sum) / self._steady_steps
+
+    def run(self, duration, sample_every=None):
+        """Make backups for ``duration``, recording the number of
+        backups every ``sample_every`` in ``counts``, as ``(time,
+        count)`` tuples.
+        """
+        until = self.now + timedelta_micros(duration)
+        sample_every = timedelta_micros(sample_every) if sample_every \
+            else self.interval
+        next_sample = self.now
+        while self.now < until:
+            now = self.now
+            self.backup()
+            if now >= next_sample:
+                self.counts.append((now, len(self.times)))
+                next_sample += sample_every
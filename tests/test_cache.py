@@ -0,0 +1,63 @@
+from os import path
+import shutil
+import tempfile
+import time
+from tarsnapper.cache import ArchiveCache, cache_filename
+
+
+class TestArchiveCache(object):
+
+    def setup(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.filename = path.join(self._tmpdir, 'archives')
+
+    def teardown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_missing(self):
+        assert ArchiveCache(self.filename).load() is None
+
+    def test_roundtrip(self):
+        ArchiveCache(self.filename).save(['a', 'b'])
+        assert ArchiveCache(self.filename).load() == ['a', 'b']
+
+    def test_ttl(self):
+        ArchiveCache(self.filename).save(['a'], time.time() - 100)
+        assert ArchiveCache(self.filename, ttl=50).load() is None
+        assert ArchiveCache(self.filename, ttl=500).load() == ['a']
+
+    def test_invalid(self):
+        open(self.filename, 'w').write('foo\nbar\n')
+        assert ArchiveCache(self.filename).load() is None
+
+    def test_stream(self):
+        cache = ArchiveCache(self.filename)
+        cache.save(['a'])
+        names = cache.stream(iter(['b', 'c']))
+        assert next(names) == 'b'
+        # Not replaced until all archives have been consumed
+        assert cache.load() == ['a']
+        assert list(names) == ['c']
+        assert cache.load() == ['b', 'c']
+
+    def test_add_remove(self):
+        cache = ArchiveCache(self.filename)
+        # Without an existing list, there is nothing to update
+        cache.add('a')
+        assert cache.load() is None
+
+        cache.save(['a', 'b'])
+        cache.add('c')
+        cache.remove(['a'])
+        assert cache.load() == ['b', 'c']
+
+
+def test_cache_filename():
+    """The cache file depends on the key and cache directory, but not
+    on other tarsnap options.
+    """
+    base = cache_filename('/tmp', [('keyfile', '/key')])
+    assert base == cache_filename('/tmp', [('keyfile', '/key'), ('v',)])
+    assert base != cache_filename('/tmp', [('keyfile', '/other')])
+    assert base != cache_filename('/tmp', [('keyfile', '/key'),
+                                           ('cachedir', '/cache')])
@@ -0,0 +1,103 @@
+from os import path
+import shutil
+import tempfile
+from datetime import datetime
+from tarsnapper.config import Job
+from tarsnapper.catalog import (
+    ArchiveCatalog, job_fingerprint, job_fingerprints, format_date,
+    parse_date)
+
+
+def test_dates():
+    for date in (datetime(2016, 1, 2, 3, 4, 5, 6), datetime(1, 1, 1)):
+        assert parse_date(format_date(date)) == date
+    assert format_date(datetime(999, 1, 1)) < format_date(datetime(1000, 1, 1))
+
+
+def test_job_fingerprint():
+    a, b = Job(name='a', target='$name-$date'), Job(name='b', target='$date')
+    assert job_fingerprint(a) == job_fingerprint(
+        Job(name='a', target='$name-$date'))
+    assert job_fingerprint(a) != job_fingerprint(a, creation_time=True)
+    assert job_fingerprint(a, [a, b]) != job_fingerprint(a, [a])
+    assert job_fingerprints([a, b], True) == {
+        'a': job_fingerprint(a, [a, b], True),
+        'b': job_fingerprint(b, [a, b], True)}
+
+
+class TestArchiveCatalog(object):
+
+    def setup(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.filename = path.join(self._tmpdir, 'catalog')
+        self.classified = []
+
+    def teardown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def classify(self, name, created):
+        """Archives "<job>-<day>" belong to <job>."""
+        self.classified.append(name)
+        job, day = name.rsplit('-', 1)
+        return [(job, created or datetime(2016, 1, int(day)))]
+
+    def test_reconcile(self):
+        catalog = ArchiveCatalog(self.filename, ttl=60)
+        assert not catalog.is_fresh()
+        catalog.reconcile([('a-1', None), ('a-2', None), ('b-1', None)],
+                          self.classify, {'a': '1', 'b': '1'})
+        assert catalog.is_fresh()
+        assert catalog.backups('a') == {'a-1': datetime(2016, 1, 1),
+                                        'a-2': datetime(2016, 1, 2)}
+
+        # Only new archives are classified
+        self.classified = []
+        catalog = ArchiveCatalog(self.filename)
+        catalog.reconcile([('a-2', None), ('a-3', None), ('b-1', None)],
+                          self.classify, {'a': '1', 'b': '1'})
+        assert self.classified == ['a-3']
+        assert sorted(catalog.backups('a')) == ['a-2', 'a-3']
+        assert catalog.list_backups('a', newest_first=True) == [
+            ('a-3', datetime(2016, 1, 3)), ('a-2', datetime(2016, 1, 2))]
+        assert catalog.backups('a', start=datetime(2016, 1, 3)).keys() == \
+            ['a-3']
+        assert catalog.backups('a', end=datetime(2016, 1, 3)).keys() == \
+            ['a-2']
+
+    def test_creation_time(self):
+        created = datetime(2015, 5, 5, 12, 30)
+        catalog = ArchiveCatalog(self.filename)
+        catalog.reconcile([('a-1', created)], self.classify, {'a': '1'})
+        assert catalog.backups('a') == {'a-1': created}
+
+    def test_classify_jobs(self):
+        catalog = ArchiveCatalog(self.filename)
+        catalog.reconcile([('a-1', None), ('b-1', None)],
+                          self.classify, {'a': '1'})
+        catalog.classify_jobs(self.classify, {'a': '1'})
+
+        # A job that is new, or was changed, is classified
+        self.classified = []
+        catalog.classify_jobs(self.classify, {'a': '1', 'b': '1'})
+        assert catalog.backups('b').keys() == ['b-1']
+        catalog.classify_jobs(self.classify, {'a': '1', 'b': '1'})
+        assert sorted(self.classified) == ['a-1', 'b-1']
+
+        # Archives added while a job was not registered
+        catalog.add('b-2', None, self.classify, {'a': '1'})
+        self.classified = []
+        catalog.classify_jobs(self.classify, {'a': '1', 'b': '1'})
+        assert sorted(catalog.backups('b')) == ['b-1', 'b-2']
+
+    def test_add_remove(self):
+        catalog = ArchiveCatalog(self.filename)
+        catalog.add('a-1', None, self.classify, {'a': '1'})
+        catalog.add('a-2', None, self.classify, {'a': '1'})
+        catalog.remove(['a-1'])
+        assert catalog.backups('a').keys() == ['a-2']
+
+    def test_names_with_suffix(self):
+        catalog = ArchiveCatalog(self.filename)
+        catalog.reconcile([('a-1', None), ('a-2.part', None)],
+                          lambda name, created: [], {})
+        assert catalog.names_with_suffix('.part') == ['a-2.part']
@@ -0,0 +1,160 @@
+from datetime import datetime
+from tarsnapper.classify import ArchiveIndex
+from tarsnapper.config import Job
+
+
+def job(name, target='$name-$date', **kwargs):
+    return Job(name=name, target=target, **kwargs)
+
+
+def test_classify():
+    home, home_dev = job('home'), job('home-dev')
+    index = ArchiveIndex([home, home_dev])
+    index.extend(['home-20100101', 'home-dev-20100102', 'other-20100103'])
+    assert index.get(home) == {
+        'home-20100101': '20100101',
+        # The generic date regex cannot tell these apart
+        'home-dev-20100102': 'dev-20100102'}
+    assert index.get(home_dev) == {'home-dev-20100102': '20100102'}
+
+
+def test_aliases():
+    """The job name takes precedence over its aliases."""
+    foo = job('foo', aliases=['foo-bar'])
+    index = ArchiveIndex([foo])
+    index.extend(['foo-bar-20100101', 'foo-20100102'])
+    assert index.get(foo) == {
+        'foo-bar-20100101': 'bar-20100101',
+        'foo-20100102': '20100102'}
+
+
+def test_no_prefix():
+    """Targets starting with the date need to be tested against every
+    archive.
+    """
+    foo = job('foo', target='$date.zip')
+    index = ArchiveIndex([foo])
+    index.extend(['20100101.zip', '20100101.tar'])
+    assert index.get(foo) == {'20100101.zip': '20100101'}
+
+
+def test_repeated_date():
+    foo = job('foo', target='$date/$name-$date')
+    index = ArchiveIndex([foo])
+    index.extend(['2010/foo-2010', '2010/foo-2011'])
+    assert index.get(foo) == {'2010/foo-2010': '2010'}
+
+
+def test_add_remove():
+    foo = job('foo')
+    index = ArchiveIndex([foo])
+    assert foo in index
+    assert job('bar') not in index
+    index.add('foo-1')
+    index.add('foo-2')
+    index.remove('foo-1')
+    assert index.get(foo) == {'foo-2': '2'}
+
+
+def test_dateformat():
+    """With a dateformat, only dates in that format are matched, and
+    are turned into a datetime right away.
+    """
+    home = job('home', dateformat='%Y%m%d')
+    index = ArchiveIndex([home])
+    index.extend(['home-20100101', 'home-dev-20100102', 'home-20101301'])
+    assert index.get(home) == {
+        'home-20100101': datetime(2010, 1, 1),
+        # Left to be rejected by parse_date()
+        'home-20101301': '20101301'}
+
+
+def test_default_dateformat():
+    """Without a dateformat, dates in the default format are preferred,
+    but anything else is accepted, too.
+    """
+    home = job('home')
+    index = ArchiveIndex([home])
+    index.extend(['home-20100101-000000', 'home-2010-01-02'])
+    assert index.get(home) == {
+        'home-20100101-000000': datetime(2010, 1, 1),
+        'home-2010-01-02': '2010-01-02'}
+
+
+def test_longer_prefix():
+    """Any string is not accepted as the date if a job with a longer
+    prefix matches the archive with a date in its format.
+    """
+    windows, windows_data = job('windows'), job('windows-data')
+    index = ArchiveIndex([windows, windows_data])
+    index.extend(['windows-20100101-000000', 'windows-data-20100102-000000',
+                  'windows-data-2010-01-03'])
+    assert index.get(windows) == {
+        'windows-20100101-000000': datetime(2010, 1, 1),
+        'windows-data-2010-01-03': 'data-2010-01-03'}
+    assert index.get(windows_data) == {
+        'windows-data-20100102-000000': datetime(2010, 1, 2),
+        'windows-data-2010-01-03': '2010-01-03'}
+
+
+def test_unsupported_dateformat():
+    home = job('home', dateformat='%Y %B')
+    index = ArchiveIndex([home])
+    index.extend(['home-2010 January'])
+    assert index.get(home) == {'home-2010 January': '2010 January'}
+
+
+def test_exclusive():
+    """In exclusive mode, an archive belongs to the job with the longest
+    matching prefix only.
+    """
+    home, home_dev = job('home'), job('home-dev')
+    index = ArchiveIndex([home, home_dev], exclusive=True)
+    index.add('home-dev-20100101-000000', datetime(2011, 1, 1))
+    assert index.get(home) == {}
+    assert index.get(home_dev) == {
+        'home-dev-20100101-000000': datetime(2011, 1, 1)}
+
+
+def test_exclusive_dates():
+    """In exclusive mode, an archive name must contain a date in the
+    job's format, or without one, in a common layout; the prefix alone
+    is not enough.
+    """
+    home, home_dev = job('home'), job('home-dev')
+    index = ArchiveIndex([home, home_dev], exclusive=True)
+    index.extend(['home-manual-keep', 'home-2010-01-02',
+                  'home-dev-20100101-000000'])
+    assert index.get(home) == {'home-2010-01-02': datetime(2010, 1, 2)}
+    assert index.get(home_dev) == {
+        'home-dev-20100101-000000': datetime(2010, 1, 1)}
+
+
+def test_exclusive_unsupported_dateformat():
+    """Directives that cannot be parsed directly match a single word."""
+    home = job('home', dateformat='%Y %B')
+    index = ArchiveIndex([home], exclusive=True)
+    index.extend(['home-2010 January', 'home-manual keep'])
+    assert index.get(home) == {'home-2010 January': '2010 January'}
+
+
+def test_shared_patterns():
+    """Jobs whose targets continue the same way after their prefix
+    share the compiled regular expressions.
+    """
+    home, mail = job('home'), job('mail')
+    assert [r for _, r, _ in home.target_patterns] == \
+        [r for _, r, _ in mail.target_patterns]
+    assert home.target_patterns[0][1] is mail.target_patterns[0][1]
+
+
+def test_partial():
+    """Partial archives belong to no job, but are kept track of."""
+    home = job('home')
+    index = ArchiveIndex([home])
+    index.extend(['home-20100101-000000', 'home-20100102-000000.part'])
+    assert index.get(home) == {
+        'home-20100101-000000': datetime(2010, 1, 1)}
+    assert index.partial == set(['home-20100102-000000.part'])
+    index.remove('home-20100102-000000.part')
+    assert index.partial == set()
@@ -1,4 +1,11 @@
-from tarsnapper.config import load_config, ConfigError
+import os
+from os import path
+import shutil
+import tempfile
+import cPickle as pickle
+from tarsnapper.config import (
+    Job, load_config, load_config_from_file, config_cache_filename,
+    parse_deltas, ConfigError)
 from nose.tools import assert_raises
 
 
@@ -271,3 +278,144 @@ def test_named_delta_and_deltas():
         delta: myDelta
         deltas: 5d 10d
     """)
+
+
+def test_group():
+    c = load_config("""
+    target: $name-$date
+    jobs:
+      foo:
+        group: db
+      bar:
+    """)[0]
+    assert c['foo'].group == 'db'
+    assert c['bar'].group is None
+
+
+def test_checkpoint_bytes():
+    c = load_config("""
+    target: $name-$date
+    checkpoint_bytes: 10M
+    jobs:
+      foo:
+        checkpoint_bytes: 2000000
+      bar:
+    """)[0]
+    assert c['foo'].checkpoint_bytes == 2000000
+    assert c['bar'].checkpoint_bytes == 10000000
+    assert_raises(ConfigError, load_config, """
+    target: $name-$date
+    jobs:
+      foo:
+        checkpoint_bytes: 100k
+    """)
+    assert_raises(ConfigError, load_config, """
+    target: $name-$date
+    jobs:
+      foo:
+        checkpoint_bytes: lots
+    """)
+
+
+def test_order():
+    """Jobs are returned in the order they are defined."""
+    c = load_config("""
+    target: $name-$date
+    jobs:
+      zeta:
+      alpha:
+      mail:
+      beta:
+    """)[0]
+    assert c.keys() == ['zeta', 'alpha', 'mail', 'beta']
+
+
+class TestConfigCache(object):
+
+    def setup(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.filename = path.join(self._tmpdir, 'tarsnapper.conf')
+        self.cache = config_cache_filename(self.filename)
+
+    def teardown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def write(self, text):
+        with open(self.filename, 'w') as f:
+            f.write(text)
+
+    def test_cached(self):
+        self.write("""
+        target: $name-$date
+        deltas: 1d 7d
+        jobs:
+          foo:
+        """)
+        jobs, _ = load_config_from_file(self.filename)
+        assert path.exists(self.cache)
+        cached, _ = load_config_from_file(self.filename)
+        assert cached['foo'].deltas == jobs['foo'].deltas
+
+    def test_order(self):
+        self.write("""
+        target: $name-$date
+        jobs:
+          zeta:
+          alpha:
+          mail:
+          beta:
+        """)
+        load_config_from_file(self.filename)
+        cached, _ = load_config_from_file(self.filename)
+        assert cached.keys() == ['zeta', 'alpha', 'mail', 'beta']
+
+    def test_changed(self):
+        """A changed config file is loaded, and validated, again."""
+        self.write("""
+        target: $name-$date
+        jobs:
+          foo:
+        """)
+        load_config_from_file(self.filename)
+        self.write("""
+        target: $name
+        jobs:
+          foo:
+        """)
+        assert_raises(ConfigError, load_config_from_file, self.filename)
+
+    def test_untrusted(self):
+        """A cache file others could have written is ignored."""
+        self.write("""
+        target: $name-$date
+        jobs:
+          foo:
+        """)
+        load_config_from_file(self.filename)
+        with open(self.cache, 'r+b') as f:
+            key = f.readline()
+            f.seek(0)
+            f.write(key)
+            pickle.dump(({'bar': Job(name='bar')}, {}), f)
+            f.truncate()
+        assert load_config_from_file(self.filename)[0].keys() == ['bar']
+        os.chmod(self.cache, 0666)
+        assert load_config_from_file(self.filename)[0].keys() == ['foo']
+
+
+def test_job_derived():
+    """What is derived from a job's settings is built only once."""
+    job = Job(name='foo', target='$name-$date', deltas=parse_deltas('7d 1d'))
+    assert not hasattr(job, '__dict__')
+    assert job.sorted_deltas == parse_deltas('1d 7d')
+    assert job.target_patterns is job.target_patterns
+    assert job.target_template is job.target_template
+
+
+def test_job_pickle():
+    job = Job(name='foo', target='$name-$date', deltas=parse_deltas('1d 7d'))
+    job.target_patterns
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        copy = pickle.loads(pickle.dumps(job, protocol))
+        assert copy.name == 'foo' and copy.deltas == job.deltas
+        assert copy.target_patterns[0][0] == 'foo-'
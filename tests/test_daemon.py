@@ -0,0 +1,36 @@
+from tarsnapper.config import Job, parse_deltas
+from tarsnapper.daemon import JobQueue, job_interval
+
+
+def test_job_interval():
+    assert job_interval(Job(name='a', deltas=parse_deltas('1d 1h 7d'))) \
+        == 3600
+    assert job_interval(Job(name='a')) is None
+
+
+def test_queue():
+    a, b, c = Job(name='a'), Job(name='b'), Job(name='c')
+    queue = JobQueue()
+    queue.push(a, 30)
+    queue.push(b, 10)
+    queue.push(c, 20)
+    assert queue.next_due() == 10
+    assert queue.pop_due(20) == [(10, b), (20, c)]
+    assert queue.pop_due(20) == []
+    assert queue.names() == ['a']
+
+
+def test_queue_reschedule():
+    """Scheduling a job again replaces its previous entry."""
+    a, b = Job(name='a'), Job(name='b')
+    queue = JobQueue()
+    queue.push(a, 10)
+    queue.push(b, 20)
+    queue.push(a, 30)
+    assert queue.due('a') == 30
+    assert queue.next_due() == 20
+    queue.remove('b')
+    assert queue.next_due() == 30
+    assert len(queue) == 1
+    assert queue.pop_due(100) == [(30, a)]
+    assert queue.next_due() is None
@@ -0,0 +1,66 @@
+from datetime import datetime
+import dateutil.parser
+from nose.tools import assert_raises
+from tarsnapper.dates import (
+    DateFormat, DateParser, compile_dateformat, DEFAULT_DATEFORMAT,
+    FAST_LAYOUTS)
+
+
+def test_matches_strptime():
+    """Dates are constructed the same way strptime would do it."""
+    dt = datetime(2010, 6, 15, 1, 2, 3, 456789)
+    for fmt in [DEFAULT_DATEFORMAT, '%Y-%m-%dT%H:%M:%S.%f', '%y%m%d',
+                '%Y.%j', '%d/%m/%Y %%', '%H%M', 'foo(%Y)']:
+        string = dt.strftime(fmt)
+        assert DateFormat(fmt).parse(string) == \
+            datetime.strptime(string, fmt), fmt
+
+
+def test_short_year():
+    assert DateFormat('%y').parse('68').year == 2068
+    assert DateFormat('%y').parse('69').year == 1969
+
+
+def test_fixed_width():
+    fmt = DateFormat(DEFAULT_DATEFORMAT)
+    assert_raises(ValueError, fmt.parse, 'data-20100615-010203')
+    assert_raises(ValueError, fmt.parse, '2010615-010203')
+    # Matches the pattern, but is not a valid date
+    assert_raises(ValueError, fmt.parse, '20101315-010203')
+
+
+def test_unsupported():
+    assert_raises(ValueError, DateFormat, '%Y %B')
+    assert_raises(ValueError, DateFormat, '%Y%')
+    assert compile_dateformat('%a %Y') is None
+    assert compile_dateformat('%Y') is compile_dateformat('%Y')
+
+
+def test_fast_layouts():
+    """The fast layouts parse dates the same way python-dateutil does."""
+    dt = datetime(2010, 6, 15, 1, 2, 3, 456789)
+    for layout in FAST_LAYOUTS:
+        string = dt.strftime(layout.dateformat)
+        assert layout.parse(string) == dateutil.parser.parse(string), \
+            layout.dateformat
+    assert_raises(ValueError, FAST_LAYOUTS[0].parse, '20100615+010203')
+    assert_raises(ValueError, FAST_LAYOUTS[0].parse, '2010061 -010203')
+
+
+def test_parser():
+    parser = DateParser(max_hints=2)
+    assert parser.parse('20100615-010203') == datetime(2010, 6, 15, 1, 2, 3)
+    assert parser.parse('June 15 2010') == datetime(2010, 6, 15)
+    assert parser.parse('15.06.2010', '%d.%m.%Y') == datetime(2010, 6, 15)
+    # strptime does not require a fixed width
+    assert parser.parse('1.6.2010', '%d.%m.%Y') == datetime(2010, 6, 1)
+
+
+def test_parser_hints():
+    parser = DateParser(max_hints=2)
+    parser.parse('2010-06-15', key='a')
+    parser.parse('20100615', key='b')
+    assert parser._hints['a'].dateformat == '%Y-%m-%d'
+    parser.parse('20100615', key='c')
+    # Only the most recent keys are remembered
+    assert parser._hints.keys() == ['b', 'c']
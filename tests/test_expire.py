@@ -6,7 +6,12 @@ XXX: How should test this? What exactly should be tested?
 - Jumping a long time into the future -> stuff should be deleted.
 """
 
-from tarsnapper.test import BackupSimulator
+import operator
+import random
+from datetime import datetime, timedelta
+from tarsnapper.config import parse_deltas
+from tarsnapper.expire import expire
+from tarsnapper.test import BackupSimulator, FastSimulator, OrderedDict
 
 def test_failing_keep():
     """This used to delete backup B, because we were first looking
@@ -22,4 +27,117 @@ def test_failing_keep():
         '20100620-000000',   # C
     ])
     delete, keep = s.expire()
-    assert not delete
\ No newline at end of file
+    assert not delete
+
+def reference_expire(backups, deltas):
+    """The original, straightforward implementation of
+    ``tarsnapper.expire.expire``, kept as an oracle for the optimized
+    version. It re-sorts all backups for every step it takes.
+    """
+    backups = [(name, time) for name, time in backups.items()]
+    backups.sort(cmp=lambda x, y: -cmp(x[1], y[1]))
+
+    deltas = list(deltas[:])
+    deltas.sort()
+
+    most_recent_backup = backups[0][1]
+    to_keep = set([backups[0][0]])
+
+    last_delta = deltas.pop()
+    while deltas:
+        current_delta = deltas.pop()
+        dt_pointer = most_recent_backup - last_delta
+        last_selected = None
+        while dt_pointer < most_recent_backup:
+            by_dist = sorted([(bn, bd, abs(bd - dt_pointer))
+                              for bn, bd in backups],
+                             key=operator.itemgetter(2))
+            if by_dist[0][0] == last_selected:
+                dt_pointer += current_delta
+            else:
+                last_selected = by_dist[0][0]
+                to_keep.add(by_dist[0][0])
+                dt_pointer = by_dist[0][1] + current_delta
+        last_delta = current_delta
+
+    return list(to_keep)
+
+
+def random_backups(rnd, count):
+    """Generate backups spread out irregularly, with bursts, large gaps
+    and duplicate timestamps.
+    """
+    backups = OrderedDict()
+    dt = datetime(2010, 1, 1)
+    for i in range(count):
+        gap = rnd.choice([
+            timedelta(0),
+            timedelta(seconds=rnd.randint(1, 3600)),
+            timedelta(hours=rnd.randint(1, 48)),
+            timedelta(days=rnd.randint(1, 90)),
+        ])
+        dt += gap
+        backups['backup-%d' % i] = dt
+    return backups
+
+
+def test_matches_reference():
+    """The optimized implementation keeps exactly the same backups as
+    the original one.
+    """
+    rnd = random.Random(42)
+    policies = ['1h 1d', '1d 7d 30d', '1h 6h 1d 7d 24d 180d',
+                '1d 7d 30d 360d 18000d', '30s 90s 1h']
+    for i in range(300):
+        backups = random_backups(rnd, rnd.randint(1, 60))
+        deltas = parse_deltas(rnd.choice(policies))
+        assert sorted(expire(backups, deltas)) == \
+            sorted(reference_expire(backups, deltas))
+
+
+def test_matches_reference_simulated():
+    """Both implementations agree over a simulated backup history."""
+    rnd = random.Random(7)
+    fast = BackupSimulator('1h 1d 7d 30d')
+    slow = BackupSimulator('1h 1d 7d 30d', expire_func=reference_expire)
+    slow.go_to(fast.now)
+    for i in range(200):
+        td = timedelta(minutes=rnd.randint(1, 600))
+        fast.go_by(td)
+        slow.go_by(td)
+        assert fast.backup()[0] == slow.backup()[0]
+
+
+def test_large_gap():
+    """A gap spanning many deltas does not require stepping through
+    each of them.
+    """
+    backups = {
+        'old': datetime(1970, 1, 1),
+        'new': datetime(2015, 1, 1),
+        'newest': datetime(2015, 1, 1, 1),
+    }
+    keep = expire(backups, parse_deltas('1s 1h 18000d'))
+    assert sorted(keep) == ['new', 'newest', 'old']
+
+
+def test_fast_simulator():
+    """The fast simulator keeps the same backups as the regular one."""
+    fast = FastSimulator('1h 1d 7d', timedelta(hours=1))
+    slow = BackupSimulator('1h 1d 7d')
+    start = slow.now
+    for i in range(300):
+        fast.backup()
+        slow.backup()
+        slow.go_by(timedelta(hours=1))
+        assert fast.times == [
+            (d - start).days * 86400 * 1000000 + (d - start).seconds * 1000000
+            for d in slow.backups.values()]
+
+
+def test_fast_simulator_stats():
+    s = FastSimulator('1h 1d 7d', timedelta(hours=1))
+    s.run(timedelta(days=30), timedelta(days=1))
+    assert len(s.counts) == 30
+    assert s.worst_gaps[0] == 3600 * 1000000
+    assert s.steady_min <= s.steady_mean <= s.steady_max
@@ -0,0 +1,55 @@
+from os import path
+import shutil
+import tempfile
+from tarsnapper.config import Job, parse_deltas
+from tarsnapper.journal import DeletionJournal
+
+
+def job(name='home', deltas='1d 7d'):
+    return Job(name=name, target='$name-$date', deltas=parse_deltas(deltas))
+
+
+class TestDeletionJournal(object):
+
+    def setup(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.filename = path.join(self._tmpdir, 'journal')
+
+    def teardown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_resume(self):
+        journal = DeletionJournal(self.filename)
+        assert journal.pending(job()) is None
+        journal.start(job(), ['a', 'b', 'c'], True)
+        journal.done(job(), ['a'])
+
+        journal = DeletionJournal(self.filename)
+        assert journal.pending(job()) == (['b', 'c'], True)
+        assert journal.pending(job('other')) is None
+        journal.done(job(), ['b', 'c'])
+        journal.finish(job())
+        assert not path.exists(self.filename)
+        assert DeletionJournal(self.filename).pending(job()) is None
+
+    def test_multiple_jobs(self):
+        journal = DeletionJournal(self.filename)
+        journal.start(job('a'), ['a-1'])
+        journal.start(job('b'), ['b-1'])
+        journal.finish(job('a'))
+        journal = DeletionJournal(self.filename)
+        assert journal.pending(job('a')) is None
+        assert journal.pending(job('b')) == (['b-1'], None)
+
+    def test_changed_job(self):
+        """A plan is not resumed for a job whose deltas changed."""
+        DeletionJournal(self.filename).start(job(), ['a'])
+        assert DeletionJournal(self.filename).pending(
+            job(deltas='1d 30d')) is None
+
+    def test_truncated(self):
+        journal = DeletionJournal(self.filename)
+        journal.start(job(), ['a', 'b'])
+        journal.done(job(), ['a'])
+        open(self.filename, 'ab').write('{"job": "home", "do')
+        assert DeletionJournal(self.filename).pending(job()) == (['b'], None)
@@ -0,0 +1,68 @@
+import logging
+import time
+from nose.tools import assert_raises
+from tarsnapper.loop import ProcessLoop
+from tarsnapper.script import LoopBackend, TarsnapError
+
+
+def test_shell():
+    loop = ProcessLoop()
+    chunks = []
+    process = loop.spawn_shell('echo foo; echo bar >&2; exit 3',
+                               on_output=chunks.append)
+    loop.run()
+    assert process.finished
+    assert process.exitstatus == 3
+    assert process.get_output() == 'foo\nbar\n'
+    assert ''.join(chunks) == 'foo\nbar\n'
+
+
+def test_concurrent():
+    """Processes run at the same time."""
+    loop = ProcessLoop()
+    start = time.time()
+    processes = [loop.spawn_shell('sleep 0.3; echo %d' % i)
+                 for i in range(5)]
+    loop.run(processes)
+    assert time.time() - start < 1.2
+    assert [p.get_output() for p in processes] == \
+        ['%d\n' % i for i in range(5)]
+
+
+def test_passphrase_prompt():
+    """The prompt is answered, and not included in the output."""
+    loop = ProcessLoop()
+    process = loop.spawn_tarsnap(
+        ['sh', '-c', 'stty -echo; printf "Please enter passphrase for keyfile k: "; '
+                     'read p; echo "got $p"'],
+        get_passphrase=lambda: 'secret')
+    loop.run()
+    assert process.exitstatus == 0
+    assert process.get_output().strip() == 'got secret'
+
+
+def test_no_prompt():
+    loop = ProcessLoop()
+    process = loop.spawn_tarsnap(['sh', '-c', 'echo a; echo b; exit 1'])
+    loop.run()
+    assert process.exitstatus == 1
+    assert process.get_output().split() == ['a', 'b']
+
+
+def test_backend_util():
+    backend = LoopBackend(logging.getLogger('test_loop'), [])
+    backend._exec_util('true')
+    assert_raises(RuntimeError, backend._exec_util, 'exit 2')
+
+    processes = [backend.submit_util('echo %d' % i) for i in range(3)]
+    backend.wait()
+    assert all(p.exitstatus == 0 for p in processes)
+
+
+def test_backend_stream():
+    backend = LoopBackend(logging.getLogger('test_loop'), [])
+    lines = backend._stream_tarsnap(['sh', '-c', 'echo a; echo b; printf c'])
+    assert [l.rstrip() for l in lines] == ['a', 'b', 'c']
+
+    lines = backend._stream_tarsnap(['sh', '-c', 'echo a; exit 1'])
+    assert_raises(TarsnapError, list, lines)
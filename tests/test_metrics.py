@@ -0,0 +1,77 @@
+from os import path
+import json
+import shutil
+import tempfile
+from tarsnapper.config import Job
+from tarsnapper.metrics import Metrics, command_name
+
+
+class Error(Exception):
+    exitstatus = 3
+
+
+def test_command_name():
+    assert command_name(['tarsnap', '-d', '-f', 'a']) == 'delete'
+    assert command_name(['tarsnap', '-c', '--print-stats']) == 'create'
+    assert command_name(['tarsnap', '--fsck']) == 'other'
+
+
+def test_phases():
+    """Time spent in nested phases is not counted twice."""
+    metrics = Metrics()
+    with metrics.job(Job(name='home')):
+        with metrics.phase('classifying'):
+            assert list(metrics.timed(iter([1, 2]), 'listing')) == [1, 2]
+    phases = metrics.jobs['home']['seconds']
+    assert set(phases) == set(['classifying', 'listing', 'total'])
+    assert phases['classifying'] + phases['listing'] <= phases['total']
+
+
+def test_calls():
+    metrics = Metrics()
+    with metrics.call('list') as record:
+        record['output_bytes'] += 10
+    try:
+        with metrics.call('delete'):
+            raise Error()
+    except Error:
+        pass
+    assert [(k, v[0], v[2]) for k, v in metrics.calls.items()] == [
+        (('', 'list', 0), 1, 10), (('', 'delete', 3), 1, 0)]
+
+
+class TestOutput(object):
+
+    def setup(self):
+        self._tmpdir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_log(self):
+        filename = path.join(self._tmpdir, 'metrics.jsonl')
+        metrics = Metrics(log_filename=filename)
+        with metrics.job(Job(name='home')):
+            with metrics.call('create'):
+                pass
+            metrics.count('deleted', 2)
+        metrics.close(True)
+        records = [json.loads(l) for l in open(filename)]
+        assert [r['event'] for r in records] == ['call', 'job', 'run']
+        assert records[0]['job'] == 'home'
+        assert records[1]['archives'] == {'deleted': 2}
+
+    def test_textfile(self):
+        filename = path.join(self._tmpdir, 'tarsnapper.prom')
+        metrics = Metrics(textfile_filename=filename)
+        with metrics.job(Job(name='ho"me')):
+            with metrics.call('list') as record:
+                record['output_bytes'] = 42
+            metrics.count('matched', 5)
+        metrics.close(False)
+        lines = open(filename).read().splitlines()
+        assert 'tarsnapper_call_output_bytes{command="list",job="ho\\"me",' \
+               'status="0"} 42' in lines
+        assert 'tarsnapper_job_archives{archives="matched",job="ho\\"me"} 5' \
+            in lines
+        assert 'tarsnapper_run_success 0' in lines
@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+from nose.tools import assert_raises
+from tarsnapper.config import Job, load_config
+from tarsnapper.runner import run_jobs, group_jobs, order_jobs
+
+
+log = logging.getLogger('test_runner')
+
+
+def test_group_jobs():
+    a, b, c = Job(name='a', group='db'), Job(name='b'), Job(name='c', group='db')
+    assert group_jobs([a, b, c]) == [[a, c], [b]]
+
+
+def test_order_jobs():
+    """The heaviest groups come first; groups keep their own order."""
+    a, b, c = Job(name='a', group='db'), Job(name='b'), Job(name='c', group='db')
+    d = Job(name='d')
+    weights = {'a': 1, 'b': 5, 'c': 1, 'd': 1}
+    weight = lambda job: weights[job.name]
+    assert order_jobs([a, b, c, d], weight) == [b, a, c, d]
+    assert order_jobs([a, b, c, d]) == [a, c, b, d]
+
+
+def test_concurrent():
+    """Jobs without a group run at the same time."""
+    running = []
+    barrier = threading.Event()
+
+    def func(job):
+        running.append(job)
+        if len(running) == 2:
+            barrier.set()
+        # Only returns if the other job has been started meanwhile
+        assert barrier.wait(5)
+
+    run_jobs([Job(name='a'), Job(name='b')], func, 2, log)
+
+
+def test_serialized():
+    """Jobs sharing a group run one after another, in order."""
+    events = []
+
+    def func(job):
+        events.append(('start', job.name))
+        time.sleep(0.01)
+        events.append(('end', job.name))
+
+    run_jobs([Job(name='a', group='x'), Job(name='b', group='x')],
+             func, 2, log)
+    assert events == [('start', 'a'), ('end', 'a'),
+                      ('start', 'b'), ('end', 'b')]
+
+
+def test_config_order():
+    """Jobs of a group run in the order of the config file."""
+    jobs, _ = load_config("""
+    target: $name-$date
+    jobs:
+      zeta:
+        group: db
+      alpha:
+        group: db
+      other:
+      mail:
+        group: db
+      beta:
+        group: db
+    """)
+    started = []
+    run_jobs(jobs.values(), lambda job: started.append(job.name), 1, log)
+    assert [n for n in started if n != 'other'] == [
+        'zeta', 'alpha', 'mail', 'beta']
+
+
+def test_error():
+    """The first error is re-raised, and no further jobs are started."""
+    started = []
+
+    def func(job):
+        started.append(job.name)
+        raise ValueError(job.name)
+
+    jobs = [Job(name='a', group='x'), Job(name='b', group='x')]
+    assert_raises(ValueError, run_jobs, jobs, func, 2, log)
+    assert started == ['a']
@@ -0,0 +1,58 @@
+from os import path
+import shutil
+import tempfile
+import time
+from tarsnapper.config import Job, parse_deltas
+from tarsnapper.schedule import ExpirySchedule
+
+
+def job(name='home', deltas='1d 7d', **kwargs):
+    return Job(name=name, target='$name-$date', deltas=parse_deltas(deltas),
+               **kwargs)
+
+
+class TestExpirySchedule(object):
+
+    def setup(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.filename = path.join(self._tmpdir, 'expiry')
+
+    def teardown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_clean(self):
+        ExpirySchedule(self.filename).set_clean(job())
+        schedule = ExpirySchedule(self.filename)
+        assert schedule.is_clean(job())
+        assert not schedule.is_clean(job('other'))
+
+        schedule.set_clean(job(), False)
+        assert not ExpirySchedule(self.filename).is_clean(job())
+
+    def test_changed_job(self):
+        """Changing the deltas or the target requires expiring again."""
+        schedule = ExpirySchedule(self.filename)
+        schedule.set_clean(job())
+        assert not schedule.is_clean(job(deltas='1d 30d'))
+        assert not schedule.is_clean(job(dateformat='%Y%m%d'))
+
+    def test_ttl(self):
+        ExpirySchedule(self.filename).set_clean(job())
+        assert ExpirySchedule(self.filename, ttl=60).is_clean(job())
+        time.sleep(0.01)
+        assert not ExpirySchedule(self.filename, ttl=0).is_clean(job())
+
+    def test_invalidate(self):
+        """A new archive invalidates all jobs it may belong to."""
+        schedule = ExpirySchedule(self.filename)
+        for name in ('home', 'home-dev', 'www'):
+            schedule.set_clean(job(name))
+        schedule.invalidate('home-dev-20100101-000000')
+        schedule = ExpirySchedule(self.filename)
+        assert not schedule.is_clean(job('home'))
+        assert not schedule.is_clean(job('home-dev'))
+        assert schedule.is_clean(job('www'))
+
+    def test_invalid(self):
+        open(self.filename, 'w').write('foo')
+        assert not ExpirySchedule(self.filename).is_clean(job())
@@ -1,15 +1,20 @@
 from StringIO import StringIO
+import os
 from os import path
 import re
 import shutil
 import tempfile
+import sys
+import json
 import logging
 import argparse
 from datetime import datetime
 from tarsnapper.script import (
-    TarsnapBackend, MakeCommand, ListCommand, ExpireCommand, parse_args,
-    DEFAULT_DATEFORMAT)
+    TarsnapBackend, MakeCommand, ListCommand, ExpireCommand, StatsCommand,
+    DaemonCommand, parse_args, main, TarsnapError, DEFAULT_DATEFORMAT,
+    BACKENDS)
 from tarsnapper.config import Job, parse_deltas, str_to_timedelta
+from tarsnapper.daemon import JobQueue
 
 
 class FakeBackend(TarsnapBackend):
@@ -18,11 +23,39 @@ class FakeBackend(TarsnapBackend):
         TarsnapBackend.__init__(self, *a, **kw)
         self.calls = []
         self.fake_archives = []
+        self.fail_archives = []
+        self.missing_archives = []
+        self.deleted_archives = []
+        # Job name => new bytes reported by --print-stats
+        self.new_bytes = {}
 
     def _exec_tarsnap(self, args):
         self.calls.append(args[1:])  # 0 is "tarsnap"
+        if '--print-stats' in args and '-d' in args:
+            return 'All archives  10000  5000\n  (unique data)  2000  1000\n' \
+                + 'Deleted data  300  100\n' * args.count('-f')
+        if '--print-stats' in args:
+            target = args[args.index('-f') + 1]
+            return 'This archive  5000  2500\nNew data  %d  %d\n' % (
+                0, self.new_bytes.get(target.split('-')[0], 0))
         if '--list-archives' in args:
             return "\n".join(self.fake_archives)
+        if '-d' in args:
+            # Like tarsnap, delete the archives in turn up to the
+            # first one that fails
+            names = [args[i + 1] for i, arg in enumerate(args)
+                     if arg == '-f']
+            for name in names:
+                if name in self.fail_archives:
+                    raise TarsnapError('Cannot delete %s' % name)
+                if name in self.missing_archives or \
+                        name in self.deleted_archives:
+                    raise TarsnapError('tarsnap: No such archive')
+                self.deleted_archives.append(name)
+
+    def _stream_tarsnap(self, args):
+        for line in self._exec_tarsnap(args).splitlines(True):
+            yield line
 
     def _exec_util(self, cmdline):
         self.calls.append(cmdline)
@@ -66,7 +99,10 @@ class BaseTest(object):
         cmd = self.command_class(argparse.Namespace(**final_args),
                                  self.log, backend_class=FakeBackend)
         cmd.backend.fake_archives = archives
-        for job in (jobs if isinstance(jobs, list) else [jobs]):
+        jobs = jobs if isinstance(jobs, list) else [jobs]
+        # Like main(), register all jobs with the backend first
+        cmd.backend.add_jobs(jobs)
+        for job in jobs:
             cmd.run(job)
         return cmd
 
@@ -125,6 +161,13 @@ class TestMake(BaseTest):
             ('--list-archives',)
         ])
 
+    def test_empty_source(self):
+        """If a source directory is empty, the job is skipped."""
+        empty = path.join(self._tmpdir, 'empty')
+        os.mkdir(empty)
+        cmd = self.run(self.job(sources=[self._tmpdir, empty]), [])
+        assert cmd.backend.match([])
+
     def test_no_sources(self):
         """If no sources are defined, the job is skipped."""
         cmd = self.run(self.job(sources=None), [])
@@ -155,6 +198,296 @@ class TestMake(BaseTest):
         ])
 
 
+class TestConcurrentMake(BaseTest):
+
+    command_class = MakeCommand
+
+    def run(self, jobs, archives, **args):
+        final_args = {
+            'tarsnap_options': (),
+            'no_expire': True,
+            'workers': 3,
+        }
+        final_args.update(args)
+        cmd = self.command_class(argparse.Namespace(**final_args),
+                                 self.log, backend_class=FakeBackend)
+        cmd.backend.fake_archives = archives
+        cmd.process(jobs)
+        return cmd
+
+    def test_exec_order(self):
+        """Each job's hooks are run around its own archive creation."""
+        names = ['a', 'b', 'c', 'd']
+        cmd = self.run([
+            self.job(name=n, exec_before='before %s' % n,
+                     exec_after='after %s' % n)
+            for n in names], [])
+        calls = cmd.backend.calls
+        assert len(calls) == 12
+        for n in names:
+            before = calls.index('before %s' % n)
+            after = calls.index('after %s' % n)
+            create = [i for i, c in enumerate(calls)
+                      if c[0] == '-c' and c[2].startswith('%s-' % n)]
+            assert before < create[0] < after
+
+
+class TestEstimate(BaseTest):
+
+    command_class = MakeCommand
+
+    def run(self, jobs, new_bytes, **args):
+        final_args = {
+            'tarsnap_options': (),
+            'no_expire': True,
+            'estimate': True,
+            'archive_cache': self._tmpdir,
+        }
+        final_args.update(args)
+        cmd = self.command_class(argparse.Namespace(**final_args),
+                                 self.log, backend_class=FakeBackend)
+        cmd.backend.new_bytes = new_bytes
+        cmd.process(jobs)
+        return cmd
+
+    def created(self, cmd):
+        return [c[c.index('-f') + 1].split('-')[0]
+                for c in cmd.backend.calls if '--dry-run' not in c]
+
+    def test_largest_first(self):
+        jobs = [self.job(name=n) for n in 'abc']
+        cmd = self.run(jobs, {'a': 100, 'b': 300, 'c': 200})
+        assert cmd.backend.match(
+            [('-c', '--dry-run', '--print-stats', '-f', '%s-.*' % n, '.*')
+             for n in 'abc'] +
+            [('-c', '--print-stats', '-f', '%s-.*' % n, '.*')
+             for n in 'bca'])
+
+        # The next run uses the size of the backups just made
+        cmd = self.run(jobs, {'a': 400, 'b': 300, 'c': 200})
+        assert self.created(cmd) == ['b', 'c', 'a']
+        cmd = self.run(jobs, {})
+        assert self.created(cmd) == ['a', 'b', 'c']
+
+    def test_disabled(self):
+        jobs = [self.job(name=n) for n in 'abc']
+        cmd = self.run(jobs, {'a': 100, 'b': 300, 'c': 200}, estimate=False)
+        assert cmd.backend.match(
+            [('-c', '-f', '%s-.*' % n, '.*') for n in 'abc'])
+
+
+class TestDaemon(BaseTest):
+
+    command_class = DaemonCommand
+
+    def daemon(self, jobs, archives, until, **args):
+        """Run the daemon until ``until`` seconds have passed."""
+        final_args = {
+            'tarsnap_options': (),
+            'no_expire': True,
+            'config': None,
+            'jobs': [],
+            'refresh_every': str_to_timedelta('1d'),
+        }
+        final_args.update(args)
+        cmd = self.command_class(argparse.Namespace(**final_args),
+                                 self.log, backend_class=FakeBackend)
+        cmd.backend.fake_archives = archives
+        clock = [1000.0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+            if clock[0] > 1000 + until:
+                cmd.stopping = True
+        cmd.clock = lambda: clock[0]
+        cmd.sleep = sleep
+        cmd.backend.add_jobs(jobs)
+        cmd.process(jobs)
+        return cmd
+
+    def created(self, cmd):
+        return [c[c.index('-f') + 1].split('-')[0]
+                for c in cmd.backend.calls if c[0] == '-c']
+
+    def test_schedule(self):
+        """Each job runs as often as its smallest delta, starting once
+        that much time has passed since its last backup.
+        """
+        cmd = self.daemon([self.job(name='a', deltas='1h 1d'),
+                           self.job(name='b', deltas='1h 1d'),
+                           self.job(name='c', deltas=None)],
+                          [self.filename('1800s', name='b')], until=9000)
+        assert self.created(cmd) == ['a', 'b', 'a', 'b', 'a', 'b']
+        assert cmd.backend.calls.count(['--list-archives']) == 1
+
+    def test_refresh(self):
+        cmd = self.daemon([self.job(name='a', deltas='1h 1d')], [],
+                          until=9000, refresh_every=str_to_timedelta('1h'))
+        assert cmd.backend.calls.count(['--list-archives']) == 3
+
+    def test_reload(self):
+        filename = path.join(self._tmpdir, 'tarsnapper.conf')
+        with open(filename, 'w') as f:
+            f.write('target: $name-$date\ndeltas: 1h 1d\njobs:\n'
+                    '  a:\n    source: %s\n  c:\n    source: %s\n' % (
+                        self._tmpdir, self._tmpdir))
+        cmd = self.command_class(argparse.Namespace(
+            tarsnap_options=(), config=filename, jobs=[]), self.log,
+            backend_class=FakeBackend)
+        cmd.queue = JobQueue()
+        jobs = [self.job(name='a', deltas='1h 1d'),
+                self.job(name='b', deltas='1h 1d')]
+        cmd.backend.add_jobs(jobs)
+        cmd.schedule_jobs(jobs)
+        cmd.queue.push(jobs[0], 1234)
+
+        cmd.reload()
+        assert sorted(cmd.queue.names()) == ['a', 'c']
+        # The job kept its place, but the new definition is used
+        due, job = cmd.queue.pop_due(1234)[0]
+        assert job.name == 'a' and job is not jobs[0]
+        assert job in cmd.backend._jobs and jobs[0] not in cmd.backend._jobs
+
+    def test_reload_subset(self):
+        """Only the jobs given are scheduled, but all jobs of the config
+        are registered, so that archives are classified the same way.
+        """
+        filename = path.join(self._tmpdir, 'tarsnapper.conf')
+        with open(filename, 'w') as f:
+            f.write('target: $name-$date\ndeltas: 1h 1d\njobs:\n'
+                    '  a:\n    source: %s\n  c:\n    source: %s\n' % (
+                        self._tmpdir, self._tmpdir))
+        cmd = self.command_class(argparse.Namespace(
+            tarsnap_options=(), config=filename, jobs=['a']), self.log,
+            backend_class=FakeBackend)
+        cmd.queue = JobQueue()
+        cmd.reload()
+        assert cmd.queue.names() == ['a']
+        assert [j.name for j in cmd.backend._jobs] == ['a', 'c']
+
+
+class TestCheckpoint(BaseTest):
+
+    command_class = MakeCommand
+
+    def test_make(self):
+        """Partial archives are not expired, but deleted once a backup
+        has been made.
+        """
+        partial = self.filename('5d') + '.part'
+        archives = [self.filename('1d'), partial,
+                    self.filename('1d', name='other') + '.part']
+        cmd = self.run(self.job(checkpoint_bytes=10000000), archives)
+        assert cmd.backend.match([
+            ('-c', '--checkpoint-bytes', '10000000', '-f', 'test-.*', '.*'),
+            ('--list-archives',),
+            ('-d', '-f', re.escape(partial)),
+        ])
+        assert partial not in cmd.backend.get_backups(self.job())
+
+    def test_catalog(self):
+        partial = self.filename('5d') + '.part'
+        cmd = self.run(self.job(checkpoint_bytes=10000000),
+                       [self.filename('1d'), partial],
+                       archive_cache=self._tmpdir, catalog=True)
+        assert cmd.backend.match([
+            ('-c', '--checkpoint-bytes', '10000000', '-f', 'test-.*', '.*'),
+            ('--list-archives',),
+            ('-d', '-f', re.escape(partial)),
+        ])
+
+    def test_creation_time(self):
+        """Only the partial archives of the job made are deleted, not
+        those of other jobs, or foreign ones.
+        """
+        partial = self.filename('5d') + '.part'
+        archives = ['%s\t2010-01-01 00:00:00' % name for name in [
+            self.filename('1d'), partial, 'test-manual-keep.part',
+            self.filename('5d', name='test-dev') + '.part']]
+        test = self.job(checkpoint_bytes=10000000)
+        cmd = self.command_class(argparse.Namespace(
+            tarsnap_options=(), no_expire=True, creation_time=True),
+            self.log, backend_class=FakeBackend)
+        cmd.backend.fake_archives = archives
+        cmd.backend.add_jobs([test, self.job(name='test-dev')])
+        cmd.run(test)
+        assert cmd.backend.match([
+            ('-c', '--checkpoint-bytes', '10000000', '-f', 'test-.*', '.*'),
+            ('--list-archives', '-v'),
+            ('-d', '-f', re.escape(partial)),
+        ])
+
+    def test_shared_prefix(self):
+        """Partial archives of a job with a longer prefix, and foreign
+        ones, are not deleted.
+        """
+        home = self.job(name='home', checkpoint_bytes=10000000)
+        home_dev = self.job(name='home-dev')
+        partial = self.filename('5d', name='home') + '.part'
+        cmd = self.command_class(
+            argparse.Namespace(tarsnap_options=(), no_expire=True),
+            self.log, backend_class=FakeBackend)
+        cmd.backend.fake_archives = [
+            self.filename('1d', name='home'), partial,
+            self.filename('5d', name='home-dev') + '.part',
+            'home-manual-keep.part']
+        cmd.backend.add_jobs([home, home_dev])
+        cmd.run(home)
+        assert cmd.backend.match([
+            ('-c', '--checkpoint-bytes', '10000000', '-f', 'home-.*', '.*'),
+            ('--list-archives',),
+            ('-d', '-f', re.escape(partial)),
+        ])
+        index = cmd.backend._partial_index
+        cmd.backend.partial_archives(home_dev)
+        assert cmd.backend._partial_index is index
+
+    def test_no_checkpoints(self):
+        """Partial archives of jobs without checkpoints are never
+        expired, but deleted once a backup has been made.
+        """
+        partial = self.filename('20d') + '.part'
+        archives = [self.filename('1d'), self.filename('2d'), partial]
+        cmd = self.run(self.job(deltas='1d 2d'), archives)
+        assert cmd.backend.match([
+            ('-c', '-f', 'test-.*', '.*'),
+            ('--list-archives',),
+            ('-d', '-f', re.escape(partial)),
+        ])
+
+    def test_no_checkpoints_no_expire(self):
+        """For jobs without checkpoints, the list of archives is not
+        queried just to look for partial archives.
+        """
+        archives = [self.filename('1d'), self.filename('20d') + '.part']
+        cmd = self.run(self.job(), archives, no_expire=True)
+        assert cmd.backend.match([('-c', '-f', 'test-.*', '.*')])
+
+    def test_delete_failure(self):
+        """Failing to delete partial archives does not fail the job."""
+        partial = self.filename('5d') + '.part'
+        cmd = self.command_class(
+            argparse.Namespace(tarsnap_options=(), no_expire=True),
+            self.log, backend_class=FakeBackend)
+        cmd.backend.fake_archives = [self.filename('1d'), partial]
+        cmd.backend.fail_archives = [partial]
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        self.log.addHandler(handler)
+        try:
+            cmd.run(self.job(checkpoint_bytes=10000000))
+        finally:
+            self.log.removeHandler(handler)
+        assert [r.levelname for r in records
+                if r.levelno >= logging.WARNING] == ['WARNING']
+        assert cmd.backend.match([
+            ('-c', '--checkpoint-bytes', '10000000', '-f', 'test-.*', '.*'),
+            ('--list-archives',),
+            ('-d', '-f', re.escape(partial)),
+        ])
+
+
 class TestExpire(BaseTest):
 
     command_class = ExpireCommand
@@ -197,6 +530,78 @@ class TestExpire(BaseTest):
             ('-d', '-f', 'alias-.*'),
         ])
 
+    def test_batched_delete(self):
+        """Multiple archives are deleted with a single tarsnap call."""
+        cmd = self.run(self.job(deltas='1d 2d'), [
+            self.filename('1d'),
+            self.filename('5d'),
+            self.filename('6d'),
+            self.filename('7d'),
+        ], delete_batch_size=2)
+        assert cmd.backend.match([
+            ('--list-archives',),
+            ('-d', '-f', 'test-.*', '-f', 'test-.*'),
+            ('-d', '-f', 'test-.*'),
+        ])
+
+    def test_batched_delete_bytes(self):
+        """Batches are limited by the length of the archive names."""
+        cmd = self.run(self.job(deltas='1d 2d'), [
+            self.filename('1d'),
+            self.filename('5d'),
+            self.filename('6d'),
+        ], delete_batch_bytes=30)
+        assert cmd.backend.match([
+            ('--list-archives',),
+            ('-d', '-f', 'test-.*'),
+            ('-d', '-f', 'test-.*'),
+        ])
+
+    def test_batched_delete_failure(self):
+        """If a batch fails, its archives are deleted one by one, so
+        that the failing archive can be reported.
+        """
+        failing = self.filename('6d')
+        cmd = self.command_class(
+            argparse.Namespace(tarsnap_options=(), no_expire=False),
+            self.log, backend_class=FakeBackend)
+        cmd.backend.fake_archives = [
+            self.filename('1d'), self.filename('5d'), failing]
+        cmd.backend.fail_archives = [failing]
+        try:
+            cmd.run(self.job(deltas='1d 2d'))
+        except TarsnapError, e:
+            assert failing in str(e)
+        else:
+            assert False, 'TarsnapError not raised'
+        assert len(cmd.backend.calls[1]) == 5
+        assert cmd.backend.calls[-1] == ['-d', '-f', failing]
+
+    def test_batch_failing_partway(self):
+        """If a batch fails after deleting some of its archives, those
+        are not blamed when the batch is retried one by one.
+        """
+        names = [self.filename('4d'), self.filename('5d'),
+                 self.filename('6d')]
+        cmd = self.command_class(
+            argparse.Namespace(tarsnap_options=(), no_expire=False),
+            self.log, backend_class=FakeBackend)
+        cmd.backend.fake_archives = names
+        cmd.backend.fail_archives = [names[1]]
+        try:
+            cmd.backend.delete(names, job=self.job())
+        except TarsnapError, e:
+            assert str(e).startswith('Deleting %s failed' % names[1])
+        else:
+            assert False, 'TarsnapError not raised'
+        # The first archive was deleted by the batch, and is gone when
+        # retried
+        assert cmd.backend.deleted_archives == names[:1]
+        assert cmd.backend.calls == [
+            ['-d', '-f', names[0], '-f', names[1], '-f', names[2]],
+            ['-d', '-f', names[0]],
+            ['-d', '-f', names[1]]]
+
     def test_date_name_mismatch(self):
         """Make sure that when processing a target "home-$date",
         we won't stumble over "home-dev-$date". This can be an issue
@@ -206,6 +611,460 @@ class TestExpire(BaseTest):
             self.filename('1d', name="home-dev"),
         ])
 
+    def test_date_name_mismatch_dateformat(self):
+        """With a dateformat, "home-dev-$date" is not even considered
+        to be a candidate for the "home" job.
+        """
+        cmd = self.run(self.job(name="home", dateformat=DEFAULT_DATEFORMAT), [
+            self.filename('1d', name="home"),
+            self.filename('1d', name="home-dev"),
+        ])
+        assert cmd.backend.get_backups(cmd.backend._jobs[0]).keys() == [
+            self.filename('1d', name="home")]
+
+
+class TestArchiveCache(BaseTest):
+
+    command_class = ExpireCommand
+
+    def run_cached(self, archives, **args):
+        return self.run(self.job(deltas='1d 10d'), archives,
+                        archive_cache=self._tmpdir,
+                        archive_cache_ttl=str_to_timedelta('1h'), **args)
+
+    def test_cached(self):
+        """The list of archives is queried only once."""
+        archives = [self.filename('1d'), self.filename('5d')]
+        cmd = self.run_cached(archives)
+        assert cmd.backend.match([('--list-archives',)])
+        cmd = self.run_cached(archives)
+        assert cmd.backend.match([])
+
+    def test_refresh(self):
+        archives = [self.filename('1d'), self.filename('5d')]
+        self.run_cached(archives)
+        cmd = self.run_cached(archives, refresh=True)
+        assert cmd.backend.match([('--list-archives',)])
+
+    def test_verbose(self):
+        """A cache written by a run with ``-o v`` can be used by a run
+        without it.
+        """
+        archives = [self.filename('1d'), self.filename('5d')]
+        self.run_cached(['%s\t2016-01-01 00:00:00' % a for a in archives],
+                        tarsnap_options=[['v']])
+        cmd = self.run_cached([])
+        assert cmd.backend.match([])
+        assert sorted(cmd.backend.get_backups(self.job())) == sorted(archives)
+
+    def test_updated(self):
+        """New and deleted archives are reflected in the cache."""
+        self.command_class = MakeCommand
+        old = self.filename('20d')
+        cmd = self.run(self.job(deltas='1d 10d'), [old],
+                       archive_cache=self._tmpdir)
+        assert cmd.backend.match([
+            ('-c', '-f', 'test-.*', '.*'),
+            ('--list-archives',),
+            ('-d', '-f', old),
+        ])
+        archives = cmd.backend.archive_cache.load()
+        assert len(archives) == 1
+        assert archives[0].startswith('test-') and archives[0] != old
+
+
+class TestCatalog(BaseTest):
+
+    command_class = ExpireCommand
+
+    def run_catalog(self, archives, job=None, **args):
+        return self.run(job or self.job(deltas='1d 10d'), archives,
+                        archive_cache=self._tmpdir, catalog=True,
+                        archive_cache_ttl=str_to_timedelta('1h'), **args)
+
+    def test_cached(self):
+        """The catalog is used until it expires."""
+        archives = [self.filename('1d'), self.filename('5d'),
+                    self.filename('20d')]
+        cmd = self.run_catalog(archives)
+        assert cmd.backend.match([
+            ('--list-archives',), ('-d', '-f', self.filename('20d'))])
+        assert cmd.backend.archive_cache is None
+        cmd = self.run_catalog(archives)
+        assert cmd.backend.match([])
+        assert sorted(cmd.backend.get_backups(self.job())) == \
+            sorted(archives[:2])
+
+    def test_reconcile(self):
+        archives = [self.filename('1d'), self.filename('5d')]
+        self.run_catalog(archives)
+        cmd = self.run_catalog([self.filename('1d'), self.filename('2d')],
+                               refresh=True)
+        assert cmd.backend.match([('--list-archives',)])
+        assert sorted(cmd.backend.get_backups(self.job())) == \
+            sorted([self.filename('1d'), self.filename('2d')])
+
+    def test_creation_time(self):
+        """Archives without a date in the job's format are not backups
+        of the job.
+        """
+        old = '%s\t2010-01-01 00:00:00'
+        archives = [old % self.filename('1d'), old % 'test-manual-keep',
+                    old % self.filename('5d', name='test-dev')]
+        test = self.job(deltas='1d 10d')
+        cmd = self.command_class(argparse.Namespace(
+            tarsnap_options=(), no_expire=False, creation_time=True,
+            archive_cache=self._tmpdir, catalog=True,
+            archive_cache_ttl=str_to_timedelta('1h')),
+            self.log, backend_class=FakeBackend)
+        cmd.backend.fake_archives = archives
+        cmd.backend.add_jobs([test, self.job(name='test-dev')])
+        cmd.run(test)
+        assert cmd.backend.match([('--list-archives', '-v')])
+        assert cmd.backend.get_backups(test).keys() == [self.filename('1d')]
+
+    def test_classifier(self):
+        """The classifier is kept until the registered jobs change."""
+        cmd = self.run_catalog([self.filename('1d')], creation_time=True)
+        classifier = cmd.backend._catalog_classifier()
+        cmd.backend._add_known_archive(self.filename('0d'))
+        assert cmd.backend._catalog_classifier() is classifier
+        cmd.backend.add_jobs([self.job(name='other')])
+        assert cmd.backend._catalog_classifier() is not classifier
+
+    def test_job_changed(self):
+        """Changing a job classifies the archives again."""
+        archives = [self.filename('1d'), self.filename('5d'),
+                    self.filename('1d', name='old')]
+        self.run_catalog(archives)
+        job = self.job(deltas='1d 10d', aliases=['old'])
+        cmd = self.run_catalog(archives, job=job)
+        assert ('--list-archives',) not in map(tuple, cmd.backend.calls)
+        assert cmd.backend.match([('-d', '-f', '.*-%s' % (
+            self.now - str_to_timedelta('1d')).strftime(DEFAULT_DATEFORMAT))])
+
+    def test_make(self):
+        self.command_class = MakeCommand
+        cmd = self.run_catalog([self.filename('20d')])
+        assert cmd.backend.match([
+            ('-c', '-f', 'test-.*', '.*'),
+            ('--list-archives',),
+            ('-d', '-f', self.filename('20d')),
+        ])
+        backups = cmd.backend.catalog.backups('test')
+        assert len(backups) == 1
+        assert backups.keys()[0] != self.filename('20d')
+
+    def test_list(self):
+        self.command_class = ListCommand
+        archives = [self.filename('5d'), self.filename('1d'),
+                    self.filename('3d')]
+        cmd = self.run_catalog(archives)
+        assert [name for name, _ in cmd.backend.list_backups(self.job())] \
+            == [self.filename('1d'), self.filename('3d'), self.filename('5d')]
+
+
+class TestExpirySchedule(BaseTest):
+
+    command_class = ExpireCommand
+
+    def run_cached(self, archives, **args):
+        return self.run(self.job(deltas='1d 10d'), archives,
+                        archive_cache=self._tmpdir,
+                        archive_cache_ttl=str_to_timedelta('1d'), **args)
+
+    def test_skip(self):
+        """Once a job has been expired, the next run skips it, even
+        without a cached list of archives.
+        """
+        archives = [self.filename('1d'), self.filename('5d'),
+                    self.filename('20d')]
+        cmd = self.run_cached(archives)
+        assert cmd.backend.match([
+            ('--list-archives',), ('-d', '-f', self.filename('20d'))])
+        os.unlink(cmd.backend.archive_cache.filename)
+        cmd = self.run_cached(archives[:2])
+        assert cmd.backend.match([])
+
+        cmd = self.run_cached(archives[:2], refresh=True)
+        assert cmd.backend.match([('--list-archives',)])
+
+    def test_dryrun(self):
+        archives = [self.filename('1d'), self.filename('5d'),
+                    self.filename('20d')]
+        self.run_cached(archives, dryrun=True)
+        cmd = self.run_cached(archives)
+        assert cmd.backend.match([
+            ('--list-archives',), ('-d', '-f', self.filename('20d'))])
+
+    def test_make(self):
+        """Making a new backup requires the job to be expired again."""
+        archives = [self.filename('1d'), self.filename('5d')]
+        cmd = self.run_cached(archives)
+        os.unlink(cmd.backend.archive_cache.filename)
+        self.command_class = MakeCommand
+        cmd = self.run_cached(archives)
+        assert cmd.backend.match([
+            ('-c', '-f', 'test-.*', '.*'), ('--list-archives',)])
+        self.command_class = ExpireCommand
+        cmd = self.run_cached(archives)
+        assert cmd.backend.match([])
+
+
+class TestDeletionJournal(BaseTest):
+
+    command_class = ExpireCommand
+
+    def run_cached(self, archives, **args):
+        return self.run(self.job(deltas='1d 2d'), archives,
+                        archive_cache=self._tmpdir, delete_batch_size=1,
+                        **args)
+
+    def test_resume(self):
+        """An interrupted run is resumed without listing the archives
+        again.
+        """
+        archives = [self.filename('1d'), self.filename('5d'),
+                    self.filename('6d'), self.filename('7d')]
+        cmd = self.command_class(argparse.Namespace(
+            tarsnap_options=(), no_expire=False, archive_cache=self._tmpdir,
+            delete_batch_size=1), self.log, backend_class=FakeBackend)
+        cmd.backend.fake_archives = archives
+        cmd.backend.fail_archives = archives[2:3]
+        try:
+            cmd.run(self.job(deltas='1d 2d'))
+        except TarsnapError:
+            pass
+        else:
+            assert False, 'TarsnapError not raised'
+        # All but the last call succeeded
+        deleted = set(call[2] for call in cmd.backend.calls[1:-1])
+
+        cmd = self.run_cached([])
+        assert not ['--list-archives'] in cmd.backend.calls
+        assert set(call[2] for call in cmd.backend.calls) == \
+            set(archives[1:]) - deleted
+        assert not [f for f in os.listdir(self._tmpdir)
+                    if f.startswith('journal')]
+
+    def test_all_done(self):
+        """A run interrupted after all archives were deleted, but before
+        the journal was finished, does not keep the job from expiring.
+        """
+        job = self.job(deltas='1d 2d')
+        journal = self.command_class(argparse.Namespace(
+            tarsnap_options=(), archive_cache=self._tmpdir), self.log,
+            backend_class=FakeBackend).backend.deletion_journal
+        journal.start(job, [self.filename('5d')], False)
+        journal.done(job, [self.filename('5d')])
+
+        archives = [self.filename('1d'), self.filename('6d'),
+                    self.filename('7d')]
+        cmd = self.run_cached(archives)
+        assert cmd.backend.match([])
+        cmd = self.run_cached(archives)
+        assert cmd.backend.match([
+            ('--list-archives',), ('-d', '-f', 'test-.*'),
+            ('-d', '-f', 'test-.*')])
+
+    def test_missing_archive(self):
+        """An archive which no longer exists counts as deleted."""
+        archives = [self.filename('1d'), self.filename('5d'),
+                    self.filename('6d'), self.filename('7d')]
+        cmd = self.command_class(
+            argparse.Namespace(tarsnap_options=(), no_expire=False),
+            self.log, backend_class=FakeBackend)
+        cmd.backend.fake_archives = archives
+        cmd.backend.missing_archives = archives[2:3]
+        cmd.run(self.job(deltas='1d 2d'))
+        assert cmd.backend.match([
+            ('--list-archives',),
+            ('-d', '-f', 'test-.*', '-f', 'test-.*', '-f', 'test-.*'),
+            ('-d', '-f', 'test-.*'),
+            ('-d', '-f', 'test-.*'),
+            ('-d', '-f', 'test-.*'),
+        ])
+
+
+class TestMetrics(BaseTest):
+
+    command_class = MakeCommand
+
+    def test_make(self):
+        cmd = self.command_class(argparse.Namespace(
+            tarsnap_options=(), no_expire=False), self.log,
+            backend_class=FakeBackend)
+        cmd.backend.fake_archives = [
+            self.filename('1d'), self.filename('5d'), self.filename('6d')]
+        cmd.process([self.job(deltas='1d 2d', exec_before='true')])
+
+        metrics = cmd.backend.metrics
+        assert [k for k in metrics.calls] == [
+            ('test', 'hook', 0), ('test', 'create', 0), ('test', 'list', 0),
+            ('test', 'delete', 0)]
+        assert metrics.jobs['test']['archives'] == {
+            'matched': 4, 'kept': 2, 'deleted': 2}
+        assert set(metrics.jobs['test']['seconds']) == set([
+            'creating', 'listing', 'classifying', 'planning', 'deleting',
+            'total'])
+
+
+class TestStatsDatabase(BaseTest):
+
+    command_class = MakeCommand
+
+    def run_stats(self, **args):
+        return self.run(self.job(deltas='1d 2d'), [
+            self.filename('1d'), self.filename('5d'), self.filename('6d')],
+            stats_db=path.join(self._tmpdir, 'stats.db'), **args)
+
+    def test_make(self):
+        cmd = self.run_stats()
+        assert cmd.backend.match([
+            ('-c', '--print-stats', '-f', 'test-.*', '.*'),
+            ('--list-archives',),
+            ('-d', '--print-stats', '-f', 'test-.*', '-f', 'test-.*'),
+        ])
+        summary = cmd.backend.stats_db.job_summary(self.job())
+        assert summary['created'] == 1
+        assert summary['last_size'] == 5000
+        assert summary['deleted'] == 2
+        assert summary['reclaimed'] == 200
+        assert cmd.backend.stats_db.account()['unique_size'] == 2000
+
+    def test_command(self):
+        self.run_stats()
+        self.command_class = StatsCommand
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            cmd = self.command_class(argparse.Namespace(
+                tarsnap_options=(), since=None,
+                stats_db=path.join(self._tmpdir, 'stats.db')), self.log,
+                backend_class=FakeBackend)
+            cmd.process([self.job()])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        assert cmd.backend.match([])
+        assert 'backups deleted:    2, reclaiming 200 B' in output
+        assert 'unique data:        2.0 kB' in output
+
+
+class TestCreationTime(BaseTest):
+
+    command_class = ExpireCommand
+
+    def listing(self, name, delta):
+        created = self.now - str_to_timedelta(delta)
+        return '%s\t%s' % (name, created.strftime('%Y-%m-%d %H:%M:%S'))
+
+    def test_expire(self):
+        """Archives are expired based on their creation time, rather
+        than the date in their name.
+        """
+        cmd = self.run(self.job(deltas='1d 2d'), [
+            self.listing(self.filename('6d'), '1d'),
+            self.listing(self.filename('1d'), '5d'),
+            self.listing(self.filename('5d'), '6d'),
+        ], creation_time=True)
+        assert cmd.backend.match([
+            ('--list-archives', '-v'),
+            ('-d', '-f', '%s|%s' % (self.filename('1d'), self.filename('5d')),
+             '-f', '%s|%s' % (self.filename('1d'), self.filename('5d'))),
+        ])
+
+    def test_prefix_ambiguity(self):
+        """An archive belongs to the job with the longest matching
+        target prefix only, and must contain a date in the job's format.
+        """
+        test, test_dev = self.job(), self.job(name='test-dev')
+        cmd = self.run([test, test_dev], [
+            self.listing(self.filename('1d'), '1d'),
+            self.listing(self.filename('1d', name='test-dev'), '1d'),
+            self.listing('test-manual-keep', '1d'),
+        ], creation_time=True)
+        assert cmd.backend.get_backups(test).keys() == [self.filename('1d')]
+        assert cmd.backend.get_backups(test_dev).keys() == [
+            self.filename('1d', name='test-dev')]
+
+    def test_common_layouts(self):
+        """Without a dateformat, dates in common layouts are matched,
+        and a job matching no archives is pointed out.
+        """
+        test, other = self.job(), self.job(name='other')
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        self.log.addHandler(handler)
+        try:
+            cmd = self.run([test, other], [
+                self.listing('test-2010-01-02T00:00:00', '1d'),
+                self.listing('other-2010-01-02 00:00', '1d'),
+            ], creation_time=True)
+        finally:
+            self.log.removeHandler(handler)
+        assert cmd.backend.get_backups(test).keys() == [
+            'test-2010-01-02T00:00:00']
+        assert [r.getMessage() for r in records
+                if r.levelno == logging.WARNING] == [
+            "No archives match 'other'; with --creation-time, their names "
+            "need to contain a date in the job's dateformat, or a common "
+            "layout such as %Y-%m-%d"]
+
+    def test_subset(self):
+        """Expiring some of the jobs of the config file leaves the
+        archives of the other jobs, and foreign ones, alone.
+        """
+        archives = [
+            self.listing(self.filename('1d', name='home'), '1d'),
+            self.listing(self.filename('5d', name='home'), '5d'),
+            self.listing(self.filename('1d', name='home-dev'), '1d'),
+            self.listing(self.filename('5d', name='home-dev'), '5d'),
+            self.listing(self.filename('6d', name='home-dev'), '6d'),
+            self.listing('home-manual-keep', '6d'),
+        ]
+        backends = []
+
+        class Backend(FakeBackend):
+            def __init__(self, *a, **kw):
+                FakeBackend.__init__(self, *a, **kw)
+                self.fake_archives = archives
+                backends.append(self)
+
+        filename = path.join(self._tmpdir, 'tarsnapper.conf')
+        with open(filename, 'w') as f:
+            f.write('target: $name-$date\n'
+                    'deltas: 1d 2d\n'
+                    'jobs:\n'
+                    '  home:\n'
+                    '    source: %s\n'
+                    '  home-dev:\n'
+                    '    source: %s\n' % (self._tmpdir, self._tmpdir))
+        BACKENDS['fake'] = Backend
+        root = logging.getLogger()
+        handlers, level = list(root.handlers), root.level
+        try:
+            assert not main(['-q', '-c', filename, '--creation-time',
+                             '--backend', 'fake', 'expire', 'home'])
+        finally:
+            del BACKENDS['fake']
+            root.handlers[:], root.level = handlers, level
+        assert backends[0].match([
+            ('--list-archives', '-v'),
+            ('-d', '-f', self.filename('5d', name='home')),
+        ])
+
+    def test_cache(self):
+        """Creation times are stored in the archive cache."""
+        archives = [self.listing(self.filename('4d'), '1d'),
+                    self.listing(self.filename('3d'), '5d')]
+        cmd = self.run(self.job(deltas='1d 10d'), archives, creation_time=True,
+                       archive_cache=self._tmpdir)
+        cmd = self.run(self.job(deltas='1d 2d'), [], creation_time=True,
+                       archive_cache=self._tmpdir)
+        assert cmd.backend.match([('-d', '-f', self.filename('3d'))])
+        assert cmd.backend.archive_cache.load() == [archives[0]]
+
 
 class TestList(BaseTest):
 
@@ -222,4 +1081,44 @@ class TestList(BaseTest):
         # necessary.
         assert cmd.backend.match([
             ('--list-archives',)
-        ])
\ No newline at end of file
+        ])
+        # The list of archives is classified as it is read, rather
+        # than being kept around.
+        assert cmd.backend._queried_archives is None
+    def list(self, output_format):
+        archives = [self.filename('1d', name='foo'), self.filename('1d'),
+                    self.filename('5d'), self.filename('3d'),
+                    self.filename('20d', name='other')]
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            cmd = self.command_class(argparse.Namespace(
+                tarsnap_options=(), format=output_format), self.log,
+                backend_class=FakeBackend)
+            cmd.backend.fake_archives = archives
+            jobs = [self.job(name='foo', deltas=None),
+                    self.job(deltas='1d 2d')]
+            cmd.backend.add_jobs(jobs)
+            cmd.process(jobs)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        # A single scan of the archives, for both jobs
+        assert cmd.backend.match([('--list-archives',)])
+        return output.splitlines()
+
+    def test_jsonl(self):
+        lines = [json.loads(l) for l in self.list('jsonl')]
+        assert [(l['job'], l['archive'], l['verdict']) for l in lines] == [
+            ('foo', self.filename('1d', name='foo'), 'keep'),
+            ('test', self.filename('5d'), 'delete'),
+            ('test', self.filename('3d'), 'keep'),
+            ('test', self.filename('1d'), 'keep'),
+        ]
+        assert lines[0]['timestamp'] == (self.now - str_to_timedelta(
+            '1d')).replace(microsecond=0).isoformat()
+
+    def test_tsv(self):
+        lines = self.list('tsv')
+        assert lines[1].split('\t') == [
+            'test', self.filename('5d'), (self.now - str_to_timedelta(
+                '5d')).replace(microsecond=0).isoformat(), 'delete']
@@ -0,0 +1,53 @@
+from os import path
+import os
+import time
+import shutil
+import tempfile
+import threading
+from tarsnapper import sources
+from tarsnapper.sources import check_sources, is_empty_dir, MISSING, EMPTY, \
+    TIMEOUT
+
+
+class TestCheckSources(object):
+
+    def setup(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.full = path.join(self._tmpdir, 'full')
+        self.empty = path.join(self._tmpdir, 'empty')
+        os.mkdir(self.full)
+        os.mkdir(self.empty)
+        open(path.join(self.full, 'file'), 'w').close()
+
+    def teardown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_is_empty_dir(self):
+        assert is_empty_dir(self.empty)
+        assert not is_empty_dir(self.full)
+
+    def test_problems(self):
+        missing = path.join(self._tmpdir, 'missing')
+        assert check_sources([self.full, path.join(self.full, 'file')]) == []
+        assert check_sources([self.full, self.empty, missing], 5) == [
+            (self.empty, EMPTY), (missing, MISSING)]
+
+    def test_timeout(self):
+        """A source that does not respond does not block the others."""
+        release = threading.Event()
+        check_source = sources.check_source
+
+        def hanging_check(source):
+            if source == self.empty:
+                release.wait()
+            return check_source(source)
+
+        sources.check_source = hanging_check
+        try:
+            start = time.time()
+            assert check_sources([self.full, self.empty], 0.2) == [
+                (self.empty, TIMEOUT)]
+            assert time.time() - start < 5
+        finally:
+            sources.check_source = check_source
+            release.set()
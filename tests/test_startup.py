@@ -0,0 +1,60 @@
+"""Make sure tarsnapper starts up quickly, by not importing any heavy
+modules until they are needed.
+"""
+
+import sys
+import json
+from os import path
+import subprocess
+import tarsnapper
+
+
+# Modules only needed when actually running tarsnap or a hook, or when
+# reading a config file or parsing an unusual date.
+HEAVY_MODULES = ('pexpect', 'yaml', 'dateutil', 'subprocess', 'urllib2',
+                 'uuid', 'getpass', 'sqlite3', 'json')
+
+# How long importing tarsnapper.script may take, in seconds. Far more
+# than it currently does, to allow for slow test machines.
+IMPORT_BUDGET = 0.25
+
+
+SCRIPT = """
+import sys, time
+start = time.time()
+import tarsnapper.script
+imported = time.time() - start
+try:
+    tarsnapper.script.main(%r)
+except SystemExit:
+    pass
+modules = sorted(m for m in sys.modules if sys.modules[m])
+import json
+sys.stdout.write('\\n' + json.dumps({
+    'seconds': imported, 'modules': modules}))
+"""
+
+
+def run(argv):
+    """Run tarsnapper with ``argv`` in a new interpreter, and return
+    the time importing it took, and the modules loaded.
+    """
+    src = path.dirname(path.dirname(path.abspath(tarsnapper.__file__)))
+    process = subprocess.Popen(
+        [sys.executable, '-c', SCRIPT % (argv,)], cwd=src,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, _ = process.communicate()
+    result = json.loads(stdout.splitlines()[-1])
+    heavy = [m for m in result['modules'] if m.split('.')[0] in HEAVY_MODULES]
+    return result['seconds'], heavy
+
+
+def test_help():
+    seconds, heavy = run(['--help'])
+    assert not heavy, heavy
+    assert seconds < IMPORT_BUDGET, seconds
+
+
+def test_argument_error():
+    seconds, heavy = run(['make'])
+    assert not heavy, heavy
@@ -0,0 +1,108 @@
+from os import path
+import shutil
+import tempfile
+import time
+from tarsnapper.config import Job
+from tarsnapper.stats import (
+    parse_print_stats, format_bytes, EstimateCache, StatsDatabase)
+
+
+OUTPUT = """\
+                                       Total size  Compressed size
+All archives                               104983            47239
+  (unique data)                             76907            32614
+This archive                                 2580             1199
+New data                                     2580             1199
+"""
+
+
+def test_parse_print_stats():
+    assert parse_print_stats(OUTPUT) == {
+        'all': (104983, 47239),
+        'unique': (76907, 32614),
+        'archive': (2580, 1199),
+        'new': (2580, 1199),
+    }
+
+
+def test_parse_print_stats_other_output():
+    output = "tarsnap: Removing leading '/' from member names\n" + \
+        OUTPUT.replace('New data', 'Deleted data')
+    stats = parse_print_stats(output)
+    assert stats['deleted'] == (2580, 1199)
+    assert 'new' not in stats
+    assert parse_print_stats('') == {}
+
+
+class TestEstimateCache(object):
+
+    def setup(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.filename = path.join(self._tmpdir, 'estimates')
+
+    def teardown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_persist(self):
+        EstimateCache(self.filename).set(Job(name='home'), 1000)
+        estimates = EstimateCache(self.filename)
+        assert estimates.get(Job(name='home')) == 1000
+        assert estimates.get(Job(name='other')) is None
+
+    def test_max_age(self):
+        EstimateCache(self.filename).set(Job(name='home'), 1000)
+        estimates = EstimateCache(self.filename, max_age=60)
+        estimates._load()['home']['time'] = time.time() - 120
+        assert estimates.get(Job(name='home')) is None
+
+    def test_memory(self):
+        estimates = EstimateCache()
+        estimates.set(Job(name='home'), 1000)
+        assert estimates.get(Job(name='home')) == 1000
+
+    def test_invalid(self):
+        with open(self.filename, 'w') as f:
+            f.write('{')
+        assert EstimateCache(self.filename).get(Job(name='home')) is None
+
+
+def test_parse_print_stats_deleted():
+    """Deleting several archives prints the statistics for each."""
+    stats = parse_print_stats(
+        OUTPUT.replace('New data', 'Deleted data') * 2)
+    assert stats['deleted'] == (5160, 2398)
+    assert stats['all'] == (104983, 47239)
+
+
+def test_format_bytes():
+    assert format_bytes(999) == '999 B'
+    assert format_bytes(1500) == '1.5 kB'
+    assert format_bytes(2 * 10 ** 15) == '2000.0 TB'
+
+
+class TestStatsDatabase(object):
+
+    def setup(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.filename = path.join(self._tmpdir, 'stats.db')
+
+    def teardown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_summary(self):
+        db = StatsDatabase(self.filename)
+        home = Job(name='home')
+        db.record_created(home, 'home-1', parse_print_stats(OUTPUT))
+        db.record_created(home, 'home-2', {'archive': (3000, 1500),
+                                           'new': (100, 50)})
+        db.record_deleted(home, ['home-1'], {'deleted': (2000, 900)})
+        db.close()
+
+        db = StatsDatabase(self.filename)
+        assert db.job_summary(home) == {
+            'created': 2, 'uploaded': 1249,
+            'last_size': 3000, 'last_compressed_size': 1500,
+            'deleted': 1, 'reclaimed': 900}
+        assert db.job_summary(home, since=time.time() + 60)['created'] == 0
+        assert db.job_summary(Job(name='other'))['last_size'] is None
+        assert db.account()['unique_compressed_size'] == 32614